@@ -0,0 +1,313 @@
+"""
+Benchmarks of the data hot paths of task_template, on synthetic data.
+
+Measured paths: the Tobii callback (on_gaze_data), the per-record and vectorized converters
+(convert_tobii_record, convert_tobii_records, interpolate_gaze_data, CoordinateTransform), the gaze data export
+(flush_data, tsv and npy) and the trial CSV writer (update_csv). Exports are measured for every combination of
+recording duration, sampling rate and number of events, with their throughput and peak memory (tracemalloc).
+The jitter of a render loop is measured without eye tracker, with the gaze callback in this process, and with the
+acquisition process (acquisition_process). Waiting for response pad presses (SimulatedResponsePad) is measured with
+the busy polling loop of the original get_response and with the input thread (ResponsePadInput): CPU usage while
+waiting, and latency from the press to its return.
+
+Results are saved as JSON. With --baseline, the run fails (exit status 1) if a metric is worse than the baseline by
+more than --tolerance, or worse than a limit of --budgets (a JSON file of metric: limit).
+
+Example::
+
+    python benchmark.py --durations 1 --output baseline.json
+    python benchmark.py --durations 1 --baseline baseline.json --tolerance 0.2
+"""
+import argparse
+import io
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import task_template
+from task_template import (TaskTemplate, GazeBuffer, CsvWriter, ResponsePadInput, SimulatedEyeTracker,
+                           SimulatedResponsePad, SimulatedWindow, gaze_dtype)
+
+higher_is_better = ('per_s',)
+"Suffixes of metrics where a higher value is better. Others are costs (time, memory)."
+
+
+def make_records(n, rate, seed=0):
+    """
+    Make <n> synthetic gaze records sampled at <rate> Hz: fixations on random points with noise, blinks, and single
+    eye dropouts.
+
+    :return: structured array (see <gaze_dtype>).
+    """
+    random = np.random.RandomState(seed)
+    records = np.zeros(n, dtype=gaze_dtype)
+    records['t'] = 10 ** 12 + np.round(np.arange(n) * 1e6 / rate).astype(np.int64)
+    fixations = np.cumsum(random.uniform(0.15, 0.45, n // int(rate * 0.15) + 2) * rate).astype(np.int64)
+    points = random.uniform(0.1, 0.9, (len(fixations) + 1, 2))[np.searchsorted(fixations, np.arange(n), 'right')]
+    blinks = random.uniform(size=n) < 0.3 / rate * 30
+    blink = np.convolve(blinks, np.ones(int(rate * 0.15)), 'same') > 0
+    for eye, offset in (('l', -0.005), ('r', 0.005)):
+        valid = ~blink & (random.uniform(size=n) >= 0.01)
+        records[eye + 'v'] = valid
+        records[eye + 'x'] = np.where(valid, points[:, 0] + offset + random.normal(0, 0.003, n), np.nan)
+        records[eye + 'y'] = np.where(valid, points[:, 1] + random.normal(0, 0.003, n), np.nan)
+        records[eye + 'p'] = np.where(valid, random.uniform(3, 4), np.nan)
+    return records
+
+
+def make_task(units='height'):
+    """
+    Make a TaskTemplate with a headless window, without running its initialization (no hardware, no dialog).
+    """
+    task = TaskTemplate.__new__(TaskTemplate)
+    task.win = SimulatedWindow(units=units)
+    task.tobii_research = task_template.simulated_tobii_research
+    task.shift = 0.0
+    task.gaze_data = GazeBuffer(task.gaze_buffer_chunk_size)
+    task.event_data = []
+    task.recording = False
+    task.datafile = None
+    return task
+
+
+def best_time(function, repeat=3):
+    """
+    Best wall time of <repeat> calls of <function>, in seconds.
+    """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def bench_callback(rate, results):
+    # one minute of samples, with the attributes of tobii_research.GazeData
+    tracker = SimulatedEyeTracker(rate, seed=0)
+    samples = [next(tracker.samples) for i in range(int(rate * 60))]
+    for i, sample in enumerate(samples):
+        sample.system_time_stamp = 10 ** 12 + int(i * 1e6 / rate)
+
+    def run():
+        task = make_task()
+        for sample in samples:
+            task.on_gaze_data(sample)
+
+    results['callback_us/{}Hz'.format(rate)] = best_time(run) / len(samples) * 1e6
+
+
+def bench_converters(results):
+    task = make_task()
+    records = make_records(100000, 1200)
+    task.gaze_data.extend(records)
+    tuples = [task.gaze_data[i] for i in range(10000)]
+    start_time = int(records['t'][0])
+
+    def per_record():
+        for record in tuples:
+            task.convert_tobii_record(record, start_time)
+
+    def interpolate():
+        for record1, record2 in zip(tuples[:-1], tuples[1:]):
+            task.interpolate_gaze_data(record1, record2, (record1[0] + record2[0]) // 2)
+
+    def single_point():
+        for record in tuples:
+            task.get_psychopy_pos(record[1:3])
+
+    results['convert_tobii_record_us'] = best_time(per_record) / len(tuples) * 1e6
+    results['interpolate_gaze_data_us'] = best_time(interpolate) / (len(tuples) - 1) * 1e6
+    results['get_psychopy_pos_us'] = best_time(single_point) / len(tuples) * 1e6
+    results['convert_tobii_records_per_s'] = len(records) / best_time(
+        lambda: task.convert_tobii_records(records, start_time))
+    for units in ('norm', 'height', 'pix', 'cm', 'deg', 'degFlat'):
+        transform = task_template.CoordinateTransform.from_window(SimulatedWindow(units=units))
+        results['transform_{}_per_s'.format(units)] = len(records) / best_time(
+            lambda: transform.to_psychopy_xy(records['lx'], records['ly']))
+
+
+def bench_export(duration, rate, n_events, datafile_format, folder, memory, results):
+    records = make_records(int(duration * 60 * rate), rate)
+    task = make_task()
+    task.gaze_data.extend(records)
+    random = np.random.RandomState(1)
+    event_times = np.sort(random.randint(records['t'][0], records['t'][-1], n_events))
+    task.event_data = [(int(t), 'event {}'.format(k)) for k, t in enumerate(event_times)]
+    filename = os.path.join(folder, 'gaze.' + datafile_format)
+
+    def run():
+        task.open_datafile(filename, embed_events=datafile_format == 'tsv', datafile_format=datafile_format)
+        task.close_datafile()
+
+    name = '{}min/{}Hz/{}events/{}'.format(duration, rate, n_events, datafile_format)
+    results['export_per_s/' + name] = len(records) / best_time(run, 1)
+    if memory:
+        tracemalloc.start()
+        run()
+        results['export_peak_bytes/' + name] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+
+def bench_csv(folder, results):
+    writer = CsvWriter(os.path.join(folder, 'trials.csv'), ['trial', 'response', 'rt', 'correct'], fsync=None)
+    n = 100000
+    start = time.perf_counter()
+    for i in range(n):
+        writer.write_row([i, 'yes', 0.4567, True])
+    results['update_csv_us'] = (time.perf_counter() - start) / n * 1e6
+    writer.close()
+
+
+def bench_jitter(rate, seconds, results):
+    # a 60 Hz render loop doing the same work every frame: the spread of the work time is the jitter caused by
+    # the gaze callback holding the GIL
+    def render_loop():
+        durations = []
+        next_frame = time.perf_counter()
+        while len(durations) < seconds * 60:
+            start = time.perf_counter()
+            sum(i * i for i in range(20000))
+            durations.append(time.perf_counter() - start)
+            next_frame += 1 / 60.0
+            time.sleep(max(0.0, next_frame - time.perf_counter()))
+        return np.array(durations) * 1000.0
+
+    def record(mode, durations):
+        name = '{}/{}Hz'.format(mode, rate)
+        results['frame_work_median_ms/' + name] = float(np.median(durations))
+        results['frame_work_p99_ms/' + name] = float(np.percentile(durations, 99))
+        results['frame_work_max_ms/' + name] = float(durations.max())
+
+    record('no_tracker', render_loop())
+    for mode in ('in_process', 'acquisition_process'):
+        task = make_task()
+        task.time_stamp_shift = time.time()
+        task.eyetracker = SimulatedEyeTracker(rate, seed=0)
+        # samples are generated in advance, as the Tobii SDK builds them outside of Python
+        task.eyetracker.samples = itertools.cycle([next(task.eyetracker.samples) for i in range(rate)])
+        task.acquisition_process = mode == 'acquisition_process'
+        task.subscribe()
+        try:
+            record(mode, render_loop())
+        finally:
+            task.unsubscribe()
+
+
+def bench_response_pad(n_responses, results):
+    # the busy loop of the original get_response, and the input thread it was replaced with
+    def polling(pad):
+        while True:
+            while not pad.has_response():
+                pad.poll_for_response()
+            yield pad.get_next_response()
+
+    def input_thread(pad):
+        pad_input = ResponsePadInput(pad)
+        pad_input.start()
+        try:
+            while True:
+                yield pad_input.get()[0]
+        finally:
+            pad_input.stop()
+
+    for wait in (polling, input_thread):
+        pad = SimulatedResponsePad(['6'], reaction_time=(0.05, 0.15), seed=0)
+        responses = wait(pad)
+        latencies = []
+        start, cpu_start = time.perf_counter(), time.process_time()
+        for response in itertools.islice(responses, n_responses):
+            # presses are timed by the pad in milliseconds since its timer was reset, as on Cedrus pads
+            latencies.append(time.time() - (pad.timer_start + response['time'] / 1000.0))
+        cpu = (time.process_time() - cpu_start) / (time.perf_counter() - start)
+        responses.close()
+        latencies = np.array(latencies) * 1000.0
+        results['pad_cpu_percent/' + wait.__name__] = cpu * 100.0
+        results['pad_latency_mean_ms/' + wait.__name__] = float(latencies.mean())
+        results['pad_latency_max_ms/' + wait.__name__] = float(latencies.max())
+
+
+def compare(results, reference, tolerance=0.0):
+    """
+    Get the metrics of <results> which are worse than <reference> by more than <tolerance> (relative).
+
+    :return: list of (metric, value, reference value).
+    """
+    regressions = []
+    for name, value in sorted(results.items()):
+        if name not in reference:
+            continue
+        limit = reference[name]
+        if name.split('/')[0].endswith(higher_is_better):
+            worse = value < limit / (1 + tolerance)
+        else:
+            worse = value > limit * (1 + tolerance)
+        if worse:
+            regressions.append((name, value, limit))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--durations', type=float, nargs='+', default=[1, 10, 60],
+                        help='recording durations of the exports, in minutes')
+    parser.add_argument('--rates', type=int, nargs='+', default=[600, 1200], help='sampling rates, in Hz')
+    parser.add_argument('--events', type=int, nargs='+', default=[0, 10000], help='numbers of events')
+    parser.add_argument('--formats', nargs='+', default=['tsv', 'npy'], help='data file formats')
+    parser.add_argument('--no-memory', action='store_true', help='do not measure peak memory of exports')
+    parser.add_argument('--jitter-seconds', type=float, default=5,
+                        help='duration of each render loop of the jitter comparison, 0 to skip it. Default is 5')
+    parser.add_argument('--pad-responses', type=int, default=20,
+                        help='number of response pad presses of the input comparison, 0 to skip it. Default is 20')
+    parser.add_argument('--output', default='benchmark.json', help='JSON file of the results')
+    parser.add_argument('--baseline', help='JSON file of reference results')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='relative regression allowed against the baseline. Default is 0.2')
+    parser.add_argument('--budgets', help='JSON file of absolute limits by metric')
+    args = parser.parse_args(argv)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        for rate in args.rates:
+            bench_callback(rate, results)
+        bench_converters(results)
+        bench_csv(folder, results)
+        if args.jitter_seconds > 0:
+            for rate in args.rates:
+                bench_jitter(rate, args.jitter_seconds, results)
+        if args.pad_responses > 0:
+            bench_response_pad(args.pad_responses, results)
+        for duration in args.durations:
+            for rate in args.rates:
+                for n_events in args.events:
+                    for datafile_format in args.formats:
+                        bench_export(int(duration) if duration == int(duration) else duration, rate, n_events,
+                                     datafile_format, folder, not args.no_memory, results)
+
+    for name, value in sorted(results.items()):
+        print('{:<50} {:>16.3f}'.format(name, value))
+    with open(args.output, 'w') as f:
+        json.dump({'python': platform.python_version(), 'numpy': np.__version__, 'platform': platform.platform(),
+                   'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'results': results}, f, indent=2)
+
+    regressions = []
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            regressions += compare(results, json.load(f)['results'], args.tolerance)
+    if args.budgets is not None:
+        with open(args.budgets) as f:
+            regressions += compare(results, json.load(f))
+    for name, value, limit in regressions:
+        print('REGRESSION {}: {:.3f} (limit {:.3f})'.format(name, value, limit))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,75 +1,3132 @@
 import os
 import sys
+import io
+import random
+import importlib
 
-import pyxid2
-import tobii_research
-from psychopy import visual, gui, data, event, core
-from psychopy.visual.shape import BaseShapeStim
-import tobii_research as tr
 import time
-from screeninfo import get_monitors
-from PIL import Image, ImageDraw
-from psychopy.tools.monitorunittools import deg2cm, deg2pix, pix2cm, cm2pix
-from psychopy import monitors
 import numpy as np
 import types
 import datetime
 import time
 import warnings
+import threading
+import json
+import math
+import bisect
+import queue
+import atexit
+import collections
+import hashlib
+import concurrent.futures
+import multiprocessing
+import functools
+import csv
+
+import_times = {}
+"Import time of the lazily imported modules in seconds, by module name (see LazyModule)"
+
+
+class LazyModule:
+    """
+    Module imported at the first access to one of its attributes.
+
+    The SDKs (PsychoPy, Tobii, Cedrus, PIL, screeninfo) take seconds to import, and most of them are only needed by
+    some features: with lazy modules, importing task_template is immediate, and the Tobii and Cedrus SDKs are never
+    imported by tasks without eye tracker or response pad. After the import, every attribute is looked up in the
+    module, and attributes set on the LazyModule are set on the module, so that patches and submodules added later
+    are seen by all the users of the module.
+    """
+
+    def __init__(self, name):
+        """
+        :param str name: Full name of the module, e.g. 'psychopy.visual'.
+        """
+        self.__dict__['__name__'] = name
+        self.__dict__['_module'] = None
+
+    def __getattr__(self, attribute):
+        return getattr(import_lazy_module(self), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(import_lazy_module(self), attribute, value)
+
+    def __delattr__(self, attribute):
+        delattr(import_lazy_module(self), attribute)
+
+
+def import_lazy_module(lazy_module):
+    """
+    Get the module of a <LazyModule>, importing it at the first call.
+    Usually, users don't have to call this function.
+    """
+    module = lazy_module.__dict__['_module']
+    if module is None:
+        name = lazy_module.__dict__['__name__']
+        module = sys.modules.get(name)
+        if module is None:
+            start = time.perf_counter()
+            module = importlib.import_module(name)
+            import_times[name] = time.perf_counter() - start
+        lazy_module.__dict__['_module'] = module
+    return module
+
+
+pyxid2 = LazyModule('pyxid2')
+tobii_research = LazyModule('tobii_research')
+visual = LazyModule('psychopy.visual')
+gui = LazyModule('psychopy.gui')
+data = LazyModule('psychopy.data')
+event = LazyModule('psychopy.event')
+core = LazyModule('psychopy.core')
+monitors = LazyModule('psychopy.monitors')
+screeninfo = LazyModule('screeninfo')
+Image = LazyModule('PIL.Image')
+ImageDraw = LazyModule('PIL.ImageDraw')
+shared_memory = LazyModule('multiprocessing.shared_memory')
+
+
+def get_monotonic_time_stamp():
+    """
+    Time of the monotonic clock of the computer in microseconds, like tobii_research.get_system_time_stamp but
+    without importing the Tobii SDK.
+    """
+    return int(time.monotonic() * 1e6)
+
+
+def cm2deg(cm, monitor, correctFlat=False):
+    """
+    Bug-fixed version of psychopy.tools.monitorunittools.cm2deg
+    (PsychoPy version<=1.85.1).
+    """
+
+    if not isinstance(monitor, monitors.Monitor):
+        msg = ("cm2deg requires a monitors.Monitor object as the second "
+               "argument but received %s")
+        raise ValueError(msg % str(type(monitor)))
+    dist = monitor.getDistance()
+    if dist is None:
+        msg = "Monitor %s has no known distance (SEE MONITOR CENTER)"
+        raise ValueError(msg % monitor.name)
+    if correctFlat:
+        return np.degrees(np.arctan(cm / dist))
+    else:
+        return cm / (dist * 0.017455)
+
+
+def pix2deg(pixels, monitor, correctFlat=False):
+    """
+    Bug-fixed version of psychopy.tools.monitorunittools.pix2deg
+    (PsychoPy version<=1.85.1).
+    """
+
+    scrWidthCm = monitor.getWidth()
+    scrSizePix = monitor.getSizePix()
+    if scrSizePix is None:
+        msg = "Monitor %s has no known size in pixels (SEE MONITOR CENTER)"
+        raise ValueError(msg % monitor.name)
+    if scrWidthCm is None:
+        msg = "Monitor %s has no known width in cm (SEE MONITOR CENTER)"
+        raise ValueError(msg % monitor.name)
+    cmSize = pixels * float(scrWidthCm) / scrSizePix[0]
+    return cm2deg(cmSize, monitor, correctFlat)
+
+
+default_calibration_target_dot_size = {
+    'pix': 2.0, 'norm': 0.004, 'height': 0.002, 'cm': 0.05,
+    'deg': 0.05, 'degFlat': 0.05, 'degFlatPos': 0.05
+}
+default_calibration_target_disc_size = {
+    'pix': 2.0 * 20, 'norm': 0.004 * 20, 'height': 0.002 * 20, 'cm': 0.05 * 20,
+    'deg': 0.05 * 20, 'degFlat': 0.05 * 20, 'degFlatPos': 0.05 * 20
+}
+
+default_key_index_dict = {
+    '1': 0, 'num_1': 0, '2': 1, 'num_2': 1, '3': 2, 'num_3': 2,
+    '4': 3, 'num_4': 3, '5': 4, 'num_5': 4, '6': 5, 'num_6': 5,
+    '7': 6, 'num_7': 6, '8': 7, 'num_8': 7, '9': 8, 'num_9': 8
+}
+
+gaze_record_format = '%.1f\t%.4f\t%.4f\t%.4f\t%d\t%.4f\t%.4f\t%.4f\t%d\t%.4f\t%.4f'
+"""Format of one gaze record in the tsv data file."""
+
+gaze_dtype = np.dtype([
+    ('t', np.int64), ('lx', np.float64), ('ly', np.float64), ('lp', np.float64), ('lv', np.int8),
+    ('rx', np.float64), ('ry', np.float64), ('rp', np.float64), ('rv', np.int8)
+])
+"""Layout of one gaze sample: (t, lx, ly, lp, lv, rx, ry, rp, rv), 58 bytes per sample."""
+
+
+class GazeBuffer:
+    """
+    Compact store for Tobii gaze samples.
+
+    Samples are written into preallocated NumPy chunks of <chunk_size> records, so recording a long session does not
+    create one Python tuple per sample. Indexing returns a plain tuple, so code written for the former list of tuples
+    (``gaze_data[-1][1:3]``, ``len(gaze_data)``...) keeps working.
+    Chunks which have been written to disk can be released (see :func:`release`) to keep memory flat.
+    """
+
+    def __init__(self, chunk_size=2 ** 16):
+        """
+        :param int chunk_size: Number of samples allocated at once. Default is 65536 (about 1 minute at 1200 Hz).
+        """
+        self.chunk_size = chunk_size
+        self._chunk = np.empty(chunk_size, dtype=gaze_dtype)
+        # chunks are keyed by their number, so that the writer thread can release old chunks while the
+        # callback thread adds new ones
+        self._chunks = {0: self._chunk}
+        self._chunk_number = 0
+        self._pos = 0
+        self._count = 0
+        self.released = 0
+        """Number of samples released from memory (they can not be read anymore)."""
+
+    def append(self, record):
+        """
+        Add a sample at the end of the buffer. Called from the Tobii callback thread.
+
+        :param record: tuple (t, lx, ly, lp, lv, rx, ry, rp, rv).
+        """
+        if self._pos == self.chunk_size:
+            self._chunk = np.empty(self.chunk_size, dtype=gaze_dtype)
+            self._chunk_number += 1
+            self._chunks[self._chunk_number] = self._chunk
+            self._pos = 0
+        self._chunk[self._pos] = record
+        self._pos += 1
+        # the counter is updated last, so readers never see a sample that is not fully written
+        self._count += 1
+
+    def extend(self, records):
+        """
+        Add samples at the end of the buffer, e.g. to replay a recording.
+
+        :param records: structured array of gaze records (see <gaze_dtype>).
+        """
+        done = 0
+        while done < len(records):
+            if self._pos == self.chunk_size:
+                self._chunk = np.empty(self.chunk_size, dtype=gaze_dtype)
+                self._chunk_number += 1
+                self._chunks[self._chunk_number] = self._chunk
+                self._pos = 0
+            n = min(self.chunk_size - self._pos, len(records) - done)
+            self._chunk[self._pos:self._pos + n] = records[done:done + n]
+            self._pos += n
+            self._count += n
+            done += n
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        count = self._count
+        if index < 0:
+            index += count
+        if not self.released <= index < count:
+            raise IndexError('gaze buffer index out of range')
+        # the chunk may have been released since the check
+        chunk = self._chunks.get(index // self.chunk_size)
+        if chunk is None:
+            raise IndexError('gaze samples before {} have been released'.format(self.released))
+        return chunk[index % self.chunk_size].item()
+
+    def __iter__(self):
+        for i in range(self.released, self._count):
+            yield self[i]
+
+    def read(self, start, stop):
+        """
+        Return a copy of samples <start> to <stop> as a structured array (see <gaze_dtype>).
+
+        :param int start: Index of the first sample. Must not have been released.
+        :param int stop: Index after the last sample.
+        """
+        if start < self.released:
+            raise IndexError('gaze samples before {} have been released'.format(self.released))
+        stop = min(stop, self._count)
+        if stop <= start:
+            return np.empty(0, dtype=gaze_dtype)
+        parts = []
+        for number in range(start // self.chunk_size, (stop - 1) // self.chunk_size + 1):
+            offset = number * self.chunk_size
+            # the chunk may have been released since the check
+            chunk = self._chunks.get(number)
+            if chunk is None:
+                raise IndexError('gaze samples before {} have been released'.format(self.released))
+            parts.append(chunk[max(start - offset, 0):stop - offset])
+        return np.concatenate(parts)
+
+    def to_array(self):
+        """
+        Return all the samples still in memory as one contiguous structured array (see <gaze_dtype>).
+        """
+        return self.read(self.released, self._count)
+
+    def release(self, stop):
+        """
+        Free the chunks holding only samples before <stop>. The chunk holding the latest sample is always kept.
+
+        :param int stop: Index after the last sample which can be released.
+        """
+        last = min(stop, self._count - 1) // self.chunk_size
+        first = self.released // self.chunk_size
+        # readers check <released> before looking chunks up, so it is advanced before the chunks are deleted
+        self.released = max(self.released, last * self.chunk_size)
+        for number in range(first, last):
+            self._chunks.pop(number, None)
+
+    def nbytes(self):
+        """Memory allocated by the buffer, in bytes."""
+        return len(self._chunks) * self.chunk_size * gaze_dtype.itemsize
+
+
+class CoordinateTransform:
+    """
+    Conversion of positions between Tobii's display area coordinates and the PsychoPy coordinate system of a window.
+
+    Window size and monitor geometry are read once, and the conversion functions for the units are chosen once, so
+    that converting is only a few arithmetic operations. Positions can be single points or arrays of points.
+    """
+
+    def __init__(self, units, size, monitor_width=None, monitor_size_pix=None, monitor_distance=None,
+                 monitor_name=''):
+        """
+        :param str units: Units of the window.
+        :param size: Size of the window in pixels.
+        :param monitor_width: Width of the monitor in cm. Needed for cm and deg units.
+        :param monitor_size_pix: Size of the monitor in pixels. Needed for cm and deg units.
+        :param monitor_distance: Distance to the monitor in cm. Needed for deg units.
+        :param str monitor_name: Name of the monitor, for error messages.
+        """
+        conversions = {
+            'norm': (self.norm_to_psychopy, self.norm_to_tobii),
+            'height': (self.height_to_psychopy, self.height_to_tobii),
+            'pix': (self.pix_to_psychopy, self.pix_to_tobii),
+            'cm': (self.cm_to_psychopy, self.cm_to_tobii),
+            'deg': (self.deg_to_psychopy, self.deg_to_tobii),
+            'degFlat': (self.deg_flat_to_psychopy, self.deg_flat_to_tobii),
+            'degFlatPos': (self.deg_flat_to_psychopy, self.deg_flat_to_tobii),
+        }
+        if units not in conversions:
+            raise ValueError('unit ({}) is not supported.'.format(units))
+        self.units = units
+        self.to_psychopy_xy, self.to_tobii_xy = conversions[units]
+        self.width = size[0]
+        self.height = size[1]
+
+        if units in ('cm', 'deg', 'degFlat', 'degFlatPos'):
+            if monitor_size_pix is None:
+                raise ValueError("Monitor %s has no known size in pixels (SEE MONITOR CENTER)" % monitor_name)
+            if monitor_width is None:
+                raise ValueError("Monitor %s has no known width in cm (SEE MONITOR CENTER)" % monitor_name)
+            self.monitor_width = float(monitor_width)
+            self.monitor_width_pix = monitor_size_pix[0]
+        if units in ('deg', 'degFlat', 'degFlatPos'):
+            if monitor_distance is None:
+                raise ValueError("Monitor %s has no known distance (SEE MONITOR CENTER)" % monitor_name)
+            self.distance = monitor_distance
+            self.cm_per_deg = monitor_distance * 0.017455
+
+    @classmethod
+    def from_window(cls, win):
+        """
+        Build the transform of a PsychoPy window.
+        """
+        monitor = win.monitor
+        return cls(win.units, win.size, monitor.getWidth(), monitor.getSizePix(), monitor.getDistance(),
+                   monitor.name)
+
+    @classmethod
+    def from_info(cls, info):
+        """
+        Build the transform saved in the information of a binary data file (see <GazeBinaryFile>).
+        """
+        return cls(info['units'], info['size'], info.get('monitor_width'), info.get('monitor_size_pix'),
+                   info.get('monitor_distance'))
+
+    def to_psychopy(self, p):
+        """
+        Convert Tobii positions to PsychoPy coordinate system.
+
+        :param p: Position (x, y), or array of positions of shape (N, 2).
+        :return: array of the same shape.
+        """
+        p = np.asarray(p, dtype=float)
+        return np.stack(self.to_psychopy_xy(p[..., 0], p[..., 1]), axis=-1)
+
+    def to_tobii(self, p):
+        """
+        Convert PsychoPy positions to Tobii coordinate system.
+
+        :param p: Position (x, y), or array of positions of shape (N, 2).
+        :return: array of the same shape.
+        """
+        p = np.asarray(p, dtype=float)
+        return np.stack(self.to_tobii_xy(p[..., 0], p[..., 1]), axis=-1)
+
+    # Tobii -> PsychoPy. Operations are done in the order of psychopy.tools.monitorunittools, so that results are
+    # the same to the last bit as with pix2cm and pix2deg.
+
+    def norm_to_psychopy(self, x, y):
+        return 2 * x - 1, 2 * (1 - y) - 1
+
+    def height_to_psychopy(self, x, y):
+        return (x - 0.5) * self.width / self.height, (1 - y) - 0.5
+
+    def pix_to_psychopy(self, x, y):
+        return (x - 0.5) * self.width, ((1 - y) - 0.5) * self.height
+
+    def cm_to_psychopy(self, x, y):
+        x, y = self.pix_to_psychopy(x, y)
+        return x * self.monitor_width / self.monitor_width_pix, y * self.monitor_width / self.monitor_width_pix
+
+    def deg_to_psychopy(self, x, y):
+        x, y = self.cm_to_psychopy(x, y)
+        return x / self.cm_per_deg, y / self.cm_per_deg
+
+    def deg_flat_to_psychopy(self, x, y):
+        x, y = self.cm_to_psychopy(x, y)
+        return np.degrees(np.arctan(x / self.distance)), np.degrees(np.arctan(y / self.distance))
+
+    # PsychoPy -> Tobii, in the order of cm2pix and deg2pix.
+
+    def norm_to_tobii(self, x, y):
+        return (x + 1) / 2, 1 - (y + 1) / 2
+
+    def height_to_tobii(self, x, y):
+        return x * self.height / self.width + 0.5, 1 - (y + 0.5)
+
+    def pix_to_tobii(self, x, y):
+        return x / self.width + 0.5, 1 - (y / self.height + 0.5)
+
+    def cm_to_tobii(self, x, y):
+        return self.pix_to_tobii(x * self.monitor_width_pix / self.monitor_width,
+                                 y * self.monitor_width_pix / self.monitor_width)
+
+    def deg_to_tobii(self, x, y):
+        return self.cm_to_tobii(x * self.distance * 0.017455, y * self.distance * 0.017455)
+
+    def deg_flat_to_tobii(self, x, y):
+        return self.cm_to_tobii(np.tan(np.radians(x)) * self.distance, np.tan(np.radians(y)) * self.distance)
+
+
+class GazeEventClassifier:
+    """
+    Velocity-threshold (I-VT) classification of gaze samples into fixations and saccades.
+
+    The velocity of a sample is its angular distance to the latest sample at least <window> microseconds older,
+    divided by their time difference, as in Tobii's I-VT filter: averaging over a fixed time window keeps the noise
+    of the velocity independent of the sampling rate. A sample is a saccade sample if its velocity is above
+    <velocity_threshold>, a fixation sample otherwise. Samples where both eyes are invalid, and the first valid sample
+    after them, have no velocity and end the current fixation or saccade; the window never extends over invalid
+    samples. Samples whose timestamp is not after the previous one are ignored.
+
+    Events ('fixation_start', 'fixation_end', 'saccade_start', 'saccade_end') are stamped with the Tobii timestamp
+    of the first and last sample of each fixation or saccade. Fixations shorter than <min_fixation_duration> are
+    discarded: they give no events, and their 'fixation_start' is only emitted once they reach that duration.
+
+    :func:`update` classifies one sample at a time with constant work, from the Tobii callback thread.
+    :func:`classify` runs the same classification on a whole recording with NumPy, and gives the same events.
+    """
+
+    labels = (None, 'fixation', 'saccade')
+
+    def __init__(self, velocity_threshold=30.0, scale=(1.0, 1.0), on_event=None, window=20000,
+                 min_fixation_duration=60000):
+        """
+        :param float velocity_threshold: Saccade velocity threshold, in degrees per second. Default value is 30.
+        :param scale: Degrees of visual angle per unit of Tobii's display area, in x and y.
+        :param on_event: Function called with (timestamp, event name) for each event detected by :func:`update`.
+        :param int window: Time window of the velocity, in microseconds. Default value is 20000 (20 ms).
+        :param int min_fixation_duration: Minimum duration of a fixation, in microseconds. Default value is 60000.
+        """
+        self.velocity_threshold = velocity_threshold
+        self.scale_x, self.scale_y = scale
+        self.on_event = on_event
+        self.window = window
+        self.min_fixation_duration = min_fixation_duration
+        self.events = []
+        """Events detected by :func:`update`, as (timestamp, event name) tuples."""
+        self.samples = collections.deque()
+        """Valid samples (t, x, y) of the current velocity window, oldest first."""
+        self.label = 0
+        self.label_start = None
+        self.confirmed = False
+        self.last_timestamp = None
+
+    def emit(self, t, name):
+        self.events.append((t, name))
+        if self.on_event is not None:
+            self.on_event(t, name)
+
+    def end_label(self):
+        """
+        Emit the end of the current fixation or saccade. Usually, users don't have to call this method.
+        """
+        if self.label == 2 or self.confirmed:
+            self.emit(self.last_timestamp, self.labels[self.label] + '_end')
+        self.confirmed = False
+
+    def update(self, record):
+        """
+        Classify a new gaze sample.
+
+        :param record: tuple (t, lx, ly, lp, lv, rx, ry, rp, rv).
+        """
+        t, lx, ly, lp, lv, rx, ry, rp, rv = record
+        if self.last_timestamp is not None and t <= self.last_timestamp:
+            return
+        label = 0
+        samples = self.samples
+        if lv == 0 and rv == 0:
+            samples.clear()
+        else:
+            if lv == 0:
+                x, y = rx, ry
+            elif rv == 0:
+                x, y = lx, ly
+            else:
+                x, y = (lx + rx) / 2.0, (ly + ry) / 2.0
+            if samples:
+                while len(samples) > 1 and samples[1][0] <= t - self.window:
+                    samples.popleft()
+                previous = samples[0]
+                velocity = math.hypot((x - previous[1]) * self.scale_x,
+                                      (y - previous[2]) * self.scale_y) / ((t - previous[0]) / 1e6)
+                label = 2 if velocity > self.velocity_threshold else 1
+            samples.append((t, x, y))
+
+        if label != self.label:
+            if self.label != 0:
+                self.end_label()
+            if label == 2:
+                self.emit(t, 'saccade_start')
+            self.label = label
+            self.label_start = t
+        if label == 1 and not self.confirmed and t - self.label_start >= self.min_fixation_duration:
+            self.emit(self.label_start, 'fixation_start')
+            self.confirmed = True
+        self.last_timestamp = t
+
+    def finish(self):
+        """
+        End the current fixation or saccade at the last sample. Called when recording stops.
+        """
+        if self.label != 0:
+            self.end_label()
+        self.label = 0
+        self.samples.clear()
+
+    def classify(self, records):
+        """
+        Classify a whole recording at once, with the same rules as :func:`update` followed by :func:`finish`.
+
+        :param records: structured array of gaze records (see <gaze_dtype>).
+        :return: list of (timestamp, event name) tuples.
+        """
+        t = records['t']
+        if len(t) > 1:
+            kept = np.ones(len(t), dtype=bool)
+            kept[1:] = t[1:] > np.maximum.accumulate(t)[:-1]
+            records = records[kept]
+            t = records['t']
+        lv = records['lv'] != 0
+        rv = records['rv'] != 0
+        x = np.where(lv, np.where(rv, (records['lx'] + records['rx']) / 2.0, records['lx']), records['rx'])
+        y = np.where(lv, np.where(rv, (records['ly'] + records['ry']) / 2.0, records['ly']), records['ry'])
+        valid = lv | rv
+
+        # first sample of the run of valid samples of each sample, and latest sample at least one window older
+        index = np.arange(len(records))
+        run_starts = valid.copy()
+        run_starts[1:] &= ~valid[:-1]
+        run_start = np.maximum.accumulate(np.where(run_starts, index, 0))
+        previous = np.maximum(np.searchsorted(t, t - self.window, side='right') - 1, run_start)
+
+        labels = np.zeros(len(records), dtype=np.int8)
+        i = np.nonzero(valid & (previous < index))[0]
+        j = previous[i]
+        velocity = np.hypot((x[i] - x[j]) * self.scale_x, (y[i] - y[j]) * self.scale_y) / ((t[i] - t[j]) / 1e6)
+        labels[i] = np.where(velocity > self.velocity_threshold, 2, 1)
+
+        previous_labels = np.concatenate([[0], labels])
+        changes = np.nonzero(previous_labels[1:] != previous_labels[:-1])[0]
+        ends = changes[previous_labels[changes] != 0]
+        starts = changes[labels[changes] != 0]
+        if len(labels) > 0 and labels[-1] != 0:
+            ends = np.append(ends, len(labels))
+
+        # fixations shorter than the minimum duration are discarded, their start and end together
+        short = (labels[starts] == 1) & (t[ends - 1] - t[starts] < self.min_fixation_duration)
+        starts = starts[~short]
+        ends = ends[~short]
+
+        # ends go before starts at the same sample
+        order = np.argsort(np.concatenate([2 * ends, 2 * starts + 1]), kind='stable')
+        timestamps = np.concatenate([t[ends - 1], t[starts]])[order]
+        names = np.concatenate([[self.labels[label] + '_end' for label in previous_labels[ends]],
+                                [self.labels[label] + '_start' for label in labels[starts]]])[order]
+        return [(int(timestamp), str(name)) for timestamp, name in zip(timestamps, names)]
+
+
+class AOIRegistry:
+    """
+    Named areas of interest (AOIs) of a trial, with dwell time, first entry latency and number of visits accumulated
+    from gaze samples.
+
+    AOIs are given in window units, and stored in Tobii's display area coordinates so that gaze samples are tested
+    without conversion. Each call of :func:`update` tests a batch of samples against all the AOIs at once. Samples
+    recorded before the start of the trial are ignored, even if they are delivered after it.
+    """
+
+    def __init__(self, transform, start_time):
+        """
+        :param transform: <CoordinateTransform> of the window.
+        :param start_time: Tobii's timestamp of the start of the trial, for first entry latencies.
+        """
+        self.transform = transform
+        self.start_time = start_time
+        self.names = []
+        self.rects = []
+        """(column, x min, x max, y min, y max) of rectangular AOIs."""
+        self.ellipses = []
+        """(column, x center, y center, x radius, y radius) of circular AOIs."""
+        self.polygons = []
+        """(column, vertices) of polygonal AOIs."""
+        self.dwell_time = np.zeros(0, dtype=np.int64)
+        """Time spent in each AOI, in microseconds."""
+        self.entered = np.zeros(0, dtype=bool)
+        """Whether each AOI was entered."""
+        self.first_entry = np.zeros(0, dtype=np.int64)
+        """Time of the first entry in each AOI since the start of the trial, in microseconds, if entered."""
+        self.visits = np.zeros(0, dtype=np.int64)
+        """Number of entries in each AOI."""
+        self.last_timestamp = None
+        self.last_hits = np.zeros(0, dtype=bool)
+
+    def add(self, name):
+        if name in self.names:
+            raise ValueError('AOI {} is already registered'.format(name))
+        self.names.append(name)
+        self.dwell_time = np.append(self.dwell_time, 0)
+        self.entered = np.append(self.entered, False)
+        self.first_entry = np.append(self.first_entry, 0)
+        self.visits = np.append(self.visits, 0)
+        self.last_hits = np.append(self.last_hits, False)
+        return len(self.names) - 1
+
+    def add_rect(self, name, pos, size):
+        """
+        Register a rectangular AOI.
+
+        :param str name: Name of the AOI.
+        :param pos: Center (x, y) in window units.
+        :param size: (width, height) in window units.
+        """
+        x, y = self.transform.to_tobii_xy(np.array([pos[0] - size[0] / 2, pos[0] + size[0] / 2]),
+                                          np.array([pos[1] - size[1] / 2, pos[1] + size[1] / 2]))
+        self.rects.append((self.add(name), x.min(), x.max(), y.min(), y.max()))
+
+    def add_circle(self, name, pos, radius):
+        """
+        Register a circular AOI.
+
+        :param str name: Name of the AOI.
+        :param pos: Center (x, y) in window units.
+        :param radius: Radius in window units.
+        """
+        x, y = self.transform.to_tobii_xy(np.array([pos[0], pos[0] + radius, pos[0]]),
+                                          np.array([pos[1], pos[1], pos[1] + radius]))
+        self.ellipses.append((self.add(name), x[0], y[0], abs(x[1] - x[0]), abs(y[2] - y[0])))
+
+    def add_polygon(self, name, vertices):
+        """
+        Register a polygonal AOI.
+
+        :param str name: Name of the AOI.
+        :param vertices: List of (x, y) vertices in window units.
+        """
+        vertices = np.asarray(vertices, dtype=float)
+        x, y = self.transform.to_tobii_xy(vertices[:, 0], vertices[:, 1])
+        self.polygons.append((self.add(name), np.column_stack([x, y])))
+
+    def add_stimulus(self, name, stim):
+        """
+        Register the bounding box of a visual stimulus (e.g. from create_visual_rect or create_visual_image) as a
+        rectangular AOI.
+
+        :param str name: Name of the AOI.
+        :param stim: PsychoPy visual stimulus.
+        """
+        vertices = np.asarray(stim.verticesPix, dtype=float)
+        x = vertices[:, 0] / self.transform.width + 0.5
+        y = 0.5 - vertices[:, 1] / self.transform.height
+        self.rects.append((self.add(name), x.min(), x.max(), y.min(), y.max()))
+
+    def hit_test(self, x, y):
+        """
+        Test positions against all the AOIs.
+
+        :param x: Array of x positions in Tobii's display area coordinates (NaN if invalid).
+        :param y: Array of y positions in Tobii's display area coordinates (NaN if invalid).
+        :return: Boolean array of shape (len(x), number of AOIs).
+        """
+        hits = np.zeros((len(x), len(self.names)), dtype=bool)
+        x = x[:, None]
+        y = y[:, None]
+        if self.rects:
+            columns, x_min, x_max, y_min, y_max = np.array(self.rects).T
+            hits[:, columns.astype(int)] = (x >= x_min) & (x <= x_max) & (y >= y_min) & (y <= y_max)
+        if self.ellipses:
+            columns, x_center, y_center, x_radius, y_radius = np.array(self.ellipses).T
+            hits[:, columns.astype(int)] = ((x - x_center) / x_radius) ** 2 + ((y - y_center) / y_radius) ** 2 <= 1
+        for column, vertices in self.polygons:
+            inside = np.zeros(len(x), dtype=bool)
+            # even-odd rule: count crossings of a horizontal ray with each edge
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for (x1, y1), (x2, y2) in zip(vertices, np.roll(vertices, -1, axis=0)):
+                    inside ^= ((y1 > y[:, 0]) != (y2 > y[:, 0])) & \
+                              (x[:, 0] < (x2 - x1) * (y[:, 0] - y1) / (y2 - y1) + x1)
+            hits[:, column] = inside
+        return hits
+
+    def update(self, records):
+        """
+        Accumulate dwell time, first entry latency and visits of the AOIs over new gaze samples.
+        The time between two samples is counted in an AOI if the first one is in it.
+
+        :param records: structured array of gaze records following the ones of the last call (see <gaze_dtype>).
+        """
+        records = records[records['t'] >= self.start_time]
+        if len(records) == 0:
+            return
+        lv = records['lv'] != 0
+        rv = records['rv'] != 0
+        x = np.where(lv, np.where(rv, (records['lx'] + records['rx']) / 2.0, records['lx']),
+                     np.where(rv, records['rx'], np.nan))
+        y = np.where(lv, np.where(rv, (records['ly'] + records['ry']) / 2.0, records['ly']),
+                     np.where(rv, records['ry'], np.nan))
+        hits = self.hit_test(x, y)
+        t = records['t']
+
+        previous_hits = np.vstack([self.last_hits[None], hits[:-1]])
+        previous_t = np.concatenate([[t[0] if self.last_timestamp is None else self.last_timestamp], t[:-1]])
+        self.dwell_time += ((t - previous_t)[:, None] * previous_hits).sum(axis=0)
+        entries = hits & ~previous_hits
+        self.visits += entries.sum(axis=0)
+        first = ~self.entered & entries.any(axis=0)
+        self.first_entry[first] = t[entries[:, first].argmax(axis=0)] - self.start_time
+        self.entered |= first
+
+        self.last_timestamp = t[-1]
+        self.last_hits = hits[-1]
+
+    def get_stats(self):
+        """
+        Get AOI statistics as a list of (name, dwell time in ms, first entry latency in ms or None, visits).
+        """
+        return [(name, self.dwell_time[i] / 1000.0, self.first_entry[i] / 1000.0 if self.entered[i] else None,
+                 int(self.visits[i])) for i, name in enumerate(self.names)]
+
+
+class CsvWriter:
+    """
+    CSV file written by a background thread.
+
+    :func:`write_row` checks the row against the headers, formats it with the csv module (values with a comma, a
+    quote or a newline are quoted) and puts it in a queue, so the caller never waits for the disk. The thread writes
+    all the queued rows at once, then flushes them to the OS and, depending on <fsync>, to the disk. The file is
+    closed, with all its rows written, by :func:`close`, or at interpreter exit if it was not.
+    """
+
+    def __init__(self, filename, headers=(), fsync='batch', append=False):
+        """
+        :param str filename: Name of the file, which is overwritten.
+        :param headers: Column names, written as the first line. If not empty, every row must have one value per
+            column.
+        :param fsync: When rows are forced to the disk with os.fsync: 'batch' after each write, 'close' only when the
+            file is closed, None never (the OS decides).
+        :param bool append: If True, rows are added at the end of the file, and the headers are only written if the
+            file is empty.
+        """
+        if fsync not in ('batch', 'close', None):
+            raise ValueError('fsync policy ({}) is not supported.'.format(fsync))
+        self.filename = filename
+        self.headers = list(headers)
+        self.fsync = fsync
+        self.file = open(filename, 'a' if append else 'w')
+        self.queue = queue.Queue()
+        self.closed = False
+        self.error = None
+        """Exception raised by the writer thread, re-raised by :func:`close`."""
+        if self.headers and self.file.tell() == 0:
+            self.write(self.format_row(self.headers))
+        self.thread = threading.Thread(target=self.run, name='CsvWriter', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write_row(self, values):
+        """
+        Queue a row.
+
+        :param values: Values of the columns, converted with str.
+        """
+        values = list(map(str, values))
+        if self.headers and len(values) != len(self.headers):
+            raise ValueError('row has {} values but {} has {} columns ({})'.format(
+                len(values), self.filename, len(self.headers), ",".join(self.headers)))
+        self.write(self.format_row(values))
+
+    @staticmethod
+    def format_row(values):
+        """
+        Format a row as a line of CSV.
+        Usually, users don't have to call this method.
+        """
+        line = io.StringIO()
+        csv.writer(line, lineterminator='\n').writerow(values)
+        return line.getvalue()
+
+    def write(self, text):
+        """
+        Queue text as is, as with a file.
+
+        :param text: String, or function returning the string, called by the writer thread (e.g. to serialize an
+            object out of the caller's thread).
+        """
+        if self.closed:
+            raise ValueError('I/O operation on closed file {}'.format(self.filename))
+        self.queue.put(text)
+
+    def run(self):
+        while True:
+            items = [self.queue.get()]
+            while True:
+                try:
+                    items.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if self.error is None:
+                try:
+                    self.file.write(''.join(item if isinstance(item, str) else item()
+                                            for item in items if isinstance(item, str) or callable(item)))
+                    self.file.flush()
+                    if self.fsync == 'batch':
+                        os.fsync(self.file.fileno())
+                except Exception as e:
+                    self.error = e
+            # None stops the thread, events are set once the rows queued before them are written
+            for item in items:
+                if isinstance(item, threading.Event):
+                    item.set()
+            if items[-1] is None:
+                return
+
+    def flush(self):
+        """
+        Wait until the rows queued so far are written.
+        """
+        if self.closed:
+            return
+        done = threading.Event()
+        self.queue.put(done)
+        done.wait()
+
+    def close(self):
+        """
+        Write the rows left and close the file. Can be called several times.
+        """
+        if self.closed:
+            return
+        self.closed = True
+        atexit.unregister(self.close)
+        self.queue.put(None)
+        self.thread.join()
+        if self.error is None and self.fsync is not None:
+            os.fsync(self.file.fileno())
+        self.file.close()
+        if self.error is not None:
+            raise self.error
+
+
+class ClockMapping:
+    """
+    Linear mapping of a clock onto the session timeline (see <ClockSync>), fitted on recent pairs of
+    (clock time, session time): session time = offset + rate * clock time.
+
+    The rate (drift) is fitted once the pairs span <min_span> seconds; before, the nominal rate of the clock is used.
+    With one-sided pairs, whose session time is only known to be later than the true one (e.g. arrival time of a
+    response), the line is moved down to the earliest pair, so that mapped times are late by the minimum delay only.
+    """
+
+    def __init__(self, nominal_rate=1.0, one_sided=False, window=64, min_span=10.0):
+        """
+        :param float nominal_rate: Session seconds per clock unit.
+        :param bool one_sided: If True, pairs are one-sided.
+        :param int window: Number of recent pairs used for the fit.
+        :param float min_span: Minimum span of the pairs, in session seconds, to fit the rate.
+        """
+        self.nominal_rate = nominal_rate
+        self.one_sided = one_sided
+        self.min_span = min_span
+        self.pairs = collections.deque(maxlen=window)
+        self.parameters = None
+        """(clock origin, rate, offset), replaced at once by :func:`add`."""
+
+    def add(self, clock_time, session_time):
+        """
+        Add a pair and fit the mapping again.
+        """
+        origin = self.parameters[0] if self.parameters is not None else clock_time
+        self.pairs.append((clock_time - origin, session_time))
+        x, y = np.array(self.pairs).T
+        if y.max() - y.min() >= self.min_span:
+            rate, offset = np.polyfit(x, y, 1)
+        else:
+            rate = self.nominal_rate
+            offset = (y - rate * x).mean()
+        if self.one_sided:
+            offset += (y - offset - rate * x).min()
+        self.parameters = (origin, rate, offset)
+
+    def __call__(self, clock_time):
+        """
+        Convert clock times (a number or an array) to session times. Returns NaN before the first pair.
+        """
+        parameters = self.parameters
+        if parameters is None:
+            return clock_time * np.nan
+        origin, rate, offset = parameters
+        return offset + rate * (clock_time - origin)
+
+
+class ClockSync:
+    """
+    Alignment of the clocks of a session on one monotonic timeline, in seconds since the creation of the ClockSync.
+
+    The reference is Tobii's system timestamp (microseconds, on the monotonic clock of the computer), which already
+    stamps gaze samples and events, or another clock in microseconds if there is no eye tracker. time.time(),
+    PsychoPy's clock (core.getTime, flip times) and the response pad timer are mapped onto it by <ClockMapping>: a
+    background thread reads the computer clocks every <interval> seconds between two reads of the reference, keeping
+    the tightest of a few tries, and each pad response gives a pair of (pad time, arrival time).
+
+    With <filename>, the mapping is saved at every synchronization, so that the times of the data files can be
+    converted afterwards: one row with the session time, <start_timestamp> (reference time of session time 0), the
+    uncertainty, and the parameters (origin, rate, offset) of each <ClockMapping>, empty before their first pair.
+    """
+
+    headers = ['session_time', 'reference_start', 'uncertainty', 'wall_origin', 'wall_rate', 'wall_offset',
+               'psychopy_origin', 'psychopy_rate', 'psychopy_offset', 'pad_origin', 'pad_rate', 'pad_offset']
+    "Columns of the file of the mapping"
+
+    def __init__(self, interval=1.0, tries=5, reference=None, filename=None, fsync='close', append=False):
+        """
+        :param float interval: Time between two synchronizations, in seconds.
+        :param int tries: Number of reads per synchronization. The one with the shortest round trip is kept.
+        :param reference: Function giving the reference time in microseconds. Default is
+            tobii_research.get_system_time_stamp.
+        :param str filename: CSV file where the mapping is saved. Default is not saved.
+        :param fsync: When rows are forced to the disk (see <CsvWriter>).
+        :param bool append: If True, rows are added to an existing file (e.g. in a resumed session).
+        """
+        self.interval = interval
+        self.tries = tries
+        self.reference = reference if reference is not None else tobii_research.get_system_time_stamp
+        self.writer = CsvWriter(filename, self.headers, fsync, append) if filename is not None else None
+        self.start_timestamp = self.reference()
+        self.wall = ClockMapping()
+        """Mapping of time.time()."""
+        self.psychopy = ClockMapping()
+        """Mapping of core.getTime()."""
+        self.pad = ClockMapping(0.001, one_sided=True)
+        """Mapping of the response pad timer (responses' "time", in milliseconds)."""
+        self.uncertainty = None
+        """Half round trip of the last synchronization, in seconds."""
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.sync()
+
+    def start(self):
+        """
+        Start synchronizing in a background thread.
+        """
+        self.thread = threading.Thread(target=self.run, name='ClockSync', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread, and close the file of the mapping.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.sync()
+
+    def sync(self):
+        """
+        Read the computer clocks between two reads of the reference, and add the pairs to their mappings.
+        Usually, users don't have to call this method.
+        """
+        best = None
+        reference = self.reference
+        for i in range(self.tries):
+            before = reference()
+            wall = time.time()
+            psychopy = core.getTime()
+            after = reference()
+            if best is None or after - before < best[0]:
+                best = (after - before, (before + after) / 2.0, wall, psychopy)
+        round_trip, timestamp, wall, psychopy = best
+        session_time = self.from_tobii(timestamp)
+        self.wall.add(wall, session_time)
+        self.psychopy.add(psychopy, session_time)
+        self.uncertainty = round_trip / 2e6
+        if self.writer is not None:
+            row = [session_time, self.start_timestamp, self.uncertainty]
+            for mapping in (self.wall, self.psychopy, self.pad):
+                parameters = mapping.parameters
+                row.extend(parameters if parameters is not None else ('', '', ''))
+            self.writer.write_row(row)
+
+    def add_pad_response(self, response, arrival):
+        """
+        Add a response of the pad, received at time.time() <arrival>, to the pad mapping.
+        Usually, users don't have to call this method.
+        """
+        self.pad.add(response["time"], self.from_wall(arrival))
+
+    def now(self):
+        """
+        Current session time, in seconds.
+        """
+        return self.from_tobii(self.reference())
+
+    def from_tobii(self, timestamp):
+        """
+        Convert Tobii's system timestamps (gaze samples, events) to session time.
+        """
+        return (timestamp - self.start_timestamp) / 1e6
+
+    def from_wall(self, t):
+        """
+        Convert time.time() values to session time.
+        """
+        return self.wall(t)
+
+    def from_psychopy(self, t):
+        """
+        Convert PsychoPy times (core.getTime, win.lastFrameT) to session time.
+        """
+        return self.psychopy(t)
+
+    def from_pad(self, t):
+        """
+        Convert response pad times (responses' "time", in milliseconds) to session time.
+        """
+        return self.pad(t)
+
+
+class ResponsePadInput:
+    """
+    Input thread of a Cedrus response pad (pyxid2 device).
+
+    The thread polls the device every <poll_interval> seconds, sleeping in between, and puts each response in a queue
+    with the time it was received. Waiting for a response (:func:`get`) blocks on the queue, so no core is kept busy
+    while the participant thinks.
+    """
+
+    def __init__(self, dev, poll_interval=0.001, on_response=None):
+        """
+        :param dev: pyxid2 device.
+        :param float poll_interval: Time between two polls of the device, in seconds. Default value is 0.001.
+        :param on_response: Function called from the thread with (response, time.time() when it was received) for
+            each response.
+        """
+        self.dev = dev
+        self.poll_interval = poll_interval
+        self.on_response = on_response
+        self.queue = queue.Queue()
+        self.thread = None
+        self.stop_event = threading.Event()
+
+    def start(self):
+        """
+        Start polling the device in a background thread.
+        """
+        self.dev.clear_response_queue()
+        self.thread = threading.Thread(target=self.run, name='ResponsePadInput', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread.
+        """
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        dev = self.dev
+        while not self.stop_event.wait(self.poll_interval):
+            dev.poll_for_response()
+            while dev.has_response():
+                received = (dev.get_next_response(), time.time())
+                if self.on_response is not None:
+                    self.on_response(*received)
+                self.queue.put(received)
+
+    def clear(self):
+        """
+        Discard the responses received so far.
+        """
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def get(self, timeout=float("inf")):
+        """
+        Wait for the next response.
+        Returns a tuple (response, time.time() when it was received), or None if timeout is reached.
+
+        :param float timeout: Maximum waiting time in seconds. Default is no timeout.
+        """
+        try:
+            return self.queue.get(timeout=None if timeout == float("inf") else max(timeout, 0))
+        except queue.Empty:
+            return None
+
+
+class StimulusCache:
+    """
+    Size-bounded cache of visual stimuli, used by the create_visual_* methods of <TaskTemplate>.
+
+    Stimuli are keyed by the parameters they were created with. When the same parameters recur, the cached stimulus
+    is reused: every attribute set by its constructor is set back to the requested value, in case the caller mutated
+    it, instead of building a new stimulus (text layout, GL resources); attributes whose change is costly (text, font,
+    height...) are only set if they differ. The least recently used stimulus is dropped when the cache is full.
+
+    Only the calls with cache=True use the cache, as the template does for its own screens. A cached stimulus is
+    shared by all the calls with the same parameters: to draw two of them with different positions in the same frame,
+    create them with different parameters, or without the cache.
+    """
+
+    def __init__(self, max_size=128):
+        """
+        :param int max_size: Maximum number of cached stimuli. 0 disables the cache.
+        """
+        self.max_size = max_size
+        self.stimuli = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(*values):
+        """
+        Make a hashable key from stimulus parameters (lists and arrays are converted to tuples).
+        """
+        return tuple(tuple(np.ravel(value).tolist()) if isinstance(value, (list, tuple, np.ndarray)) else value
+                     for value in values)
+
+    def get(self, key, create, reset=None):
+        """
+        Get the stimulus of a key, creating it if it is not cached.
+
+        :param key: Key made by :func:`make_key`.
+        :param create: Function returning a new stimulus.
+        :param reset: Function called with the cached stimulus on a hit, to set its attributes back.
+        """
+        stim = self.stimuli.get(key)
+        if stim is None:
+            self.misses += 1
+            stim = create()
+            if self.max_size > 0:
+                self.stimuli[key] = stim
+                if len(self.stimuli) > self.max_size:
+                    self.stimuli.popitem(last=False)
+            return stim
+        self.hits += 1
+        self.stimuli.move_to_end(key)
+        if reset is not None:
+            reset(stim)
+        return stim
+
+    def clear(self):
+        """
+        Drop all the cached stimuli.
+        """
+        self.stimuli.clear()
+
+    def get_stats(self):
+        """
+        Get cache statistics as a dict with keys 'size', 'hits' and 'misses'.
+        """
+        return {'size': len(self.stimuli), 'hits': self.hits, 'misses': self.misses}
+
+
+def fit_image_size(width, height, max_width, max_height, step=0.9):
+    """
+    Shrink an image size by steps of <step> until it fits in (max_width, max_height), as :func:`TaskTemplate.size`
+    always did, but with the number of steps computed in closed form.
+
+    :return: (width, height).
+    """
+    steps = 0
+    for size, max_size in ((width, max_width), (height, max_height)):
+        size *= step ** steps
+        if size > max_size:
+            n = max(1, math.ceil(math.log(max_size / size) / math.log(step)))
+            # the logarithm may be rounded across a step
+            if size * step ** (n - 1) <= max_size:
+                n -= 1
+            elif size * step ** n > max_size:
+                n += 1
+            steps += n
+    scale = step ** steps
+    return width * scale, height * scale
+
+
+class ImagePipeline:
+    """
+    Image assets decoded, fitted to the screen and converted to texture-ready arrays by a pool of threads, before
+    they are needed.
+
+    Fitted images are saved in <cache_folder>, keyed by the hash of the file and the screen size, so that the next
+    sessions only read them back. Images are kept in memory as 8 bits RGBA arrays, and converted once to PsychoPy's
+    texture format (float32 in [-1, 1], bottom row first) by :func:`get_texture`. Images that are not needed any more
+    are dropped with :func:`release`.
+    """
+
+    def __init__(self, folder, screen_size, cache_folder=None, workers=4):
+        """
+        :param str folder: Folder of the images.
+        :param screen_size: (width, height) of the screen in pixels.
+        :param str cache_folder: Folder of the fitted images. Default is no disk cache.
+        :param int workers: Number of threads.
+        """
+        self.folder = folder
+        self.screen_size = tuple(screen_size)
+        self.cache_folder = cache_folder
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers,
+                                                              thread_name_prefix='ImagePipeline')
+        self.futures = {}
+        self.textures = {}
+
+    def load(self, names):
+        """
+        Start loading images, if they are not loaded yet.
+
+        :param names: File names in <folder>.
+        """
+        for name in names:
+            if name not in self.futures:
+                self.futures[name] = self.executor.submit(self.prepare, name)
+
+    def prepare(self, name):
+        """
+        Decode and fit an image, or read it from the disk cache.
+        Usually, users don't have to call this method.
+
+        :return: (RGBA uint8 array, fitted (width, height)).
+        """
+        with open(os.path.join(self.folder, name), 'rb') as f:
+            content = f.read()
+        cache_file = None
+        if self.cache_folder is not None:
+            cache_file = os.path.join(self.cache_folder, '{}_{}x{}.npz'.format(
+                hashlib.sha1(content).hexdigest(), *self.screen_size))
+            if os.path.exists(cache_file):
+                with np.load(cache_file) as cached:
+                    return cached['pixels'], tuple(float(value) for value in cached['size'])
+
+        image = Image.open(io.BytesIO(content))
+        size = fit_image_size(image.size[0], image.size[1], *self.screen_size)
+        pixel_size = (max(1, int(round(size[0]))), max(1, int(round(size[1]))))
+        image = image.convert('RGBA')
+        if pixel_size != image.size:
+            image = image.resize(pixel_size, Image.LANCZOS)
+        pixels = np.asarray(image)
+
+        if cache_file is not None:
+            os.makedirs(self.cache_folder, exist_ok=True)
+            # written under another name first, so that a session never reads a partial file
+            temporary_file = cache_file + '.{}.tmp.npz'.format(threading.get_ident())
+            np.savez(temporary_file, pixels=pixels, size=np.array(size))
+            os.replace(temporary_file, cache_file)
+        return pixels, size
+
+    def get(self, name):
+        """
+        Get a loaded image as (RGBA uint8 array, fitted (width, height)), waiting for it if needed.
+        The image is loaded now if :func:`load` was not called for it.
+        """
+        self.load([name])
+        return self.futures[name].result()
+
+    def get_size(self, name):
+        """
+        Get the fitted (width, height) of an image.
+        """
+        return self.get(name)[1]
+
+    def get_texture(self, name):
+        """
+        Get an image as a texture-ready array for visual.ImageStim: float32 in [-1, 1], bottom row first.
+        The array is computed at the first call and kept until :func:`release`, so call it first from a background
+        thread (e.g. in prepare_trial) for large images.
+        """
+        texture = self.textures.get(name)
+        if texture is None:
+            pixels = self.get(name)[0]
+            texture = pixels[::-1].astype(np.float32)
+            texture /= 127.5
+            texture -= 1
+            self.textures[name] = texture
+        return texture
+
+    def release(self, names):
+        """
+        Drop loaded images and their textures from memory. They are loaded again if they are needed later.
+
+        :param names: File names in <folder>.
+        """
+        for name in names:
+            self.textures.pop(name, None)
+            self.futures.pop(name, None)
+
+    def close(self):
+        """
+        Stop the threads, after the loads in progress.
+        """
+        self.executor.shutdown(wait=True)
+
+
+class StimulusCatalog:
+    """
+    Index of a stimulus directory, built once and queried in memory.
+
+    Each file has an entry with its size, mtime, checksum (SHA-1), and for images, format and dimensions. The index can
+    be saved in <index_file>, outside the stimulus directory, so that the next sessions only stat the files: an entry
+    is computed again only if the mtime or size of its file changed. :func:`refresh` does the same during a session.
+    """
+
+    def __init__(self, folder, index_file=None, seed=None):
+        """
+        :param str folder: Stimulus directory.
+        :param str index_file: File where the index is saved, e.g. in a local cache folder. Default is no file. An
+            index saved for another folder is ignored.
+        :param seed: Seed of the random sampling. Default is random.
+        """
+        self.folder = folder
+        self.index_file = index_file
+        self.random = random.Random(seed)
+        self.entries = {}
+        """Entries by file name: dict with keys 'size', 'mtime', 'sha1', 'format', 'width' and 'height'."""
+        self.pools = {}
+        if self.index_file is not None and os.path.exists(self.index_file):
+            try:
+                with open(self.index_file) as f:
+                    index = json.load(f)
+                if index.get('folder') == os.path.abspath(folder):
+                    self.entries = index['entries']
+            except (OSError, ValueError, KeyError, AttributeError):
+                self.entries = {}
+        self.refresh()
+
+    def refresh(self):
+        """
+        Update the index from the directory: new and modified files are indexed, deleted files are removed.
+        """
+        entries = {}
+        changed = False
+        with os.scandir(self.folder) as files:
+            for file in files:
+                if not file.is_file() or file.name.startswith('.'):
+                    continue
+                stat = file.stat()
+                entry = self.entries.get(file.name)
+                if entry is None or entry['mtime'] != stat.st_mtime or entry['size'] != stat.st_size:
+                    entry = self.index(file.path, stat)
+                    changed = True
+                entries[file.name] = entry
+        changed = changed or len(entries) != len(self.entries)
+        self.entries = entries
+        if changed and self.index_file is not None:
+            try:
+                with open(self.index_file, 'w') as f:
+                    json.dump({'folder': os.path.abspath(self.folder), 'entries': entries}, f)
+            except OSError:
+                pass
+
+    def index(self, path, stat):
+        """
+        Compute the entry of a file.
+        Usually, users don't have to call this method.
+        """
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2 ** 20), b''):
+                sha1.update(block)
+        entry = {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': sha1.hexdigest(),
+                 'format': None, 'width': None, 'height': None}
+        try:
+            with Image.open(path) as image:
+                entry['format'] = image.format
+                entry['width'], entry['height'] = image.size
+        except Exception:
+            pass
+        return entry
+
+    def names(self, condition=None, **criteria):
+        """
+        Get the sorted names of the files matching a query.
+
+        :param condition: Function called with an entry, returning True if the file matches.
+        :param criteria: Values the entries must have, e.g. format='PNG'.
+        """
+        return [name for name, entry in sorted(self.entries.items())
+                if all(entry.get(key) == value for key, value in criteria.items())
+                and (condition is None or condition(entry))]
+
+    def sample(self, k, names=None, generator=None):
+        """
+        Draw files at random without replacement: a file is drawn again only once all the candidates have been
+        drawn. Draws from the same candidates share the same pool across calls.
+
+        :param int k: Number of files.
+        :param names: Candidate names (e.g. from :func:`names`). Default is all the files.
+        :param generator: Random generator shuffling the pool (random.Random or numpy.random.RandomState), e.g.
+            from :func:`TaskTemplate.get_trial_random` in prepare_trial. Default is the generator of the catalog.
+        """
+        names = tuple(self.names() if names is None else names)
+        if k > len(names):
+            raise ValueError('cannot draw {} files out of {}'.format(k, len(names)))
+        pool = self.pools.setdefault(names, [])
+        drawn = []
+        while len(drawn) < k:
+            if not pool:
+                pool.extend(name for name in names if name not in drawn)
+                (self.random if generator is None else generator).shuffle(pool)
+            drawn.append(pool.pop())
+        return drawn
+
+    def assign(self, conditions, participant, names=None):
+        """
+        Counterbalanced assignment of files to conditions: sorted files are split in as many groups as conditions,
+        and groups are rotated across conditions with the participant number (Latin square).
+
+        :param conditions: List of conditions.
+        :param int participant: Participant number.
+        :param names: Names to assign. Default is all the files.
+        :return: dict of condition: list of names.
+        """
+        names = self.names() if names is None else sorted(names)
+        groups = np.array_split(np.arange(len(names)), len(conditions))
+        return {condition: [names[i] for i in groups[(c + participant) % len(conditions)]]
+                for c, condition in enumerate(conditions)}
+
+
+class FrameTimer:
+    """
+    Flip timestamps of a window, tagged with the current phase (e.g. 'instructions', 'calibration', 'task') and trial
+    number, in preallocated arrays.
+
+    A frame is dropped if its interval from the previous flip is above <threshold> refresh periods. Each time the
+    phase or trial changes, the summary of the frames of the previous one is given to <on_segment>. Intervals are only
+    counted between flips of the same phase and trial, so that the waits between trials are not counted as drops;
+    static screens (e.g. an instruction waiting for a key press) do show long intervals.
+    """
+
+    def __init__(self, frame_period, threshold=1.5, capacity=2 ** 18, on_segment=None):
+        """
+        :param float frame_period: Refresh period of the monitor, in seconds.
+        :param float threshold: Dropped frame threshold, in refresh periods.
+        :param int capacity: Number of flips allocated at once (2 ** 18 is more than an hour at 60 Hz).
+        :param on_segment: Function called with the summary (see :func:`get_summary`) of each phase or trial.
+        """
+        self.frame_period = frame_period
+        self.threshold = threshold
+        self.on_segment = on_segment
+        self.times = np.zeros(capacity)
+        self.trials = np.full(capacity, -1, dtype=np.int32)
+        self.phases = np.zeros(capacity, dtype=np.int8)
+        self.phase_names = ['']
+        self.count = 0
+        self.phase = 0
+        self.trial = -1
+        self.segment_start = 0
+
+    def record(self, t):
+        """
+        Record a flip at time <t>, in seconds.
+        """
+        i = self.count
+        if i == len(self.times):
+            self.times = np.concatenate([self.times, np.zeros(len(self.times))])
+            self.trials = np.concatenate([self.trials, np.full(len(self.trials), -1, dtype=np.int32)])
+            self.phases = np.concatenate([self.phases, np.zeros(len(self.phases), dtype=np.int8)])
+        self.times[i] = t
+        self.trials[i] = self.trial
+        self.phases[i] = self.phase
+        self.count = i + 1
+
+    def set_phase(self, phase, no_trial=-1):
+        """
+        Set the phase and trial number of the next flips, and end the current ones.
+
+        :param str phase: Name of the phase.
+        :param int no_trial: Trial number, -1 if none.
+        """
+        self.end_segment()
+        if phase not in self.phase_names:
+            self.phase_names.append(phase)
+        self.phase = self.phase_names.index(phase)
+        self.trial = no_trial
+
+    def end_segment(self):
+        """
+        Give the summary of the flips since the last phase change to <on_segment>.
+        """
+        if self.count > self.segment_start and self.on_segment is not None:
+            self.on_segment(self.get_summary(self.segment_start, self.count))
+        self.segment_start = self.count
+
+    def get_intervals(self, start=0, stop=None):
+        """
+        Get the intervals between the flips from <start> to <stop> (flip indices), in seconds.
+        """
+        return np.diff(self.times[start:self.count if stop is None else stop])
+
+    def get_dropped(self):
+        """
+        Get the indices of the dropped frames, among flips of the same phase and trial as the previous one.
+        """
+        same = (np.diff(self.phases[:self.count]) == 0) & (np.diff(self.trials[:self.count]) == 0)
+        intervals = self.get_intervals()
+        return np.nonzero(same & (intervals > self.threshold * self.frame_period))[0] + 1
+
+    def get_summary(self, start, stop):
+        """
+        Get the summary of the flips from <start> to <stop> (flip indices, of the same phase and trial), as a tuple
+        (trial, phase, frames, mean interval, max interval, dropped frames). Intervals are in milliseconds, NaN if
+        there is only one flip.
+        """
+        intervals = self.get_intervals(start, stop) * 1000.0
+        if len(intervals) == 0:
+            mean, maximum = np.nan, np.nan
+        else:
+            mean, maximum = intervals.mean(), intervals.max()
+        dropped = int(np.count_nonzero(intervals > self.threshold * self.frame_period * 1000.0))
+        return (int(self.trials[start]), self.phase_names[self.phases[start]], stop - start, mean, maximum, dropped)
+
+
+class SimulatedEyeTracker:
+    """
+    Eye tracker generating synthetic gaze data, with the interface of tobii_research.EyeTracker used by
+    <TaskTemplate>.
+
+    Gaze alternates between fixations (150-400 ms) on random points and saccades (20-60 ms) to the next point.
+    During fixations, gaze drifts slowly (a random walk whose spread depends on time, not on the number of samples),
+    and each sample has a small measurement noise (0.001 display area units), so that fixations look the same at any
+    frequency. Both eyes are lost during blinks (100-300 ms, <blink_rate> per second), and each eye is lost on single
+    samples with probability <dropout_rate>. A thread delivers samples to the subscribed callbacks in real time,
+    by bursts if it is late, with the timestamps of the monotonic clock they would have had (see
+    :func:`get_monotonic_time_stamp`): the Tobii SDK is not needed.
+    """
+
+    drift = 0.005
+    """Standard deviation of the drift of gaze during a fixation after one second, in display area units."""
+    noise = 0.001
+    """Standard deviation of the measurement noise of each sample, in display area units."""
+
+    def __init__(self, frequency=600, dropout_rate=0.01, blink_rate=0.3, seed=None):
+        """
+        :param frequency: Sampling frequency in Hz (e.g. 60 to 1200).
+        :param float dropout_rate: Probability of losing one eye on a sample.
+        :param float blink_rate: Blinks per second.
+        :param seed: Seed of the random generator.
+        """
+        self.frequency = frequency
+        self.dropout_rate = dropout_rate
+        self.blink_rate = blink_rate
+        self.random = np.random.RandomState(seed)
+        self.address = 'simulated'
+        self.model = 'Simulated eye tracker'
+        self.serial_number = 'simulated'
+        self.callbacks = {}
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.samples = self.generate()
+
+    def subscribe_to(self, stream, callback, as_dictionary=False):
+        """
+        Subscribe a callback to a stream (only gaze data is generated).
+        """
+        self.callbacks.setdefault(stream, []).append(callback)
+        if self.thread is None:
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self.run, name='SimulatedEyeTracker', daemon=True)
+            self.thread.start()
+
+    def unsubscribe_from(self, stream, callback=None):
+        """
+        Unsubscribe a callback, or all the callbacks, from a stream.
+        """
+        callbacks = self.callbacks.get(stream, [])
+        if callback is None:
+            callbacks.clear()
+        elif callback in callbacks:
+            callbacks.remove(callback)
+        if not any(self.callbacks.values()) and self.thread is not None:
+            self.stop_event.set()
+            if self.thread is not threading.current_thread():
+                self.thread.join()
+            self.thread = None
+
+    def run(self):
+        period = 1e6 / self.frequency
+        start = get_monotonic_time_stamp()
+        n = 0
+        while not self.stop_event.is_set():
+            due = int((get_monotonic_time_stamp() - start) / period) + 1
+            while n < due:
+                sample = next(self.samples)
+                sample.system_time_stamp = int(start + n * period)
+                sample.device_time_stamp = sample.system_time_stamp
+                for callback in list(self.callbacks.get(simulated_tobii_research.EYETRACKER_GAZE_DATA, [])):
+                    callback(sample)
+                n += 1
+            self.stop_event.wait(max(0.0, (start + n * period - get_monotonic_time_stamp()) / 1e6))
+
+    def generate(self):
+        """
+        Generate gaze samples forever.
+        Usually, users don't have to call this method.
+        """
+        random = self.random
+        dt = 1.0 / self.frequency
+        position = random.uniform(0.1, 0.9, 2)
+        pupil = 3.5
+        while True:
+            target = random.uniform(0.1, 0.9, 2)
+            fixation = int(random.uniform(0.15, 0.4) / dt) + 1
+            saccade = int(random.uniform(0.02, 0.06) / dt) + 1
+            drift = np.cumsum(random.normal(0, self.drift * math.sqrt(dt), (fixation, 2)), axis=0)
+            path = list(position + drift + random.normal(0, self.noise, (fixation, 2)))
+            start = path[-1]
+            path += [start + (target - start) * (i + 1) / saccade + random.normal(0, self.noise, 2)
+                     for i in range(saccade)]
+            position = target
+            blink = random.uniform() < self.blink_rate * (fixation + saccade) * dt
+            blink_start = random.randint(len(path)) if blink else len(path)
+            blink_stop = blink_start + int(random.uniform(0.1, 0.3) / dt)
+            for i, point in enumerate(path):
+                pupil = min(5.0, max(2.0, pupil + random.normal(0, 0.01)))
+                valid = [not blink_start <= i < blink_stop and random.uniform() >= self.dropout_rate
+                         for eye in range(2)]
+                yield self.make_sample(point, pupil, valid)
+
+    def make_sample(self, point, pupil, valid):
+        """
+        Make a sample with the attributes of tobii_research.GazeData.
+        Usually, users don't have to call this method.
+        """
+        eyes = []
+        for eye, offset in enumerate((-0.005, 0.005)):
+            # validity values of tobii_research: 1 valid, 0 invalid
+            eyes.append(types.SimpleNamespace(
+                gaze_point=types.SimpleNamespace(
+                    position_on_display_area=(point[0] + offset, point[1]) if valid[eye] else (np.nan, np.nan),
+                    validity=int(valid[eye])),
+                pupil=types.SimpleNamespace(diameter=pupil if valid[eye] else np.nan, validity=int(valid[eye])),
+                gaze_origin=types.SimpleNamespace(
+                    position_in_track_box_coordinates=(0.5 + offset * 10, 0.5, 0.5) if valid[eye] else
+                    (np.nan, np.nan, np.nan),
+                    validity=int(valid[eye]))))
+        return types.SimpleNamespace(left_eye=eyes[0], right_eye=eyes[1], system_time_stamp=0, device_time_stamp=0)
+
+
+class SimulatedCalibration:
+    """
+    Calibration of a <SimulatedEyeTracker>, with the interface of tobii_research.ScreenBasedCalibration: every point
+    succeeds.
+    """
+
+    def __init__(self, eyetracker):
+        self.eyetracker = eyetracker
+        self.points = []
+
+    def enter_calibration_mode(self):
+        self.points = []
+
+    def leave_calibration_mode(self):
+        pass
+
+    def collect_data(self, x, y):
+        self.points.append((x, y))
+        return simulated_tobii_research.CALIBRATION_STATUS_SUCCESS
+
+    def discard_data(self, x, y):
+        self.points = [p for p in self.points if p != (x, y)]
+
+    def compute_and_apply(self):
+        points = [types.SimpleNamespace(position_on_display_area=p, calibration_samples=[]) for p in self.points]
+        return types.SimpleNamespace(status=simulated_tobii_research.CALIBRATION_STATUS_SUCCESS,
+                                     calibration_points=points)
+
+
+class SimulatedResponsePad:
+    """
+    Scripted response pad, with the interface of the pyxid2 devices used by <TaskTemplate>: keys of <keys> are pressed
+    in turn, each one a random reaction time after the previous one.
+    """
+
+    def __init__(self, keys, reaction_time=(0.3, 0.8), seed=None):
+        """
+        :param keys: Keys pressed in turn (e.g. ['6', '0']).
+        :param reaction_time: Range of the time between two presses, in seconds.
+        :param seed: Seed of the random generator.
+        """
+        self.keys = list(keys)
+        self.reaction_time = reaction_time
+        self.random = random.Random(seed)
+        self.responses = collections.deque()
+        self.pressed = 0
+        self.timer_start = time.time()
+        self.next_time = self.timer_start + self.random.uniform(*reaction_time)
+
+    def enable_usb_output(self, mode, enabled):
+        pass
+
+    def reset_rt_timer(self):
+        self.timer_start = time.time()
+
+    def poll_for_response(self):
+        now = time.time()
+        while now >= self.next_time:
+            key = self.keys[self.pressed % len(self.keys)]
+            self.responses.append({'port': 0, 'key': int(key) if str(key).isdigit() else key, 'pressed': True,
+                                   'time': int((self.next_time - self.timer_start) * 1000)})
+            self.pressed += 1
+            self.next_time += self.random.uniform(*self.reaction_time)
+
+    def has_response(self):
+        return len(self.responses) > 0
+
+    def get_next_response(self):
+        return self.responses.popleft()
+
+    def clear_response_queue(self):
+        self.responses.clear()
+
+    def flush_serial_buffer(self):
+        pass
+
+
+class SimulatedKeyboard:
+    """
+    Scripted keyboard, with the interface of psychopy.event used by <TaskTemplate>: keys of <keys> are pressed in turn,
+    one every <interval> seconds.
+    """
+
+    def __init__(self, keys, interval=0.5):
+        self.keys = list(keys)
+        self.interval = interval
+        self.start_time = core.getTime()
+        self.read = 0
+
+    def pending(self, now):
+        pressed = int((now - self.start_time) / self.interval)
+        presses = [(self.keys[i % len(self.keys)], self.start_time + (i + 1) * self.interval)
+                   for i in range(self.read, pressed)]
+        self.read = max(self.read, pressed)
+        return presses
+
+    def getKeys(self, keyList=None, timeStamped=False):
+        presses = [press for press in self.pending(core.getTime()) if keyList is None or press[0] in keyList]
+        if not timeStamped:
+            return [key for key, t in presses]
+        return [[key, self.stamp(t, timeStamped)] for key, t in presses]
+
+    def waitKeys(self, maxWait=float('inf'), keyList=None, timeStamped=False, clearEvents=True):
+        deadline = core.getTime() + maxWait
+        if clearEvents:
+            self.pending(core.getTime())
+        while True:
+            keys = self.getKeys(keyList, timeStamped)
+            if keys:
+                return keys
+            now = core.getTime()
+            if now >= deadline:
+                return None
+            time.sleep(min(deadline - now, self.interval / 10))
+
+    def stamp(self, t, clock):
+        if clock is True:
+            return t
+        return clock.getTime() - (core.getTime() - t)
+
+    def Mouse(self, visible=True, win=None):
+        return types.SimpleNamespace(getPressed=lambda: [0, 0, 0])
+
+
+class SimulatedMonitor:
+    """
+    Monitor of a <SimulatedWindow>.
+    """
+
+    def __init__(self, size_pix, width=53.0, distance=60.0):
+        self.name = 'simulated'
+        self.size_pix = list(size_pix)
+        self.width = width
+        self.distance = distance
+
+    def getWidth(self):
+        return self.width
+
+    def getSizePix(self):
+        return self.size_pix
+
+    def getDistance(self):
+        return self.distance
+
+
+class SimulatedWindow:
+    """
+    Headless window, with the interface of visual.Window used by <TaskTemplate>: flips wait for the next refresh of a
+    simulated <frame_rate> Hz display.
+    """
+
+    def __init__(self, size=(1920, 1080), units='height', frame_rate=60.0, color=None, **kwargs):
+        self.size = np.array(size)
+        self.units = units
+        self.color = color
+        self.monitor = SimulatedMonitor(size)
+        self.monitorFramePeriod = 1.0 / frame_rate
+        self.lastFrameT = core.getTime()
+        self.winHandle = types.SimpleNamespace(set_fullscreen=lambda fullscreen: None)
+        self.mouseVisible = True
+        self.autoLog = True
+
+    def flip(self, clearBuffer=True):
+        now = core.getTime()
+        frames = max(1, math.ceil((now - self.lastFrameT) / self.monitorFramePeriod))
+        self.lastFrameT += frames * self.monitorFramePeriod
+        time.sleep(max(0.0, self.lastFrameT - now))
+        return self.lastFrameT
+
+    def close(self):
+        pass
+
+
+class SimulatedStim:
+    """
+    Stimulus of a <SimulatedWindow>: parameters are kept as attributes, drawing does nothing.
+    """
+
+    def __init__(self, win=None, image=None, **kwargs):
+        self.win = win
+        self.image = image
+        self.pos = (0, 0)
+        self.__dict__.update(kwargs)
+
+    def draw(self, win=None):
+        pass
+
+    def contains(self, x, y=None, units=None):
+        """
+        Test whether a point (or the position of a mouse) is inside the stimulus, in the units of the stimulus: an
+        ellipse of radius <radius> * <size> for circles, a rectangle of <size> (or <width>, <height>) otherwise.
+        Orientation is ignored, and stimuli without a size (texts) contain no point.
+        """
+        if y is None:
+            x, y = x.getPos() if hasattr(x, 'getPos') else x
+        size = self.__dict__.get('size')
+        if size is None:
+            if 'width' not in self.__dict__ or 'height' not in self.__dict__:
+                return False
+            size = (self.width, self.height)
+        width, height = np.broadcast_to(np.asarray(size, dtype=float), 2)
+        dx = x - self.pos[0]
+        dy = y - self.pos[1]
+        if 'radius' in self.__dict__:
+            return bool((dx / (self.radius * width)) ** 2 + (dy / (self.radius * height)) ** 2 <= 1)
+        return bool(abs(dx) <= width / 2 and abs(dy) <= height / 2)
+
+    def __getattr__(self, name):
+        # setPos(value), setText(value)... set the attribute
+        if name.startswith('set') and len(name) > 3:
+            attribute = name[3].lower() + name[4:]
+            return lambda value, *args, **kwargs: setattr(self, attribute, value)
+        raise AttributeError(name)
+
+
+simulated_visual = types.SimpleNamespace(Window=SimulatedWindow, TextStim=SimulatedStim, ImageStim=SimulatedStim,
+                                         SimpleImageStim=SimulatedStim, Rect=SimulatedStim, Circle=SimulatedStim)
+"Replacement of the visual module in simulation, see TaskTemplate.simulated"
+
+simulated_tobii_research = types.SimpleNamespace(
+    get_system_time_stamp=get_monotonic_time_stamp,
+    ScreenBasedCalibration=SimulatedCalibration,
+    EYETRACKER_GAZE_DATA='eyetracker_gaze_data',
+    CALIBRATION_STATUS_SUCCESS='calibration_status_success',
+    CALIBRATION_STATUS_FAILURE='calibration_status_failure',
+    VALIDITY_VALID_AND_USED='validity_valid_and_used')
+"Replacement of the tobii_research module in simulation (same constant values), see TaskTemplate.simulated"
+
+
+class SharedGazeRing:
+    """
+    Ring buffer of gaze samples (see <gaze_dtype>) in shared memory, written by one process and read by others
+    directly, without pipe or pickling.
+
+    The shared block holds the number of samples written so far, followed by <capacity> records. The writer fills
+    the next record, then increments the counter, so readers never see a sample that is not fully written. A sample
+    is overwritten <capacity> samples later, so readers must keep up (see :func:`read`).
+    Requires Python 3.8 (multiprocessing.shared_memory).
+    """
+
+    header_size = 64
+    "Size of the header holding the counter, in bytes (keeps records aligned)"
+
+    def __init__(self, capacity=2 ** 16, name=None):
+        """
+        :param int capacity: Number of samples. Default is 65536 (about 55 s at 1200 Hz).
+        :param str name: Name of an existing ring to attach to. Default is to create a new one.
+        """
+        self.capacity = capacity
+        self.owner = name is None
+        self.memory = shared_memory.SharedMemory(name=name, create=self.owner,
+                                                 size=self.header_size + capacity * gaze_dtype.itemsize)
+        self.name = self.memory.name
+        self.counter = np.ndarray(1, dtype=np.int64, buffer=self.memory.buf)
+        self.records = np.ndarray(capacity, dtype=gaze_dtype, buffer=self.memory.buf, offset=self.header_size)
+        if self.owner:
+            self.counter[0] = 0
+
+    def append(self, record):
+        """
+        Add a sample. Only one process may write in a ring.
+
+        :param record: tuple (t, lx, ly, lp, lv, rx, ry, rp, rv).
+        """
+        count = int(self.counter[0])
+        self.records[count % self.capacity] = record
+        # the counter is updated last, so readers never see a sample that is not fully written
+        self.counter[0] = count + 1
+
+    def __len__(self):
+        return int(self.counter[0])
+
+    def read(self, start, stop):
+        """
+        Return a copy of samples <start> to <stop> as a structured array (see <gaze_dtype>).
+
+        :param int start: Index of the first sample.
+        :param int stop: Index after the last sample. Must not be above len(ring).
+        """
+        if stop - start > self.capacity:
+            raise IndexError('gaze samples before {} have been overwritten'.format(stop - self.capacity))
+        records = self.records.take(np.arange(start, stop) % self.capacity)
+        if len(self) - self.capacity > start:
+            # the writer went around the ring during the copy
+            raise IndexError('gaze samples before {} have been overwritten'.format(len(self) - self.capacity))
+        return records
+
+    def latest(self):
+        """
+        Get the latest sample and the one before, as a tuple (record, previous record or None) of tuples (see
+        <gaze_dtype>). Returns None before the first sample.
+        """
+        count = int(self.counter[0])
+        if count == 0:
+            return None
+        previous = self.records[(count - 2) % self.capacity].item() if count > 1 else None
+        return self.records[(count - 1) % self.capacity].item(), previous
+
+    def close(self):
+        """
+        Detach from the shared memory, and free it if this ring created it.
+        """
+        # views on the shared memory must be released before closing it
+        self.counter = None
+        self.records = None
+        self.memory.close()
+        if self.owner:
+            self.memory.unlink()
+
+
+class GazeAcquisition:
+    """
+    Gaze acquisition in a separate process, which owns the eye tracker subscription and writes the samples in a
+    <SharedGazeRing>.
+
+    The Tobii callback then runs in another interpreter, so it does not contend for the GIL with the render loop of
+    this one. Here, a thread takes the new samples from the ring every <poll_interval> seconds, as one array, and
+    gives them to <on_samples>; the latest sample can be read from the ring at any time (see :func:`latest`).
+    It only helps with a free CPU core for the process: on a single core, the process preempts the render loop and
+    the jitter is worse than with the callback in this process (see benchmark.py).
+
+    The process is started with the 'spawn' method, which imports the main module again: the script running the
+    task must be protected by ``if __name__ == '__main__':``.
+    """
+
+    def __init__(self, eyetracker, capacity=2 ** 16, poll_interval=0.005, on_samples=None):
+        """
+        :param eyetracker: tobii_research.EyeTracker or <SimulatedEyeTracker>. The process connects to the same eye
+            tracker.
+        :param int capacity: Number of samples of the ring.
+        :param float poll_interval: Time between two reads of the ring, in seconds.
+        :param on_samples: Function called with each block of new samples (structured array, see <gaze_dtype>), in
+            the reading thread.
+        """
+        self.spec = self.describe(eyetracker)
+        self.capacity = capacity
+        self.poll_interval = poll_interval
+        self.on_samples = on_samples
+        self.ring = None
+        self.process = None
+        self.stop_event = None
+        self.thread = None
+        self.thread_stop = threading.Event()
+        self.drained = 0
+        """Number of samples given to <on_samples>."""
+
+    @staticmethod
+    def describe(eyetracker):
+        """
+        Get what the acquisition process needs to connect to <eyetracker>: ('tobii', address), or ('simulated',
+        frequency, dropout rate, blink rate) for a <SimulatedEyeTracker>.
+        Usually, users don't have to call this method.
+        """
+        if isinstance(eyetracker, SimulatedEyeTracker):
+            return 'simulated', eyetracker.frequency, eyetracker.dropout_rate, eyetracker.blink_rate
+        return 'tobii', eyetracker.address
+
+    def start(self):
+        """
+        Start the acquisition process, and return once it is subscribed to the eye tracker.
+        """
+        context = multiprocessing.get_context('spawn')
+        self.ring = SharedGazeRing(self.capacity)
+        ready = context.Event()
+        self.stop_event = context.Event()
+        self.process = context.Process(target=run_gaze_acquisition, name='GazeAcquisition', daemon=True,
+                                       args=(self.spec, self.ring.name, self.capacity, ready, self.stop_event))
+        self.process.start()
+        while not ready.wait(0.1):
+            if not self.process.is_alive():
+                self.ring.close()
+                raise RuntimeError('gaze acquisition process failed (exit code {})'.format(self.process.exitcode))
+        self.thread_stop.clear()
+        self.thread = threading.Thread(target=self.run, name='GazeAcquisition', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the acquisition process, give the last samples to <on_samples> and free the ring.
+        """
+        self.stop_event.set()
+        self.process.join()
+        self.thread_stop.set()
+        self.thread.join()
+        self.drain()
+        self.ring.close()
+
+    def run(self):
+        while not self.thread_stop.wait(self.poll_interval):
+            self.drain()
+
+    def drain(self):
+        """
+        Give the samples written since the last call to <on_samples>.
+        Usually, users don't have to call this method.
+        """
+        count = len(self.ring)
+        if count > self.drained:
+            records = self.ring.read(self.drained, count)
+            self.drained = count
+            if self.on_samples is not None:
+                self.on_samples(records)
+
+    def latest(self):
+        """
+        Get the latest sample and the one before, read from the ring (see :func:`SharedGazeRing.latest`).
+        """
+        return self.ring.latest()
+
+
+def run_gaze_acquisition(spec, ring_name, capacity, ready, stop):
+    """
+    Main function of the process of <GazeAcquisition>: write the gaze samples of the eye tracker in the ring until
+    <stop> is set.
+    Usually, users don't have to call this function.
+
+    :param spec: Eye tracker, see :func:`GazeAcquisition.describe`.
+    :param str ring_name: Name of the <SharedGazeRing>.
+    :param int capacity: Number of samples of the ring.
+    :param ready: Event set once subscribed.
+    :param stop: Event to set to stop.
+    """
+    ring = SharedGazeRing(capacity, ring_name)
+    if spec[0] == 'simulated':
+        sdk = simulated_tobii_research
+        eyetracker = SimulatedEyeTracker(*spec[1:])
+    else:
+        sdk = tobii_research
+        eyetracker = tobii_research.EyeTracker(spec[1])
+    append = ring.append
+
+    def on_gaze_data(gaze_data):
+        left = gaze_data.left_eye
+        right = gaze_data.right_eye
+        left_point = left.gaze_point
+        right_point = right.gaze_point
+        append((gaze_data.system_time_stamp,
+                left_point.position_on_display_area[0], left_point.position_on_display_area[1],
+                left.pupil.diameter, left_point.validity,
+                right_point.position_on_display_area[0], right_point.position_on_display_area[1],
+                right.pupil.diameter, right_point.validity))
+
+    eyetracker.subscribe_to(sdk.EYETRACKER_GAZE_DATA, on_gaze_data)
+    ready.set()
+    stop.wait()
+    eyetracker.unsubscribe_from(sdk.EYETRACKER_GAZE_DATA, on_gaze_data)
+    ring.close()
+
+
+class SessionJournal:
+    """
+    Append-only journal of a session, one JSON object per line, so that it survives a crash of the task or of the
+    computer. Entries are serialized and written by the background thread of a <CsvWriter>, and forced to the disk
+    according to its <fsync> policy, so the caller never waits for the disk.
+
+    Each entry has a "type" and a "time" (time.time()): 'session' first, with the participant and file name,
+    'trial_start' with the states of the random generators (see :func:`get_random_state`), 'trial_end' with the rows
+    written by update_csv during the trial, the range of its gaze samples in the recording and the number of samples
+    of the recording already written to the gaze data file, 'recording' when a recording stops, with the gaze data file
+    and the Tobii timestamp and session time (see <ClockSync>) of its TimeStamp 0, 'resume' when the session is
+    resumed (see <TaskTemplate.resume>), 'error' if a trial raised an exception, and 'end'.
+    """
+
+    def __init__(self, filename, fsync='batch'):
+        """
+        :param str filename: Name of the journal. An existing journal is continued.
+        :param fsync: When entries are forced to the disk (see <CsvWriter>).
+        """
+        self.filename = filename
+        if os.path.exists(filename):
+            # a line cut by a crash is removed, so that the next entry starts on its own line
+            with open(filename, 'rb+') as f:
+                content = f.read()
+                if content and not content.endswith(b'\n'):
+                    f.truncate(content.rfind(b'\n') + 1)
+        self.writer = CsvWriter(filename, fsync=fsync, append=True)
+
+    def write(self, entry_type, **values):
+        """
+        Queue an entry.
+
+        :param str entry_type: Type of the entry.
+        :param values: Values of the entry, serializable to JSON. They must not be modified afterwards.
+        """
+        values['type'] = entry_type
+        values['time'] = time.time()
+        self.writer.write(lambda: json.dumps(values) + '\n')
 
+    def flush(self):
+        """
+        Wait until the entries queued so far are written.
+        """
+        self.writer.flush()
 
-def cm2deg(cm, monitor, correctFlat=False):
+    def close(self):
+        self.writer.close()
+
+    @staticmethod
+    def load(filename):
+        """
+        Read the entries of a journal. A last line cut by a crash is ignored.
+
+        :return: list of dict.
+        """
+        entries = []
+        with open(filename) as f:
+            for line in f:
+                try:
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break
+        return entries
+
+    @staticmethod
+    def get_random_state(generator=None):
+        """
+        Get the states of Python's random module, of NumPy's global generator and of <generator> (a random.Random) if
+        given, as a dict serializable to JSON.
+        """
+        version, internal, gauss = random.getstate()
+        name, keys, position, has_gauss, cached = np.random.get_state()
+        state = {'random': [version, list(internal), gauss],
+                 'numpy': [name, keys.tolist(), position, has_gauss, cached]}
+        if generator is not None:
+            version, internal, gauss = generator.getstate()
+            state['generator'] = [version, list(internal), gauss]
+        return state
+
+    @staticmethod
+    def set_random_state(state, generator=None):
+        """
+        Restore states got by :func:`get_random_state`.
+        """
+        version, internal, gauss = state['random']
+        random.setstate((version, tuple(internal), gauss))
+        name, keys, position, has_gauss, cached = state['numpy']
+        np.random.set_state((name, np.array(keys, dtype=np.uint32), position, has_gauss, cached))
+        if generator is not None and 'generator' in state:
+            version, internal, gauss = state['generator']
+            generator.setstate((version, tuple(internal), gauss))
+
+
+def balanced_latin_square(n, row):
     """
-    Bug-fixed version of psychopy.tools.monitorunittools.cm2deg
-    (PsychoPy version<=1.85.1).
+    Get a row of a balanced Latin square of order <n> (Williams design): across rows, each level is at each position
+    as often as the others, and follows each other level as often. For odd <n>, the square has 2 * n rows, the last n
+    being the first ones reversed.
+
+    :param int n: Number of levels.
+    :param int row: Row number, e.g. participant number. Rows repeat after n (even n) or 2 * n (odd n) rows.
+    :return: list of level indices.
     """
+    base = [0] + [(k + 1) // 2 if k % 2 == 1 else n - k // 2 for k in range(1, n)]
+    order = [(level + row) % n for level in base]
+    if n % 2 == 1 and (row // n) % 2 == 1:
+        order.reverse()
+    return order
 
-    if not isinstance(monitor, monitors.Monitor):
-        msg = ("cm2deg requires a monitors.Monitor object as the second "
-               "argument but received %s")
-        raise ValueError(msg % str(type(monitor)))
-    dist = monitor.getDistance()
-    if dist is None:
-        msg = "Monitor %s has no known distance (SEE MONITOR CENTER)"
-        raise ValueError(msg % monitor.name)
-    if correctFlat:
-        return np.degrees(np.arctan(cm / dist))
+
+class TrialSequence:
+    """
+    Plan of the trials of a session, generated at once from a table of conditions.
+
+    Each block holds every condition <repetitions> times, in random order. With <block_factor>, the design is blocked:
+    each block holds the conditions of one level of that factor, and the order of the levels is counterbalanced
+    across participants with a balanced Latin square. Otherwise the design is interleaved: every block mixes all the
+    conditions. The orders of all the blocks of the same size are drawn at once with NumPy. With <max_repeats>, runs
+    of the same value of <repeat_factor> longer than <max_repeats> are found for all blocks at once, and broken by
+    swapping trials within their block, or if swaps fail, by drawing the order of the block again trial by trial.
+    Runs are also limited across the boundaries of blocks: a block continuing the run that ends the previous one is
+    drawn again trial by trial.
+
+    Trials are dicts with the columns of their condition, and 'trial', 'block' and 'condition' (index of the condition
+    in the table). They are built once, so getting one is a list lookup.
+    """
+
+    def __init__(self, conditions, repetitions=1, blocks=1, block_factor=None, max_repeats=None, repeat_factor=None,
+                 participant=0, seed=None):
+        """
+        :param conditions: Table of conditions: dict of columns (lists of the same length), or list of dicts.
+        :param int repetitions: Number of times each condition is in a block.
+        :param int blocks: Number of blocks. With <block_factor>, number of blocks of each level.
+        :param str block_factor: Column whose levels define the blocks (blocked design). Default is interleaved.
+        :param int max_repeats: Maximum number of consecutive trials with the same value of <repeat_factor>.
+        :param str repeat_factor: Column constrained by <max_repeats>. Default is the condition itself.
+        :param participant: Participant number or identifier, which selects the row of the Latin square.
+        :param seed: Seed of the random orders. Default is derived from <participant>, so that a participant gets the
+            same plan in every session (e.g. when resuming).
+        """
+        if isinstance(conditions, dict):
+            self.columns = {name: list(values) for name, values in conditions.items()}
+        else:
+            self.columns = {name: [condition[name] for condition in conditions] for name in conditions[0]}
+        n = len(next(iter(self.columns.values())))
+        if isinstance(participant, int):
+            number = participant
+        elif str(participant).isdigit():
+            number = int(participant)
+        else:
+            number = int(hashlib.sha1(str(participant).encode()).hexdigest()[:8], 16)
+        self.participant = number
+        self.random = np.random.RandomState(seed if seed is not None else number % 2 ** 32)
+
+        if block_factor is None:
+            groups = [np.arange(n)]
+            block_groups = [0] * blocks
+        else:
+            values = self.columns[block_factor]
+            levels = list(dict.fromkeys(values))
+            groups = [np.array([i for i in range(n) if values[i] == level]) for level in levels]
+            block_groups = balanced_latin_square(len(levels), number) * blocks
+
+        if max_repeats is not None:
+            if repeat_factor is None:
+                codes = np.arange(n)
+            else:
+                values = self.columns[repeat_factor]
+                index = {value: code for code, value in enumerate(dict.fromkeys(values))}
+                codes = np.array([index[value] for value in values])
+        orders = [None] * len(block_groups)
+        for group_number, group in enumerate(groups):
+            positions = [k for k, g in enumerate(block_groups) if g == group_number]
+            if not positions:
+                continue
+            # one row per block: all the permutations are drawn at once
+            trials = np.repeat(group, repetitions)
+            permutations = np.argsort(self.random.random_sample((len(positions), len(trials))), axis=1)
+            group_orders = trials[permutations]
+            if max_repeats is not None:
+                for k in np.nonzero(self.has_long_runs(codes[group_orders], max_repeats))[0]:
+                    group_orders[k] = self.break_runs(group_orders[k], codes, max_repeats)
+            for k, position in enumerate(positions):
+                orders[position] = group_orders[k]
+        if max_repeats is not None:
+            for position in range(1, len(orders)):
+                # the last trials of the previous block, which may start a run
+                previous = codes[orders[position - 1]][-max_repeats:]
+                if self.has_long_runs(np.concatenate([previous, codes[orders[position]]])[np.newaxis], max_repeats)[0]:
+                    orders[position] = self.build_order(orders[position], codes, max_repeats, previous)
+
+        self.condition = np.concatenate(orders)
+        """Condition index of each trial."""
+        self.block = np.repeat(np.arange(len(orders)), [len(order) for order in orders])
+        """Block number of each trial."""
+        names = ['trial', 'block', 'condition'] + list(self.columns)
+        values = [np.asarray(self.columns[name] + [None], dtype=object)[:-1][self.condition].tolist()
+                  for name in self.columns]
+        self.trials = [dict(zip(names, row)) for row in zip(range(len(self.condition)), self.block.tolist(),
+                                                           self.condition.tolist(), *values)]
+
+    @staticmethod
+    def has_long_runs(codes, max_repeats):
+        """
+        Find the rows of <codes> (2d array, one row per block) having more than <max_repeats> equal values in a row.
+        Usually, users don't have to call this method.
+        """
+        same = np.zeros((codes.shape[0], codes.shape[1]), dtype=np.int32)
+        same[:, 1:] = codes[:, 1:] == codes[:, :-1]
+        # number of equal neighbours in each window of max_repeats pairs
+        counts = np.cumsum(same, axis=1)
+        windows = counts[:, max_repeats:] - counts[:, :-max_repeats]
+        return np.any(windows == max_repeats, axis=1)
+
+    def break_runs(self, order, codes, max_repeats, tries=100):
+        """
+        Break the runs of an order longer than <max_repeats> by swapping their trials with trials of other values, or
+        draw the order again with :func:`build_order` if swaps fail.
+        Usually, users don't have to call this method.
+        """
+        order = order.copy()
+        values = codes[order]
+
+        def run_bounds(i):
+            start = i
+            while start > 0 and values[start - 1] == values[i]:
+                start -= 1
+            stop = i + 1
+            while stop < len(values) and values[stop] == values[i]:
+                stop += 1
+            return start, stop
+
+        def run_length(i):
+            start, stop = run_bounds(i)
+            return stop - start
+
+        for attempt in range(tries):
+            long_runs = self.has_long_runs(values[np.newaxis], max_repeats)[0]
+            if not long_runs:
+                return order
+            same = np.r_[False, values[1:] == values[:-1]]
+            run_start = np.maximum.accumulate(np.where(same, 0, np.arange(len(values))))
+            moved = False
+            # from left to right, one of the trials of a run reaching max_repeats + 1 is swapped with a trial of
+            # another value, without making another run too long
+            for i in np.nonzero(np.arange(len(values)) - run_start >= max_repeats)[0]:
+                start = run_bounds(i)[0]
+                if i - start < max_repeats:
+                    continue
+                candidates = self.random.randint(len(values), size=64).tolist()
+                swapped = False
+                for k in range(i, start, -1):
+                    for j in candidates:
+                        if values[j] == values[k]:
+                            continue
+                        order[k], order[j] = order[j], order[k]
+                        values[k], values[j] = values[j], values[k]
+                        if (run_length(k) <= max_repeats and run_length(j) <= max_repeats
+                                and i - run_bounds(i)[0] < max_repeats):
+                            swapped = True
+                            break
+                        order[k], order[j] = order[j], order[k]
+                        values[k], values[j] = values[j], values[k]
+                    if swapped:
+                        moved = True
+                        break
+            if not moved:
+                break
+        return self.build_order(order, codes, max_repeats)
+
+    def build_order(self, order, codes, max_repeats, previous=()):
+        """
+        Draw an order of the trials of <order> trial by trial, with runs of at most <max_repeats>: each trial is drawn
+        at random among the values for which the remaining trials can still be ordered, with the number of remaining
+        trials of each value as weight.
+        Usually, users don't have to call this method.
+
+        :param previous: Codes of the trials preceding the order, e.g. the end of the previous block.
+        """
+        remaining = {}
+        for trial in self.random.permutation(order).tolist():
+            remaining.setdefault(int(codes[trial]), []).append(trial)
+        run_value, run_length = None, 0
+        for value in np.asarray(previous).tolist():
+            run_length = run_length + 1 if value == run_value else 1
+            run_value = value
+
+        result = []
+        for position in range(len(order)):
+            total = len(order) - position - 1
+            candidates = []
+            for value, trials in remaining.items():
+                length = run_length + 1 if value == run_value else 1
+                if not trials or length > max_repeats:
+                    continue
+                # every value must still fit in runs of max_repeats between the trials of the other values
+                if all(len(others) - (other == value) <= max_repeats * (total - len(others) + (other == value) + 1)
+                       - (length if other == value else 0) for other, others in remaining.items()):
+                    candidates.append(value)
+            if not candidates:
+                raise ValueError('cannot order the trials with at most {} repeats'.format(max_repeats))
+            weights = np.array([len(remaining[value]) for value in candidates], dtype=float)
+            value = candidates[self.random.choice(len(candidates), p=weights / weights.sum())]
+            run_length = run_length + 1 if value == run_value else 1
+            run_value = value
+            result.append(remaining[value].pop())
+        return np.array(result, dtype=np.asarray(order).dtype)
+
+    def __len__(self):
+        return len(self.trials)
+
+    def __getitem__(self, no_trial):
+        return self.trials[no_trial]
+
+    def save(self, filename):
+        """
+        Write the plan in a CSV file, one row per trial.
+        """
+        writer = CsvWriter(filename, list(self.trials[0]) if self.trials else [], fsync='close')
+        for trial in self.trials:
+            writer.write_row(trial.values())
+        writer.close()
+
+
+def weibull(x, threshold, slope):
+    """
+    Weibull detection function on intensities in dB, as in QUEST+: 1 - exp(-10 ** (slope * (x - threshold) / 20)).
+    """
+    return 1 - np.exp(-10 ** (slope * (x - threshold) / 20.0))
+
+
+def logistic(x, threshold, slope):
+    """
+    Logistic detection function: 1 / (1 + exp(-slope * (x - threshold))).
+    """
+    return 1 / (1 + np.exp(-slope * (x - threshold)))
+
+
+class QuestPlus:
+    """
+    QUEST+ adaptive procedure (Watson, 2017) for a task with correct and incorrect responses, on grids of intensities
+    and of psychometric function parameters (threshold, slope, lapse rate).
+
+    The probabilities of both responses for every intensity and parameter set are computed once, with their terms of
+    the entropy, as matrices of shape (parameter sets, 2 * intensities). Updating the posterior on a response is then
+    one multiplication, and choosing the intensity which minimizes the expected entropy of the posterior is three
+    matrix-vector products: a few milliseconds for 100 intensities and 10,000 parameter sets, done before the trial
+    by TaskTemplate.
+    """
+
+    def __init__(self, intensities, thresholds, slopes=(3.5,), lapses=(0.01,), guess=0.5, function=weibull,
+                 prior=None):
+        """
+        :param intensities: Possible intensities of the stimulus.
+        :param thresholds: Grid of thresholds.
+        :param slopes: Grid of slopes.
+        :param lapses: Grid of lapse rates.
+        :param float guess: Guess rate, e.g. 0.5 for a two alternative forced choice.
+        :param function: Detection function f(x, threshold, slope) working on arrays, e.g. <weibull> (intensities in
+            dB) or <logistic>. The probability of a correct response is guess + (1 - guess - lapse) * f.
+        :param prior: Prior probability of the parameter sets, array of shape (len(thresholds), len(slopes),
+            len(lapses)). Default is uniform.
+        """
+        self.intensities = np.asarray(intensities, dtype=float)
+        self.grid = (np.asarray(thresholds, dtype=float), np.asarray(slopes, dtype=float),
+                     np.asarray(lapses, dtype=float))
+        threshold, slope, lapse = [values.ravel()[:, np.newaxis]
+                                   for values in np.meshgrid(*self.grid, indexing='ij')]
+        correct = guess + (1 - guess - lapse) * function(self.intensities[np.newaxis], threshold, slope)
+        self.likelihood = np.concatenate([1 - correct, correct], axis=1)
+        """Probability of each response (incorrect then correct, by intensity), for each parameter set."""
+        self.likelihood_entropy = self.likelihood * np.log(np.where(self.likelihood > 0, self.likelihood, 1))
+        if prior is None:
+            prior = np.ones(len(threshold))
+        self.posterior = np.asarray(prior, dtype=float).ravel() / np.sum(prior)
+        self.next = None
+        self.presented = []
+        """Intensities presented."""
+        self.responses = []
+        """Responses: 1 correct, 0 incorrect."""
+
+    def next_intensity(self):
+        """
+        Get the intensity which minimizes the expected entropy of the posterior after the next response. It is
+        computed once per trial.
+        """
+        if self.next is None:
+            posterior = self.posterior
+            p_response = posterior @ self.likelihood
+            log_posterior = np.log(np.where(posterior > 0, posterior, 1))
+            # sum over responses of p log p - sum of posterior * likelihood * log(posterior * likelihood)
+            terms = (p_response * np.log(np.where(p_response > 0, p_response, 1))
+                     - posterior @ self.likelihood_entropy - (posterior * log_posterior) @ self.likelihood)
+            n = len(self.intensities)
+            self.next = int(np.argmin(terms[:n] + terms[n:]))
+        return self.intensities[self.next]
+
+    def update(self, intensity, response):
+        """
+        Update the posterior on a response.
+
+        :param float intensity: Intensity presented (the nearest of <intensities> is used).
+        :param response: True or 1 if correct.
+        """
+        index = int(np.argmin(np.abs(self.intensities - intensity)))
+        posterior = self.posterior * self.likelihood[:, index + len(self.intensities) * int(bool(response))]
+        self.posterior = posterior / posterior.sum()
+        self.next = None
+        self.presented.append(float(intensity))
+        self.responses.append(int(bool(response)))
+
+    def get_estimate(self, method='mean'):
+        """
+        Get the estimate of the parameters, as a dict with keys 'threshold', 'slope' and 'lapse'.
+
+        :param str method: 'mean' (mean of the posterior) or 'mode' (parameter set with the highest probability).
+        """
+        posterior = self.posterior.reshape([len(values) for values in self.grid])
+        if method == 'mode':
+            index = np.unravel_index(np.argmax(posterior), posterior.shape)
+            values = [grid[i] for grid, i in zip(self.grid, index)]
+        elif method == 'mean':
+            values = [np.sum(posterior.sum(axis=tuple(a for a in range(3) if a != axis)) * grid)
+                      for axis, grid in enumerate(self.grid)]
+        else:
+            raise ValueError('method must be \'mean\' or \'mode\'')
+        return dict(zip(('threshold', 'slope', 'lapse'), [float(value) for value in values]))
+
+    def get_state(self):
+        """
+        Get the state of the procedure as a dict of arrays (see :func:`set_state`).
+        """
+        return {'posterior': self.posterior, 'presented': np.array(self.presented),
+                'responses': np.array(self.responses, dtype=np.int8)}
+
+    def set_state(self, state):
+        """
+        Restore a state got by :func:`get_state`, of a procedure with the same grids.
+        """
+        if state['posterior'].shape != self.posterior.shape:
+            raise ValueError('posterior of {} parameter sets does not match the grid of {}'.format(
+                len(state['posterior']), len(self.posterior)))
+        self.posterior = np.array(state['posterior'], dtype=float)
+        self.presented = state['presented'].tolist()
+        self.responses = state['responses'].tolist()
+        self.next = None
+
+
+class Staircase:
+    """
+    Transformed up-down staircase: the intensity goes down one step after <down> correct responses in a row, and up
+    one step after <up> incorrect ones (2-down 1-up converges on 70.7% correct). The step size is taken from <steps>,
+    moving to the next one at each reversal. It has the interface of <QuestPlus>.
+    """
+
+    def __init__(self, start, steps, down=2, up=1, min_intensity=-np.inf, max_intensity=np.inf, reversals=6):
+        """
+        :param float start: First intensity.
+        :param steps: Step sizes, from the first reversal to the last one; the last one is kept afterwards.
+        :param int down: Number of correct responses in a row to decrease the intensity.
+        :param int up: Number of incorrect responses in a row to increase the intensity.
+        :param float min_intensity: Minimum intensity.
+        :param float max_intensity: Maximum intensity.
+        :param int reversals: Number of last reversals averaged by :func:`get_estimate`.
+        """
+        self.steps = list(steps)
+        self.down = down
+        self.up = up
+        self.min_intensity = min_intensity
+        self.max_intensity = max_intensity
+        self.reversals_averaged = reversals
+        self.intensity = start
+        self.direction = 0
+        self.correct = 0
+        self.incorrect = 0
+        self.reversals = []
+        """Intensities at the reversals."""
+        self.presented = []
+        self.responses = []
+
+    def next_intensity(self):
+        """
+        Get the intensity of the next trial.
+        """
+        return self.intensity
+
+    def update(self, intensity, response):
+        """
+        Update the staircase on a response.
+
+        :param float intensity: Intensity presented.
+        :param response: True or 1 if correct.
+        """
+        self.presented.append(float(intensity))
+        self.responses.append(int(bool(response)))
+        if response:
+            self.correct += 1
+            self.incorrect = 0
+            if self.correct >= self.down:
+                self.move(-1)
+        else:
+            self.incorrect += 1
+            self.correct = 0
+            if self.incorrect >= self.up:
+                self.move(1)
+
+    def move(self, direction):
+        """
+        Move the intensity one step down (-1) or up (1).
+        Usually, users don't have to call this method.
+        """
+        if self.direction != 0 and direction != self.direction:
+            self.reversals.append(self.intensity)
+        self.direction = direction
+        step = self.steps[min(len(self.reversals), len(self.steps) - 1)]
+        self.intensity = min(self.max_intensity, max(self.min_intensity, self.intensity + direction * step))
+        self.correct = 0
+        self.incorrect = 0
+
+    def get_estimate(self, method='mean'):
+        """
+        Get the estimate of the threshold, mean of the last reversals, as a dict with key 'threshold' (NaN before the
+        first reversal).
+        """
+        reversals = self.reversals[-self.reversals_averaged:]
+        return {'threshold': float(np.mean(reversals)) if reversals else np.nan}
+
+    def get_state(self):
+        """
+        Get the state of the staircase as a dict of arrays (see :func:`set_state`).
+        """
+        return {'counters': np.array([self.intensity, self.direction, self.correct, self.incorrect]),
+                'reversals': np.array(self.reversals), 'presented': np.array(self.presented),
+                'responses': np.array(self.responses, dtype=np.int8)}
+
+    def set_state(self, state):
+        """
+        Restore a state got by :func:`get_state`.
+        """
+        intensity, direction, correct, incorrect = state['counters'].tolist()
+        self.intensity = intensity
+        self.direction = int(direction)
+        self.correct = int(correct)
+        self.incorrect = int(incorrect)
+        self.reversals = state['reversals'].tolist()
+        self.presented = state['presented'].tolist()
+        self.responses = state['responses'].tolist()
+
+
+def as_gaze_array(gaze_data):
+    """
+    Return gaze records as a structured array (see <gaze_dtype>).
+
+    :param gaze_data: <GazeBuffer> or list of (t, lx, ly, lp, lv, rx, ry, rp, rv) tuples.
+    """
+    if isinstance(gaze_data, GazeBuffer):
+        return gaze_data.to_array()
+    return np.array(gaze_data, dtype=gaze_dtype)
+
+
+def format_rows(table, row_format, block_size=8192, texts=None):
+    """
+    Format the rows of a 2D array with <row_format>, <block_size> rows at a time.
+    Each block is formatted by a single % operation, which is much faster than formatting rows one by one.
+
+    :param table: 2D array, one row per line of output.
+    :param str row_format: % format of one row, including its line ending.
+    :param int block_size: Number of rows per yielded text block.
+    :param texts: Optional array of objects appended as a last column (e.g. event names).
+    """
+    for start in range(0, len(table), block_size):
+        block = table[start:start + block_size]
+        if texts is not None:
+            values = np.empty((len(block), block.shape[1] + 1), dtype=object)
+            values[:, :-1] = block
+            values[:, -1] = texts[start:start + block_size]
+            block = values
+        yield (row_format * len(block)) % tuple(block.ravel().tolist())
+
+
+def get_event_positions(timestamps, event_timestamps, start=0):
+    """
+    Find, for all events at once, the index of the gaze sample each event is written before when events are
+    embedded in gaze data. An event goes right before the first sample recorded after it, and at most one event
+    goes before each sample. Events left after the last sample get len(timestamps).
+
+    :param timestamps: Sorted Tobii timestamps of gaze samples.
+    :param event_timestamps: Sorted Tobii timestamps of events.
+    :param int start: Lowest position allowed for the first event.
+    """
+    k = np.arange(len(event_timestamps))
+    first_after = np.searchsorted(timestamps, event_timestamps, side='right')
+    first_after[:1] = np.maximum(first_after[:1], start)
+    # positions[k] = max(positions[k - 1] + 1, first_after[k])
+    positions = np.maximum.accumulate(first_after - k) + k
+    return np.minimum(positions, len(timestamps))
+
+
+def write_tsv_header(datafile, embed_events):
+    """
+    Write the header line of a tsv gaze data file.
+
+    :param datafile: File to write to.
+    :param bool embed_events: Whether events are embedded in gaze data.
+    """
+    if embed_events:
+        datafile.write('\t'.join(['TimeStamp',
+                                  'GazePointXLeft',
+                                  'GazePointYLeft',
+                                  'PupilLeft',
+                                  'ValidityLeft',
+                                  'GazePointXRight',
+                                  'GazePointYRight',
+                                  'PupilRight',
+                                  'ValidityRight',
+                                  'GazePointX',
+                                  'GazePointY',
+                                  'Event']) + '\n')
     else:
-        return cm / (dist * 0.017455)
+        datafile.write('\t'.join(['TimeStamp',
+                                  'GazePointXLeft',
+                                  'GazePointYLeft',
+                                  'PupilLeft',
+                                  'ValidityLeft',
+                                  'GazePointXRight',
+                                  'GazePointYRight',
+                                  'PupilRight',
+                                  'ValidityRight',
+                                  'GazePointX',
+                                  'GazePointY']) + '\n')
+
+
+class GazeBinaryFile:
+    """
+    Append-only binary gaze data file, an alternative to the tsv data file.
 
+    Raw gaze records are appended to ``<base>_gaze.npy`` with typed columns (see <gaze_dtype>). Its header is
+    updated at each flush, so the file is always a valid .npy file which analysis code can open without copy with
+    ``numpy.load(..., mmap_mode='r')``. Events are kept in ``<base>_events.npy`` (columns t and event), and the
+    information needed to convert positions in ``<base>_info.json``. See :func:`load_gaze_file` to open the three of
+    them, and :func:`export_tsv` to get the tsv layout.
 
-def pix2deg(pixels, monitor, correctFlat=False):
+    Each recording written to the file is a segment (see :func:`start_segment`). The samples and events of each
+    segment, and its shift, are listed in ``info['segments']`` as dictionaries with keys 'start' and 'stop' (sample
+    indices), 'events_start', 'events_stop' (event indices) and 'shift'.
     """
-    Bug-fixed version of psychopy.tools.monitorunittools.pix2deg
-    (PsychoPy version<=1.85.1).
+
+    header_size = 512
+    """Size reserved for the .npy header, so that it can be rewritten in place when samples are added."""
+
+    def __init__(self, filename, info=None):
+        """
+        :param str filename: Name of the data file. Its extension is replaced by the suffixes above.
+        :param dict info: Information saved with data (window units and size, monitor...).
+        """
+        self.base = os.path.splitext(filename)[0]
+        self.info = dict(info or {})
+        self.segments = []
+        """Segments of the file, as dictionaries with keys 'start' (first sample), 'events' and 'shift'."""
+        self.count = 0
+        self.gaze_file = open(self.base + '_gaze.npy', 'wb+')
+        self.write_gaze_header()
+
+    def write_gaze_header(self):
+        header = "{{'descr': {!r}, 'fortran_order': False, 'shape': ({},), }}".format(
+            np.lib.format.dtype_to_descr(gaze_dtype), self.count)
+        header = header.ljust(self.header_size - 10 - 1) + '\n'
+        self.gaze_file.seek(0)
+        self.gaze_file.write(b'\x93NUMPY\x01\x00' + np.uint16(len(header)).tobytes() + header.encode('latin1'))
+        self.gaze_file.seek(0, os.SEEK_END)
+
+    def start_segment(self, events, shift=None):
+        """
+        Start a new segment: gaze records appended from now on belong to it.
+
+        :param list events: Events of the segment, as (timestamp, event) tuples. The list can grow until the next
+            segment starts, events are read at each flush.
+        :param shift: Shift of the recording (see <TaskTemplate.shift>).
+        """
+        self.segments.append({'start': self.count, 'events': events, 'shift': shift})
+
+    def append(self, records):
+        """
+        Add gaze records at the end of the current segment.
+
+        :param records: structured array of gaze records (see <gaze_dtype>).
+        """
+        self.gaze_file.write(np.ascontiguousarray(records, dtype=gaze_dtype).tobytes())
+        self.count += len(records)
+
+    def flush(self):
+        """
+        Make samples written so far readable: update the .npy header, and write events and information.
+        """
+        self.write_gaze_header()
+        self.gaze_file.flush()
+        all_events = []
+        segments = []
+        for i, segment in enumerate(self.segments):
+            stop = self.segments[i + 1]['start'] if i + 1 < len(self.segments) else self.count
+            events = list(segment['events'])
+            segments.append({'start': segment['start'], 'stop': stop, 'events_start': len(all_events),
+                             'events_stop': len(all_events) + len(events), 'shift': segment['shift']})
+            all_events.extend(events)
+        self.info['segments'] = segments
+        width = max([len(str(e[1])) for e in all_events] + [1])
+        events = np.array([(e[0], str(e[1])) for e in all_events],
+                          dtype=[('t', np.int64), ('event', 'U{}'.format(width))])
+        np.save(self.base + '_events.npy', events)
+        with open(self.base + '_info.json', 'w') as info_file:
+            json.dump(self.info, info_file)
+
+    def close(self):
+        self.flush()
+        self.gaze_file.close()
+
+
+def load_gaze_file(filename):
     """
+    Open a binary gaze data file written by <GazeBinaryFile>.
+    Gaze records are memory-mapped, so nothing is read until used.
 
-    scrWidthCm = monitor.getWidth()
-    scrSizePix = monitor.getSizePix()
-    if scrSizePix is None:
-        msg = "Monitor %s has no known size in pixels (SEE MONITOR CENTER)"
-        raise ValueError(msg % monitor.name)
-    if scrWidthCm is None:
-        msg = "Monitor %s has no known width in cm (SEE MONITOR CENTER)"
-        raise ValueError(msg % monitor.name)
-    cmSize = pixels * float(scrWidthCm) / scrSizePix[0]
-    return cm2deg(cmSize, monitor, correctFlat)
+    :param str filename: Name of the data file, as given to :func:`TaskTemplate.open_datafile`.
+    :return: tuple (gaze records, events, info).
+    """
+    base = os.path.splitext(filename)[0]
+    gaze = np.load(base + '_gaze.npy', mmap_mode='r')
+    events = np.load(base + '_events.npy')
+    with open(base + '_info.json') as info_file:
+        info = json.load(info_file)
+    return gaze, events, info
 
 
-default_calibration_target_dot_size = {
-    'pix': 2.0, 'norm': 0.004, 'height': 0.002, 'cm': 0.05,
-    'deg': 0.05, 'degFlat': 0.05, 'degFlatPos': 0.05
-}
-default_calibration_target_disc_size = {
-    'pix': 2.0 * 20, 'norm': 0.004 * 20, 'height': 0.002 * 20, 'cm': 0.05 * 20,
-    'deg': 0.05 * 20, 'degFlat': 0.05 * 20, 'degFlatPos': 0.05 * 20
-}
+def convert_gaze_records(records, start_time, transform):
+    """
+    Convert an array of tobii data to output style, one column at a time.
+    Vectorized version of :func:`TaskTemplate.convert_tobii_record`.
 
-default_key_index_dict = {
-    '1': 0, 'num_1': 0, '2': 1, 'num_2': 1, '3': 2, 'num_3': 2,
-    '4': 3, 'num_4': 3, '5': 4, 'num_5': 4, '6': 5, 'num_6': 5,
-    '7': 6, 'num_7': 6, '8': 7, 'num_8': 7, '9': 8, 'num_9': 8
-}
+    :param records: structured array of gaze records (see <gaze_dtype>).
+    :param start_time: Tobii's timestamp when recording was started.
+    :param transform: <CoordinateTransform> of the window.
+    :return: list of the 11 output columns.
+    """
+
+    lx, ly = transform.to_psychopy_xy(records['lx'], records['ly'])
+    rx, ry = transform.to_psychopy_xy(records['rx'], records['ry'])
+    lv = records['lv']
+    rv = records['rv']
+
+    not_detected = (lv == 0) & (rv == 0)
+    ave_x = np.where(lv == 0, rx, np.where(rv == 0, lx, (lx + rx) / 2.0))
+    ave_y = np.where(lv == 0, ry, np.where(rv == 0, ly, (ly + ry) / 2.0))
+    ave_x[not_detected] = np.nan
+    ave_y[not_detected] = np.nan
+
+    return [(records['t'] - start_time) / 1000.0,
+            lx, ly, records['lp'], lv,
+            rx, ry, records['rp'], rv,
+            ave_x, ave_y]
+
+
+def interpolate_gaze_records(records, positions, t):
+    """
+    Interpolate gaze data at several timestamps at once, between records[positions - 1] and records[positions].
+    Vectorized version of :func:`TaskTemplate.interpolate_gaze_data`, with the same validity rules for each eye.
+    Where positions is 0 or len(records), the result is an invalid record (NaN values, validity 0).
+
+    :param records: structured array of gaze records (see <gaze_dtype>).
+    :param positions: index of the record following each timestamp.
+    :param t: timestamps to calculate interpolation.
+    """
+
+    result = np.zeros(len(t), dtype=gaze_dtype)
+    for name in ('lx', 'ly', 'lp', 'rx', 'ry', 'rp'):
+        result[name] = np.nan
+    result['t'] = t
+
+    inside = (positions > 0) & (positions < len(records))
+    record1 = records[positions[inside] - 1]
+    record2 = records[positions[inside]]
+    t = t[inside]
+    w1 = (record2['t'] - t) / (record2['t'] - record1['t'])
+    w2 = (t - record1['t']) / (record2['t'] - record1['t'])
+
+    interpolated = np.empty(len(t), dtype=gaze_dtype)
+    interpolated['t'] = t
+    for eye in ('l', 'r'):
+        v1 = record1[eye + 'v']
+        v2 = record2[eye + 'v']
+        both_valid = (v1 != 0) & (v2 != 0)
+        second_only = (v1 == 0) & (v2 != 0)
+        for name in (eye + 'x', eye + 'y', eye + 'p'):
+            interpolated[name] = np.where(both_valid, w1 * record1[name] + w2 * record2[name],
+                                          np.where(second_only, record2[name], record1[name]))
+        interpolated[eye + 'v'] = np.where(both_valid, 1, np.where(second_only, v2, v1))
+    result[inside] = interpolated
+
+    return result
+
+
+class GazeDataWriter:
+    """
+    Write gaze and event data to a data file, one segment of samples at a time.
+
+    :func:`TaskTemplate.flush_data` writes the whole recording as a single segment, and :func:`export_tsv` converts a
+    binary data file the same way. In streaming mode (see <TaskTemplate.streaming>), :func:`start` runs a background
+    thread which writes new samples of <gaze_data> by bounded batches while recording goes on, and releases them from
+    the buffer, so memory stays flat whatever the length of the session. The Tobii callback thread never waits for
+    this thread. The writer only needs its arguments, not a <TaskTemplate>.
+    """
+
+    def __init__(self, datafile, transform, shift=None, event_data=(), embed_events=False, timestamp_start=None,
+                 gaze_data=None, release_limit=None, interval=1.0, batch_size=2 ** 14, latency=100000):
+        """
+        :param datafile: File written to: text file, or <GazeBinaryFile>.
+        :param transform: <CoordinateTransform> used to convert positions.
+        :param shift: Shift of the recording (see <TaskTemplate.shift>), written after the events.
+        :param event_data: Events as (timestamp, event) tuples, sorted by timestamp. In streaming mode, the list can
+            grow while recording.
+        :param bool embed_events: If True, event data is embedded in gaze data.
+        :param timestamp_start: Tobii's timestamp when recording was started. Default is the first sample written.
+        :param gaze_data: <GazeBuffer> written by :func:`write` in streaming mode.
+        :param release_limit: Function returning the index of the first sample which must stay in <gaze_data>
+            after a write (e.g. for AOI statistics), or None. Default is no limit.
+        :param float interval: Maximum time (in seconds) between two writes in streaming mode.
+        :param int batch_size: Number of pending samples which triggers a write, and maximum number of samples
+            converted at once.
+        :param int latency: In streaming mode, samples recorded less than <latency> microseconds before the latest
+            one are kept for the next write, so that events recorded meanwhile are still embedded at the right place.
+        """
+        self.datafile = datafile
+        self.embed_events = embed_events
+        self.event_data = event_data
+        self.shift = shift
+        self.transform = transform
+        self.gaze_data = gaze_data
+        self.release_limit = release_limit
+        self.timestamp_start = timestamp_start
+        self.interval = interval
+        self.batch_size = batch_size
+        self.latency = latency
+        self.samples_written = 0
+        self.events_written = 0
+        self.next_position = 0
+        self.previous_record = None
+        self.segment_started = False
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.flush_request = threading.Event()
+        self.flushed = threading.Event()
+
+    def start(self):
+        """
+        Start writing in a background thread.
+        """
+        self.thread = threading.Thread(target=self.run, name='GazeDataWriter', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        """
+        Stop the background thread, then write all the data left and the end of the file.
+        """
+        self.stop_event.set()
+        self.thread.join()
+        self.write(final=True)
+        self.datafile.flush()
+
+    def flush(self, timeout=None):
+        """
+        Ask the background thread to write the pending samples now, and wait until they are written.
+
+        :param float timeout: Maximum waiting time in seconds. Default is no timeout.
+        :return: True if the samples were written, False if timeout was reached.
+        """
+        self.flushed.clear()
+        self.flush_request.set()
+        return self.flushed.wait(timeout)
+
+    def run(self):
+        last_write = time.time()
+        while not self.stop_event.wait(min(self.interval, 0.05)):
+            pending = len(self.gaze_data) - self.samples_written
+            flush = self.flush_request.is_set()
+            if flush or pending >= self.batch_size or time.time() - last_write >= self.interval:
+                self.flush_request.clear()
+                self.write()
+                self.datafile.flush()
+                last_write = time.time()
+                if flush:
+                    self.flushed.set()
+
+    def write(self, final=False):
+        """
+        Write the samples added to <gaze_data> since the last write, then release them.
+
+        :param bool final: If True, write all the samples and the events left, and end the file. Otherwise, the
+            latest samples are kept for the next write (see <latency>).
+        """
+        gaze_data = self.gaze_data
+        count = len(gaze_data)
+        if count == 0:
+            return
+        latest = gaze_data[count - 1][0]
+
+        while True:
+            stop = min(count, self.samples_written + self.batch_size)
+            records = gaze_data.read(self.samples_written, stop)
+            if not final:
+                records = records[:np.searchsorted(records['t'], latest - self.latency, side='right')]
+                if len(records) == 0:
+                    return
+            if self.timestamp_start is None:
+                if not isinstance(self.datafile, GazeBinaryFile):
+                    write_tsv_header(self.datafile, self.embed_events)
+                self.timestamp_start = int(records['t'][0])
+            self.write_segment(records, final=final and stop == count)
+            gaze_data.release(self.get_release_stop())
+            if stop == count:
+                return
+
+    def get_release_stop(self):
+        """
+        Get the index after the last sample which can be released from the gaze buffer: samples must be written, and
+        not be needed anymore (see <release_limit>).
+        Usually, users don't have to call this method.
+        """
+        stop = self.samples_written
+        limit = self.release_limit() if self.release_limit is not None else None
+        if limit is not None:
+            stop = min(stop, limit)
+        return stop
+
+    def write_segment(self, records, final=False):
+        """
+        Write a segment of samples, following the ones already written, with the events recorded during the segment.
+
+        :param records: structured array of gaze records (see <gaze_dtype>).
+        :param bool final: If True, this is the last segment: the events left and the end of the file are written.
+        """
+        datafile = self.datafile
+
+        if isinstance(datafile, GazeBinaryFile):
+            # raw records are stored as is, conversion is done by export_tsv
+            if not self.segment_started:
+                datafile.start_segment(self.event_data, self.shift)
+                self.segment_started = True
+            datafile.append(records)
+            self.samples_written += len(records)
+            return
+
+        table = np.column_stack(convert_gaze_records(records, self.timestamp_start, self.transform))
+
+        if not self.embed_events:
+            datafile.writelines(format_rows(table, gaze_record_format + '\n'))
+            self.samples_written += len(records)
+            if final:
+                datafile.write('TimeStamp\tEvent\n')
+                datafile.write(''.join('%.1f\t%s\n' % ((e[0] - self.timestamp_start) / 1000.0, e[1])
+                                       for e in self.event_data))
+                datafile.write('Shift\t' + str(self.shift))
+            return
+
+        events = self.event_data[self.events_written:]
+        event_timestamps = np.array([e[0] for e in events], dtype=np.int64)
+        positions = get_event_positions(np.ascontiguousarray(records['t']), event_timestamps, self.next_position)
+        if not final:
+            # events placed after the last sample of the segment are written with the next segment
+            n_events = int(np.searchsorted(positions, len(records)))
+            events = events[:n_events]
+            event_timestamps = event_timestamps[:n_events]
+            positions = positions[:n_events]
+        if self.previous_record is None:
+            event_records = interpolate_gaze_records(records, positions, event_timestamps)
+        else:
+            event_records = interpolate_gaze_records(np.concatenate([self.previous_record, records]),
+                                                          positions + 1, event_timestamps)
+        event_table = np.column_stack(convert_gaze_records(event_records, self.timestamp_start, self.transform))
+
+        # merge event rows and sample rows: event k is output at row positions[k] + k
+        event_rows = positions + np.arange(len(positions))
+        is_event = np.zeros(len(table) + len(event_table), dtype=bool)
+        is_event[event_rows] = True
+        merged = np.empty((len(is_event), table.shape[1]))
+        merged[event_rows] = event_table
+        merged[~is_event] = table
+        texts = np.full(len(merged), '', dtype=object)
+        texts[event_rows] = [e[1] for e in events]
+        datafile.writelines(format_rows(merged, gaze_record_format + '\t%s\n', texts=texts))
+
+        if len(events) > 0:
+            self.next_position = max(0, int(positions[-1]) + 1 - len(records))
+        else:
+            self.next_position = max(0, self.next_position - len(records))
+        if len(records) > 0:
+            self.previous_record = records[-1:].copy()
+        self.samples_written += len(records)
+        self.events_written += len(events)
+
+
+def export_tsv(filename, tsv_filename, embed_events=False):
+    """
+    Write the tsv data file corresponding to a binary data file (see <GazeBinaryFile>), in the same layout as
+    :func:`TaskTemplate.flush_data`: one section per recording, each with its own header, events and shift. Positions
+    are converted with the window units, size and monitor saved with data, so no window is needed.
+
+    :param str filename: Name of the binary data file.
+    :param str tsv_filename: Name of the tsv file to write.
+    :param bool embed_events: If True, event data is embeded in gaze data.
+    """
+    gaze, events, info = load_gaze_file(filename)
+    segments = info.get('segments', [{'start': 0, 'stop': len(gaze), 'events_start': 0,
+                                      'events_stop': len(events), 'shift': info.get('shift')}])
+    transform = CoordinateTransform.from_info(info)
+    with open(tsv_filename, 'w') as tsv_file:
+        for segment in segments:
+            records = gaze[segment['start']:segment['stop']]
+            if len(records) == 0:
+                continue
+            event_data = [(int(e['t']), e['event']) for e in events[segment['events_start']:segment['events_stop']]]
+            writer = GazeDataWriter(tsv_file, transform, segment['shift'], event_data, embed_events,
+                                    timestamp_start=int(records['t'][0]))
+            write_tsv_header(tsv_file, embed_events)
+            writer.write_segment(records, final=True)
 
 
 class TaskTemplate:
@@ -123,10 +3180,105 @@ class TaskTemplate:
     """Text to show when all trials are done, and before the end."""
     csv_headers = []
     """Headers of CSV file. Should be overwritten as it is empty in this template."""
+    csv_fsync = 'batch'
+    """When CSV rows are forced to the disk: 'batch' after each write of the background writer, 'close' only at the
+    end, None never (see CsvWriter)."""
     exp_start_timestamp = time.time()
     "Determine the absolute timestamp of the task"
     response_pad_timestamp = 0
     "Time stamp since the RP has been plugged"
+    response_input = None
+    "Input thread of the response pad, see ResponsePadInput"
+    clock = None
+    "Clock alignment of the session, see ClockSync"
+    clock_sync_interval = 1.0
+    "Time between two clock synchronizations, in seconds"
+    last_response_time = None
+    "Session time (see ClockSync) of the last response returned by get_response or get_response_with_time"
+
+    images_folder = 'img'
+    "Folder of the images used by size, preload_images and create_visual_image"
+    image_cache_folder = 'img/.cache'
+    "Folder of the images fitted to the screen, reused by the next sessions. None disables the disk cache."
+    image_workers = 4
+    "Number of threads decoding images"
+    preload_images_at_start = False
+    """If True, all the images of images_folder are loaded in background threads when the task starts, and kept in
+    memory for the whole session. Otherwise, load the images of a block with preload_images in prepare_block."""
+    image_pipeline = None
+    stimuli_folder = '../img'
+    "Folder indexed by the stimulus catalog, see get_stimulus_catalog"
+    stimulus_catalog = None
+    stimulus_catalog_file = None
+    "File where the stimulus catalog is saved for the next sessions. Default is stimulus_catalog.json in csv_folder"
+    record_frame_timing = False
+    "If True, flips of the window are timed (see FrameTimer) and summarized per trial in <file_name>_frames.csv"
+    frame_drop_threshold = 1.5
+    "Interval above which a frame is dropped, in refresh periods"
+    frame_timer = None
+    frameFile = None
+    prepared_trials = {}
+    "Results of prepare_trial by trial number, as futures"
+    trial_executor = None
+    "Worker thread of prepare_trial"
+    session_seed = None
+    "Seed of the generators of get_trial_random. Default is drawn at the start of the session, and saved in the journal"
+    startup_times = {}
+    "Duration of the startup phases in seconds, see get_startup_report"
+    startup_phase_start = None
+    print_startup_report = False
+    "If True, the startup report (see get_startup_report) is printed at the end of the constructor"
+    device_discovery = None
+    "Result of discover_devices, as a future"
+    adaptive_procedures = {}
+    "Adaptive procedures of the session by name (see QuestPlus, Staircase and add_adaptive_procedure)"
+    trial_sequence = None
+    "Plan of the session (see TrialSequence), from make_trial_sequence"
+    journal = None
+    "Journal of the session (see SessionJournal), <file_name>_journal.jsonl in <csv_folder>"
+    resumed = False
+    "True if the session continues a previous one (see resume)"
+    resume_trial = 0
+    "First trial of resume: the next unfinished trial of the journal"
+    resume_state = None
+    "States of the random generators at the start of resume_trial, from the journal"
+    trial_rows = []
+    "Rows written by update_csv during the current trial"
+    trial_gaze_start = 0
+    "Index of the first gaze sample of the current trial in the current recording, and in its section of the data file"
+    datafile_name = None
+    "Name of the gaze data file, see open_datafile"
+    break_drift_check = False
+    "If True, breaks of check_break end with a drift check (see drift_check) when recording"
+    drift_check_duration = 2.0
+    "Duration of the drift check of breaks, in seconds"
+    drift_offsets = []
+    "Results of the drift checks: list of (trial, x offset, y offset)"
+    break_worker = None
+    "Thread running the tasks of the last break"
+    break_worker_timeout = 5.0
+    "Maximum time waited for the tasks of the last break before the next break or the end of the experiment, in seconds"
+    stimulus_cache_size = 128
+    "Maximum number of stimuli reused by the create_visual_* methods (see StimulusCache). 0 disables the cache."
+    stimulus_cache = None
+
+    simulated = False
+    """If True, the screen, the response pad, the keyboard and the eye tracker are simulated (see SimulatedWindow,
+    SimulatedResponsePad, SimulatedKeyboard, SimulatedEyeTracker), so the task runs without hardware."""
+    simulated_screen_size = (1920, 1080)
+    "Screen size in simulation"
+    simulated_gaze_frequency = 600
+    "Sampling frequency of the simulated eye tracker, in Hz"
+    simulated_dropout_rate = 0.01
+    "Probability of losing one eye on a sample of the simulated eye tracker"
+    simulated_keys = ['space']
+    "Keys pressed in turn on the simulated keyboard"
+    visual = visual
+    "Module of windows and stimuli, replaced by simulated_visual in simulation"
+    tobii_research = tobii_research
+    "Tobii SDK module, replaced by simulated_tobii_research in simulation"
+    event = event
+    "Module of keyboard events, replaced by a SimulatedKeyboard in simulation"
 
     ### EYE TRACKER VARIABLES
     eye_tracker_study = True
@@ -135,17 +3287,70 @@ class TaskTemplate:
     "Set the eye-tracker machine"
     calibration = None
     gaze_data = []
-    "Gaze data which will be saved in the tsv file"
+    "Gaze data which will be saved in the tsv file. Replaced by a <GazeBuffer> when recording starts"
+    gaze_buffer_chunk_size = 2 ** 16
+    "Number of gaze samples allocated at once by the gaze buffer"
     event_data = []
     retry_points = []
     datafile = None
     embed_events = False
     recording = False
+    batch_export = True
+    "If True, gaze data is converted and written column by column. Put False to use the per-record export."
+    datafile_format = 'tsv'
+    "Format of the gaze data file: 'tsv' (text) or 'npy' (binary, see GazeBinaryFile)"
+    streaming = False
+    """If True, gaze data is written to the data file by a background thread during recording, not only at the end.
+    Always on in sessions with a journal (see <journal>), so that gaze data survives a crash."""
+    stream_interval = 1.0
+    "Maximum time (in seconds) between two writes of gaze data in streaming mode"
+    stream_batch_size = 2 ** 14
+    "Number of pending gaze samples which triggers a write in streaming mode"
+    gaze_writer = None
+    "Background writer of gaze data, while recording in streaming mode"
+    coordinate_transform = None
+    "Conversion of positions between Tobii and PsychoPy for the window, see get_coordinate_transform"
+    coordinate_transform_key = None
+    acquisition_process = False
+    "If True, subscribe() starts a separate process owning the eye tracker subscription (see GazeAcquisition)"
+    acquisition_ring_size = 2 ** 16
+    "Number of samples of the shared ring of the acquisition process"
+    acquisition_poll_interval = 0.005
+    "Time between two reads of the shared ring by this process, in seconds"
+    gaze_acquisition = None
+    latest_gaze = None
+    "Latest gaze sample and the one before, replaced at once by the Tobii callback thread"
+    latest_gaze_converted = None
+    gaze_waiter = None
+    "Event set at each gaze sample while wait_for_gaze_in is waiting"
+    gaze_contingent_timestamp = None
+    gaze_latencies = []
+    "Sample-to-display latencies (ms) measured by flip_gaze_contingent"
+    classify_gaze_events = False
+    "If True, fixations and saccades are detected during recording and recorded as events (see GazeEventClassifier)"
+    saccade_velocity_threshold = 30.0
+    "Velocity threshold of saccades, in degrees per second"
+    saccade_velocity_window = 20000
+    "Time window of gaze velocities for the classification of saccades, in microseconds"
+    min_fixation_duration = 60000
+    "Fixations shorter than this duration, in microseconds, are discarded by the classification"
+    gaze_classifier = None
+    "Online fixation and saccade classifier, while recording"
+    event_lock = threading.Lock()
+    "Lock for insertions in event_data, which happen from the main thread and the Tobii callback thread"
+    aois = None
+    "Areas of interest of the current trial, see start_aoi_trial"
+    aoi_trial = None
+    aoi_position = 0
+    aoiFile = None
+    "CSV file of AOI statistics, opened at the first trial with AOIs"
     key_index_dict = default_key_index_dict.copy()
 
-    def __init__(self, csv_folder, launch_example=None):
+    def __init__(self, csv_folder, launch_example=None, resume_from=None):
         """
         :param launch_example: Can overwrite default <self.example> value.
+        :param str resume_from: Journal of a session to continue (see :func:`resume`). The participant dialog is
+            skipped, and the CSV file is written again from the results of the finished trials.
         """
         self.shift = None
         self.right_key_code = None
@@ -157,8 +3362,20 @@ class TaskTemplate:
         self.left_key_code = None
         self.mid_left_key_name = None
 
-        self.win = visual.Window(
-            size=[get_monitors()[0].width, get_monitors()[0].height],
+        startup = time.perf_counter()
+        self.startup_times = {}
+        self.startup_phase_start = startup
+        # the devices are searched while the window is created and the participant fills the dialog
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='discover_devices')
+        self.device_discovery = executor.submit(self.discover_devices)
+        executor.shutdown(wait=False)
+
+        if self.simulated:
+            self.visual = simulated_visual
+            self.event = SimulatedKeyboard(self.simulated_keys)
+            self.tobii_research = simulated_tobii_research
+        self.win = self.visual.Window(
+            size=list(self.get_screen_size()),
             # if needed, change the size in concordance with your monitor
             fullscr=False,
             units="height",
@@ -168,23 +3385,57 @@ class TaskTemplate:
             color=self.bg,
             colorSpace='rgb'
         )
-        exp_info = {'participant': '', "date": data.getDateStr()}
-        gui.DlgFromDict(exp_info, title='Psychopy Task', fixed=["date"])
-        self.participant = exp_info["participant"]
-        self.file_name = exp_info['participant'] + '_' + exp_info['date'][:-7]
-        self.dataFile = open(f"{csv_folder}/{self.file_name}.csv", 'w')
-        self.dataFile.write(",".join(self.csv_headers))
-        self.dataFile.write("\n")
+        self.stimulus_cache = StimulusCache(self.stimulus_cache_size)
+        if self.record_frame_timing:
+            self.enable_frame_timing()
+        self.prepared_trials = {}
+        self.adaptive_procedures = {}
+        self.drift_offsets = []
+        self.gaze_data = GazeBuffer(self.gaze_buffer_chunk_size)
+        self.end_startup_phase('window')
+        if resume_from is not None:
+            entries = SessionJournal.load(resume_from)
+            self.participant = entries[0]['participant']
+            self.file_name = entries[0]['file_name']
+            self.session_seed = entries[0].get('session_seed', self.session_seed)
+        else:
+            exp_info = {'participant': '', "date": data.getDateStr()}
+            if self.simulated:
+                exp_info['participant'] = 'simulated'
+            else:
+                gui.DlgFromDict(exp_info, title='Psychopy Task', fixed=["date"])
+            self.participant = exp_info["participant"]
+            self.file_name = exp_info['participant'] + '_' + exp_info['date'][:-7]
+        self.end_startup_phase('dialog')
+        if self.session_seed is None:
+            self.session_seed = random.SystemRandom().randrange(2 ** 32)
+        self.csv_folder = csv_folder
+        self.dataFile = CsvWriter(f"{csv_folder}/{self.file_name}.csv", self.csv_headers, self.csv_fsync)
+        self.trial_rows = []
+        if resume_from is not None:
+            self.journal = SessionJournal(resume_from, self.csv_fsync)
+            self.load_journal(entries)
+        else:
+            self.journal = SessionJournal(f"{csv_folder}/{self.file_name}_journal.jsonl", self.csv_fsync)
+            self.journal.write('session', participant=self.participant, file_name=self.file_name,
+                               trials=self.trials, session_seed=self.session_seed)
         self.time_stamp_shift = time.time()
+        # without eye tracker, the Tobii SDK is not imported just for its clock
+        self.clock = ClockSync(self.clock_sync_interval,
+                               reference=self.tobii_research.get_system_time_stamp if self.eye_tracker_study
+                               else get_monotonic_time_stamp,
+                               filename=f"{csv_folder}/{self.file_name}_clock.csv", fsync=self.csv_fsync,
+                               append=self.resumed)
+        self.clock.start()
         if launch_example is not None:
             self.launch_example = launch_example
         if self.eye_tracker_study:
             self.calibration_target_dot_size = default_calibration_target_dot_size[self.win.units]
             self.calibration_target_disc_size = default_calibration_target_disc_size[self.win.units]
-            self.calibration_target_dot = visual.Circle(self.win,
+            self.calibration_target_dot = self.visual.Circle(self.win,
                                                         radius=self.calibration_target_dot_size, fillColor='white',
                                                         lineColor=None, lineWidth=1, autoLog=False)
-            self.calibration_target_disc = visual.Circle(self.win,
+            self.calibration_target_disc = self.visual.Circle(self.win,
                                                          radius=self.calibration_target_disc_size,
                                                          fillColor='lime',
                                                          lineColor='white', lineWidth=1, autoLog=False)
@@ -193,18 +3444,92 @@ class TaskTemplate:
             if self.win.units == 'norm':  # fix oval
                 self.calibration_target_dot.setSize([float(self.win.size[1]) / self.win.size[0], 1.0])
                 self.calibration_target_disc.setSize([float(self.win.size[1]) / self.win.size[0], 1.0])
+        self.end_startup_phase('session')
 
         self.init()
+        self.trial_sequence = self.make_trial_sequence()
+        if self.trial_sequence is not None:
+            self.trials = len(self.trial_sequence)
+            self.trial_sequence.save(f"{csv_folder}/{self.file_name}_plan.csv")
+        self.end_startup_phase('init')
+        self.startup_times['total'] = time.perf_counter() - startup
+        if self.print_startup_report:
+            print(self.get_startup_report())
+
+    def end_startup_phase(self, phase):
+        """
+        Record the duration of a startup phase, since the end of the previous one.
+        Usually, users don't have to call this method.
+        """
+        now = time.perf_counter()
+        self.startup_times[phase] = now - self.startup_phase_start
+        self.startup_phase_start = now
+
+    def get_startup_report(self):
+        """
+        Get a report of where the startup time goes: the duration of each phase of the constructor, and the import
+        time of the SDKs (see <LazyModule>). Imports are included in the phase where they happen. Device discovery
+        runs in the background during the window and dialog phases; the main thread only waits for its end
+        ('device wait', part of 'init').
+        """
+        lines = ['Startup:']
+        for phase, duration in self.startup_times.items():
+            lines.append(f"    {phase:<24}{duration * 1000:10.1f} ms")
+        lines.append('Imports:')
+        for name, duration in sorted(import_times.items(), key=lambda item: -item[1]):
+            lines.append(f"    {name:<24}{duration * 1000:10.1f} ms")
+        return '\n'.join(lines)
+
+    def discover_devices(self):
+        """
+        Find the response pad (if <response_pad>) and the eye tracker (if <eye_tracker_study>), importing their SDKs.
+        Run in a background thread by the constructor, see :func:`get_devices`.
+        Usually, users don't have to call this method.
+
+        :return: (list of response pads, list of eye trackers)
+        """
+        start = time.perf_counter()
+        pads, eyetrackers = [], []
+        if self.simulated:
+            if self.response_pad:
+                # the pad presses the answer and flag keys in turn, never the quit key
+                pad_keys = {2: ["6", "0", "3"], 4: ["0", "1", "5", "6", "3"]}.get(self.nb_ans, ["6"])
+                pads = [SimulatedResponsePad(pad_keys)]
+            if self.eye_tracker_study:
+                eyetrackers = [SimulatedEyeTracker(self.simulated_gaze_frequency, self.simulated_dropout_rate)]
+        else:
+            if self.response_pad:
+                pads = pyxid2.get_xid_devices()
+            if self.eye_tracker_study:
+                eyetrackers = tobii_research.find_all_eyetrackers()
+        self.startup_times['device discovery'] = time.perf_counter() - start
+        return pads, eyetrackers
+
+    def get_devices(self):
+        """
+        Get the devices found by :func:`discover_devices`, waiting for the end of the discovery. Exceptions raised by
+        the discovery are raised here.
+
+        :return: (list of response pads, list of eye trackers)
+        """
+        if self.device_discovery is None:
+            return self.discover_devices()
+        start = time.perf_counter()
+        devices = self.device_discovery.result()
+        self.startup_times.setdefault('device wait', time.perf_counter() - start)
+        return devices
 
     def init(self):
         """Function launched at the end of constructor if you want to create instance variables or execute some code
         at initialization"""
         if self.response_pad:
             # get the device and save it
-            devices = pyxid2.get_xid_devices()
+            devices, eyetrackers = self.get_devices()
             self.dev = devices[0]
             self.dev.enable_usb_output('K', True)
             self.response_pad_timestamp = time.time()
+            self.response_input = ResponsePadInput(self.dev, on_response=self.clock.add_pad_response)
+            self.response_input.start()
             print(self.dev)
             if self.nb_ans == 2:
                 self.yes_key_name = "verte"
@@ -255,60 +3580,292 @@ class TaskTemplate:
 
         ### EYE TRACKER
         if self.eye_tracker_study:
-            eyetrackers = tobii_research.find_all_eyetrackers()
+            devices, eyetrackers = self.get_devices()
+
+            if len(eyetrackers) == 0:
+                raise RuntimeError('No Tobii eyetrackers')
+            self.eyetracker = eyetrackers[0]
+            self.calibration = self.tobii_research.ScreenBasedCalibration(self.eyetracker)
+
+    def load_journal(self, entries):
+        """
+        Prepare the continuation of a session from the entries of its journal: the rows of the finished trials are
+        written again in the CSV file (rows of an unfinished trial are dropped), and <resume_trial> and
+        <resume_state> are set.
+        Usually, users don't have to call this method.
+        """
+        self.resumed = True
+        finished = {}
+        for entry in entries:
+            if entry['type'] == 'trial_end':
+                finished[entry['trial']] = entry
+        self.resume_trial = max(finished) + 1 if finished else 0
+        for no_trial in sorted(finished):
+            for row in finished[no_trial]['rows']:
+                self.dataFile.write_row(row)
+        self.resume_state = None
+        for entry in entries:
+            if entry['type'] == 'trial_start' and entry['trial'] == self.resume_trial:
+                self.resume_state = entry['random_state']
+        self.journal.write('resume', trial=self.resume_trial)
+
+    def update_csv(self, *args):
+        """
+        Write a row in the CSV file, with one value per column of <csv_headers>. The row is written by a background
+        thread (see <CsvWriter>), so this method returns immediately.
+        """
+        self.dataFile.write_row(args)
+        self.trial_rows.append([str(value) for value in args])
+        if self.aois is not None:
+            self.write_aoi_stats()
+
+    def start_aoi_trial(self, no_trial):
+        """
+        Start accumulating gaze statistics on areas of interest for a trial.
+        Register AOIs in the returned <AOIRegistry>; their statistics are written to
+        <csv_folder>/<file_name>_aoi.csv by the next call of :func:`update_csv`.
+
+        :param no_trial: Trial number.
+        """
+        self.update_aois()
+        self.aois = AOIRegistry(self.get_coordinate_transform(), self.tobii_research.get_system_time_stamp())
+        self.aoi_trial = no_trial
+        self.aoi_position = len(self.gaze_data)
+        return self.aois
 
-            if len(eyetrackers) == 0:
-                raise RuntimeError('No Tobii eyetrackers')
-            self.eyetracker = eyetrackers[0]
-            self.calibration = tobii_research.ScreenBasedCalibration(self.eyetracker)
+    def get_release_limit(self):
+        """
+        Get the index of the first gaze sample which the streaming writer must keep in memory: the first one not yet
+        used by the AOI statistics of the current trial, or None without AOIs (see <GazeDataWriter.release_limit>).
+        Usually, users don't have to call this method.
+        """
+        return self.aoi_position if self.aois is not None else None
 
-    def update_csv(self, *args):
-        args = list(map(str, args))
-        self.dataFile.write(",".join(args))
-        self.dataFile.write("\n")
+    def update_aois(self):
+        """
+        Accumulate AOI statistics over the gaze samples recorded since the last call. Called by :func:`update_csv`,
+        it can also be called during the trial (e.g. at each frame) to keep statistics up to date.
+        """
+        if self.aois is None:
+            return
+        count = len(self.gaze_data)
+        if self.aoi_position < self.gaze_data.released:
+            warnings.warn('gaze samples released before AOI statistics were updated.')
+            self.aoi_position = self.gaze_data.released
+        self.aois.update(self.gaze_data.read(self.aoi_position, count))
+        self.aoi_position = count
+
+    def write_aoi_stats(self):
+        """
+        Write the AOI statistics of the current trial, one row per AOI, and stop accumulating them.
+        """
+        self.update_aois()
+        if self.aoiFile is None:
+            self.aoiFile = CsvWriter(f"{self.csv_folder}/{self.file_name}_aoi.csv",
+                                     ["trial", "aoi", "dwell_time", "first_entry_latency", "visits"], self.csv_fsync,
+                                     append=self.resumed)
+        for name, dwell_time, first_entry, visits in self.aois.get_stats():
+            self.aoiFile.write_row([self.aoi_trial, name, f"{dwell_time:.1f}",
+                                    '' if first_entry is None else f"{first_entry:.1f}", visits])
+        self.aois = None
 
     def size(self, img):
-        image = Image.open(f'img/{img}')
-        imgwidth, imgheight = image.size
-        while imgwidth > get_monitors()[0].width:
-            imgwidth = imgwidth * 0.9
-            imgheight = imgheight * 0.9
-        while imgheight > get_monitors()[0].height:
-            imgwidth = imgwidth * 0.9
-            imgheight = imgheight * 0.9
+        """
+        Get the size of an image of <images_folder>, shrunk by steps of 0.9 until it fits in the screen.
+        Only the header of the file is read, unless the image is already loaded by :func:`preload_images`.
+        """
+        if self.image_pipeline is not None and img in self.image_pipeline.futures:
+            return self.image_pipeline.get_size(img)
+        with Image.open(os.path.join(self.images_folder, img)) as image:
+            width, height = image.size
+        return fit_image_size(width, height, *self.get_screen_size())
+
+    def get_screen_size(self):
+        """
+        Get the size (width, height) of the first monitor in pixels, or <simulated_screen_size> in simulation.
+        """
+        if self.simulated:
+            return tuple(self.simulated_screen_size)
+        monitor = screeninfo.get_monitors()[0]
+        return monitor.width, monitor.height
+
+    def get_image_pipeline(self):
+        """
+        Get the <ImagePipeline> of <images_folder>, created at the first call.
+        """
+        if self.image_pipeline is None:
+            self.image_pipeline = ImagePipeline(self.images_folder, self.get_screen_size(), self.image_cache_folder,
+                                                self.image_workers)
+        return self.image_pipeline
 
-        return imgwidth, imgheight
+    def preload_images(self, names=None):
+        """
+        Start decoding and fitting images in background threads (see <ImagePipeline>).
+
+        :param names: File names in <images_folder>. Default is all the files of the folder, if it exists.
+        """
+        if names is None:
+            if not os.path.isdir(self.images_folder):
+                return
+            names = sorted(name for name in os.listdir(self.images_folder)
+                           if os.path.isfile(os.path.join(self.images_folder, name)))
+        self.get_image_pipeline().load(names)
 
     def get_images(self, no_trial):
-        return [filename for filename in os.listdir('../img')]
+        """
+        Get the names of the files of <stimuli_folder>, from the <StimulusCatalog> indexed when the task starts.
+        """
+        return self.get_stimulus_catalog().names()
+
+    def get_stimulus_catalog(self):
+        """
+        Get the <StimulusCatalog> of <stimuli_folder>, indexed at the first call.
+        """
+        if self.stimulus_catalog is None:
+            index_file = self.stimulus_catalog_file
+            if index_file is None:
+                index_file = os.path.join(self.csv_folder, 'stimulus_catalog.json')
+            self.stimulus_catalog = StimulusCatalog(self.stimuli_folder, index_file)
+        return self.stimulus_catalog
+
+    def index_stimuli(self):
+        """
+        Index <stimuli_folder> in the <StimulusCatalog> if the folder exists, so that the trials only query the
+        catalog in memory. Called by start and resume.
+        Usually, users don't have to call this method.
+        """
+        if self.stimulus_catalog is None and os.path.isdir(self.stimuli_folder):
+            self.get_stimulus_catalog()
 
     def get_good_ans(self, answer, dic_values):
-        for key, value in dic_values.items():
-            if answer == key:
-                return value
+        return dic_values.get(answer)
+
+    def make_trial_sequence(self):
+        """Method to overwrite to plan the session with a <TrialSequence>, e.g.
+        ``return TrialSequence({'word': words, 'answer': answers}, repetitions=4, participant=self.participant)``.
+        It is called at the end of the constructor; the number of trials is then the length of the sequence, and
+        <task> gets its trial with :func:`get_trial`. The plan is saved in <csv_folder>/<file_name>_plan.csv.
+        Default is no sequence.
+        """
+        return None
 
-    def create_visual_text(self, text, pos=(0, 0), font_size=0.06, color=text_color, units='height', autolog=None):
+    def add_adaptive_procedure(self, name, procedure):
         """
-        Create a <visual.TextStim> with some default parameters so it's simpler to create visual texts
+        Register an adaptive procedure (<QuestPlus> or <Staircase>). Its next intensity is chosen before each trial,
+        and its state is saved in <csv_folder>/<file_name>_<name>.npz at the end of each trial. If that file exists
+        (e.g. next block, or resumed session), the state is restored from it.
+
+        :param str name: Name of the procedure.
+        :return: the procedure.
         """
-        return visual.TextStim(
-            win=self.win,
-            text=text,
-            font='Arial',
-            units=units,
-            pos=pos,
-            height=font_size,
-            wrapWidth=None,
-            ori=0,
-            color=color,
-            colorSpace='rgb',
-            opacity=1,
-            languageStyle='LTR',
-            autoLog=autolog,
-        )
+        filename = self.get_adaptive_filename(name)
+        if os.path.exists(filename):
+            with np.load(filename) as state:
+                procedure.set_state(dict(state))
+        self.adaptive_procedures[name] = procedure
+        return procedure
+
+    def get_adaptive_intensity(self, name):
+        """
+        Get the intensity chosen by an adaptive procedure for the current trial.
+        """
+        return self.adaptive_procedures[name].next_intensity()
+
+    def update_adaptive(self, name, response, intensity=None):
+        """
+        Update an adaptive procedure on the response of the current trial, e.g. with the key of
+        :func:`get_response_with_time` compared to the good answer.
+
+        :param str name: Name of the procedure.
+        :param response: True or 1 if correct.
+        :param float intensity: Intensity presented. Default is the one of :func:`get_adaptive_intensity`.
+        """
+        procedure = self.adaptive_procedures[name]
+        procedure.update(procedure.next_intensity() if intensity is None else intensity, response)
+
+    def get_adaptive_filename(self, name):
+        """
+        Get the file where the state of an adaptive procedure is saved.
+        Usually, users don't have to call this method.
+        """
+        return f"{self.csv_folder}/{self.file_name}_{name}.npz"
+
+    def save_adaptive_procedures(self):
+        """
+        Save the state of the adaptive procedures. Files are replaced at once, so they are never partially written.
+        Usually, users don't have to call this method.
+        """
+        for name, procedure in self.adaptive_procedures.items():
+            filename = self.get_adaptive_filename(name)
+            np.savez(filename[:-len('.npz')] + '.tmp.npz', **procedure.get_state())
+            os.replace(filename[:-len('.npz')] + '.tmp.npz', filename)
+
+    def get_trial(self, no_trial):
+        """
+        Get a trial of <trial_sequence>, as a dict with the columns of its condition, 'trial', 'block' and
+        'condition'.
+        :param no_trial: Trial number (starting from 0).
+        """
+        return self.trial_sequence[no_trial]
+
+    def create_visual_text(self, text, pos=(0, 0), font_size=0.06, color=text_color, units='height', autolog=None,
+                           cache=False):
+        """
+        Create a <visual.TextStim> with some default parameters so it's simpler to create visual texts.
+        If <cache> is True, the stimulus is reused if it was created with the same parameters before (see
+        <StimulusCache>).
+        """
+        def create():
+            return self.visual.TextStim(
+                win=self.win,
+                text=text,
+                font='Arial',
+                units=units,
+                pos=pos,
+                height=font_size,
+                wrapWidth=None,
+                ori=0,
+                color=color,
+                colorSpace='rgb',
+                opacity=1,
+                languageStyle='LTR',
+                autoLog=autolog,
+            )
+
+        def reset(stim):
+            stim.units = units
+            if stim.text != text:
+                stim.text = text
+            if stim.font != 'Arial':
+                stim.font = 'Arial'
+            if stim.height != font_size:
+                stim.height = font_size
+            if stim.wrapWidth is not None:
+                stim.wrapWidth = None
+            if stim.languageStyle != 'LTR':
+                stim.languageStyle = 'LTR'
+            stim.pos = pos
+            stim.ori = 0
+            stim.colorSpace = 'rgb'
+            stim.color = color
+            stim.opacity = 1
+            stim.autoLog = autolog if autolog is not None else self.win.autoLog
+
+        if not cache:
+            return create()
+        key = StimulusCache.make_key('text', text, pos, font_size, color, units, autolog)
+        return self.stimulus_cache.get(key, create, reset)
 
     def create_visual_image(self, image, pos=(0, 0), ori=0.0, units='pix', size=None, autolog=None):
-        return visual.ImageStim(
+        """
+        Create a <visual.ImageStim>. If <image> is the path of an image of <images_folder> loaded by
+        :func:`preload_images`, the decoded and fitted image is used instead of reading the file again.
+        """
+        if isinstance(image, str) and self.image_pipeline is not None:
+            name = os.path.relpath(image, self.images_folder)
+            if name in self.image_pipeline.futures:
+                image = self.image_pipeline.get_texture(name)
+        return self.visual.ImageStim(
             win=self.win,
             image=image,
             size=size,
@@ -318,58 +3875,287 @@ class TaskTemplate:
             autoLog=autolog,
         )
 
-    def create_visual_rect(self, size, lineColor, fillColor, units="height", autolog=None):
-        return visual.Rect(
-            win=self.win,
-            width=300,
-            height=100,
-            size=size,
-            units=units,
-            lineColor=lineColor,
-            fillColor=fillColor,
-            autoLog=autolog,
-        )
-
-    def create_visual_circle(self, size, units, fillcolor, pos=None, autolog=None):
-        return visual.Circle(
-            win=self.win,
-            size=size,
-            units=units,
-            radius=30,
-            fillColor=fillcolor,
-            lineWidth=0,
-            pos=pos,
-            autoLog=autolog,
-        )
+    def create_visual_rect(self, size, lineColor, fillColor, units="height", autolog=None, cache=False):
+        """
+        Create a <visual.Rect> centered in the window.
+        If <cache> is True, the stimulus is reused if it was created with the same parameters before (see
+        <StimulusCache>).
+        """
+        def create():
+            return self.visual.Rect(
+                win=self.win,
+                width=300,
+                height=100,
+                size=size,
+                units=units,
+                pos=(0, 0),
+                ori=0,
+                opacity=1,
+                lineColor=lineColor,
+                fillColor=fillColor,
+                autoLog=autolog,
+            )
+
+        def reset(stim):
+            stim.units = units
+            stim.size = size
+            stim.pos = (0, 0)
+            stim.ori = 0
+            stim.opacity = 1
+            stim.lineColor = lineColor
+            stim.fillColor = fillColor
+            stim.autoLog = autolog if autolog is not None else self.win.autoLog
+
+        if not cache:
+            return create()
+        key = StimulusCache.make_key('rect', size, lineColor, fillColor, units, autolog)
+        return self.stimulus_cache.get(key, create, reset)
+
+    def create_visual_circle(self, size, units, fillcolor, pos=None, autolog=None, cache=False):
+        """
+        Create a <visual.Circle>, centered in the window if <pos> is None.
+        If <cache> is True, the stimulus is reused if it was created with the same parameters before (see
+        <StimulusCache>).
+        """
+        if pos is None:
+            pos = (0, 0)
+
+        def create():
+            return self.visual.Circle(
+                win=self.win,
+                size=size,
+                units=units,
+                radius=30,
+                fillColor=fillcolor,
+                lineWidth=0,
+                pos=pos,
+                ori=0,
+                opacity=1,
+                autoLog=autolog,
+            )
+
+        def reset(stim):
+            stim.units = units
+            stim.radius = 30
+            stim.size = size
+            stim.fillColor = fillcolor
+            stim.lineWidth = 0
+            stim.pos = pos
+            stim.ori = 0
+            stim.opacity = 1
+            stim.autoLog = autolog if autolog is not None else self.win.autoLog
+
+        if not cache:
+            return create()
+        key = StimulusCache.make_key('circle', size, units, fillcolor, pos, autolog)
+        return self.stimulus_cache.get(key, create, reset)
 
     def check_break(self, no_trial, first_threshold, second_threshold=None, test=False):
-        if no_trial == first_threshold:
-            self.create_visual_text("2 minutes de pause").draw()
-            self.win.flip()
-            if not test:
-                core.wait(60)  # two minuts break
-            else:
-                core.wait(10)
-            self.create_visual_text("Plus qu'une minute !").draw()
-            self.win.flip()
-            if not test:
-                core.wait(60)
-            else:
-                core.wait(10)
+        """
+        Take a two minutes break at trial <first_threshold>, and at trial <second_threshold> if given: "2 minutes de
+        pause" then "Plus qu'une minute !" are shown for one minute each (10 seconds if <test>). The tasks of
+        :func:`get_break_tasks` run meanwhile (see :func:`take_break`).
+        """
+        if no_trial == first_threshold or (second_threshold is not None and no_trial == second_threshold):
+            duration = 10 if test else 60
+            self.take_break([("2 minutes de pause", duration), ("Plus qu'une minute !", duration)],
+                            self.get_break_tasks(no_trial), self.break_drift_check and self.recording, no_trial)
 
-        elif second_threshold is not None and no_trial == second_threshold:
-            self.create_visual_text("2 minutes de pause").draw()
-            self.win.flip()
-            if not test:
-                core.wait(60)  # two minuts break
-            else:
-                core.wait(10)
-            self.create_visual_text("Plus qu'une minute !").draw()
+    def take_break(self, screens, tasks=(), drift_check=False, no_trial=-1):
+        """
+        Show the screens of a break, each for its duration, while <tasks> run one after the other in a worker thread.
+        The window is flipped at every frame, so it stays responsive. The break ends on time whatever the work left:
+        tasks not started by then are skipped with a warning, and the one running finishes in the background. If it
+        is still running at the next break after <break_worker_timeout>, the tasks of the next break wait for it.
+
+        :param screens: List of (text, duration in seconds).
+        :param tasks: Functions called without argument, e.g. from :func:`get_break_tasks`.
+        :param bool drift_check: If True, the end of the last screen is replaced by a drift check (see
+            :func:`drift_check`).
+        :param int no_trial: Trial number, for frame timing and the drift check.
+        :return: Names of the tasks done before the end of the break.
+        """
+        self.set_frame_phase('break', no_trial)
+        # the last task of the previous break may still be running
+        previous = self.break_worker if not self.join_break_worker() else None
+        tasks = list(tasks)
+        names = [getattr(getattr(task, 'func', task), '__name__', repr(task)) for task in tasks]
+        ended = threading.Event()
+        started = []
+        done = []
+
+        def run_tasks():
+            if previous is not None:
+                previous.join()
+            for task, name in zip(tasks, names):
+                if ended.is_set():
+                    return
+                started.append(name)
+                try:
+                    task()
+                except Exception as e:
+                    warnings.warn(f"break task {name} failed: {e!r}")
+                done.append(name)
+
+        self.break_worker = threading.Thread(target=run_tasks, name='break', daemon=True)
+        self.break_worker.start()
+
+        end = core.getTime()
+        for k, (text, duration) in enumerate(screens):
+            end += duration
+            screen_end = end - self.drift_check_duration if drift_check and k == len(screens) - 1 else end
+            stim = self.create_visual_text(text, cache=True)
+            while True:
+                stim.draw()
+                self.win.flip()
+                if core.getTime() >= screen_end:
+                    break
+        if drift_check:
+            self.drift_check(max(0.0, end - core.getTime()), no_trial)
+        ended.set()
+
+        finished = list(done)
+        skipped = names[len(started):]
+        if skipped:
+            warnings.warn(f"break ended before: {', '.join(skipped)}")
+        self.set_frame_phase('task', no_trial)
+        return finished
+
+    def join_break_worker(self):
+        """
+        Wait for the tasks of the last break (see :func:`take_break`) at most <break_worker_timeout> seconds, with a
+        warning if they are still running then.
+        Usually, users don't have to call this method.
+
+        :return: True if no task is running.
+        """
+        if self.break_worker is None:
+            return True
+        self.break_worker.join(self.break_worker_timeout)
+        if self.break_worker.is_alive():
+            warnings.warn(f"break tasks still running after {self.break_worker_timeout} s")
+            return False
+        return True
+
+    def get_break_tasks(self, no_trial):
+        """
+        Get the functions run during a break (see :func:`take_break`): flush of the data files
+        (:func:`flush_buffers`), checkpoint (:func:`write_checkpoint`) and preparation of the next trials
+        (:func:`prepare_block`). Method to overwrite to add or remove tasks.
+        :param no_trial: Trial number of the break.
+        """
+        return [self.flush_buffers, functools.partial(self.write_checkpoint, no_trial),
+                functools.partial(self.prepare_block, no_trial)]
+
+    def flush_buffers(self):
+        """
+        Wait until the rows queued in the CSV files are written, and in streaming mode (see <streaming>), write the
+        gaze data recorded so far.
+        """
+        for writer in (self.dataFile, self.aoiFile, self.frameFile):
+            if writer is not None:
+                writer.flush()
+        if self.gaze_writer is not None:
+            self.gaze_writer.flush()
+
+    def write_checkpoint(self, no_trial):
+        """
+        Write the state of the session in <csv_folder>/<file_name>_checkpoint.json: participant, trial number, time
+        and amount of data recorded. The file is replaced at once, so it is never partially written.
+        :param no_trial: Trial number.
+        """
+        checkpoint = {'participant': self.participant, 'file_name': self.file_name, 'trial': no_trial,
+                      'time': time.time(), 'gaze_samples': len(self.gaze_data), 'events': len(self.event_data)}
+        filename = f"{self.csv_folder}/{self.file_name}_checkpoint.json"
+        with open(filename + '.tmp', 'w') as f:
+            json.dump(checkpoint, f)
+        os.replace(filename + '.tmp', filename)
+
+    def prepare_block(self, no_trial):
+        """Method to overwrite to prepare the trials following a break, in the background during the break (e.g.
+        load the images of the next block with preload_images, and drop the previous ones with
+        get_image_pipeline().release). By default, the next trial is prefetched (see :func:`prefetch_trial`).
+        :param no_trial: Trial number of the break.
+        """
+        self.prefetch_trial(no_trial + 1)
+
+    def drift_check(self, duration, no_trial=-1):
+        """
+        Show the calibration target at the center of the screen for <duration> seconds, and measure the offset of the
+        gaze from it over the second half, once the eyes have reached the target. The offset is added to
+        <drift_offsets> and recorded as a "drift" event.
+        :param float duration: Duration in seconds.
+        :param int no_trial: Trial number.
+        :return: Offset (x, y) in window units, or None without valid gaze data.
+        """
+        self.calibration_target_dot.setPos((0, 0))
+        self.calibration_target_disc.setPos((0, 0))
+        self.calibration_target_disc.setRadius(self.calibration_target_disc_size)
+        start = core.getTime()
+        positions = []
+        while True:
+            self.calibration_target_disc.draw()
+            self.calibration_target_dot.draw()
             self.win.flip()
-            if not test:
-                core.wait(60)
-            else:
-                core.wait(10)
+            now = core.getTime()
+            sample = self.get_latest_gaze()
+            if now - start >= duration / 2.0 and sample is not None and not np.isnan(sample[5]):
+                positions.append(sample[5:7])
+            if now - start >= duration:
+                break
+        if len(positions) == 0:
+            return None
+        x, y = np.median(positions, axis=0)
+        self.drift_offsets.append((no_trial, x, y))
+        self.record_event(f"drift {x:.4f} {y:.4f}")
+        return x, y
+
+    def enable_frame_timing(self):
+        """
+        Time every flip of the window with a <FrameTimer>: win.flip is replaced by a method recording the flip time.
+        Called at initialization if <record_frame_timing> is True.
+        """
+        frame_period = self.win.monitorFramePeriod
+        self.frame_timer = FrameTimer(frame_period, self.frame_drop_threshold, on_segment=self.write_frame_summary)
+        flip = self.win.flip
+        record = self.frame_timer.record
+
+        def timed_flip(*args, **kwargs):
+            flip_time = flip(*args, **kwargs)
+            record(self.win.lastFrameT)
+            return flip_time
+
+        self.win.flip = timed_flip
+
+    def set_frame_phase(self, phase, no_trial=-1):
+        """
+        Tag the next flips with a phase and a trial number (see <FrameTimer>). Does nothing if frame timing is not
+        enabled.
+
+        :param str phase: Name of the phase (e.g. 'instructions', 'calibration', 'task').
+        :param int no_trial: Trial number, -1 if none.
+        """
+        if self.frame_timer is not None:
+            self.frame_timer.set_phase(phase, no_trial)
+
+    def write_frame_summary(self, summary):
+        """
+        Write the frame summary of a phase or trial in <file_name>_frames.csv.
+        Usually, users don't have to call this method.
+        """
+        if self.frameFile is None:
+            self.frameFile = CsvWriter(f"{self.csv_folder}/{self.file_name}_frames.csv",
+                                       ["trial", "phase", "frames", "mean_interval", "max_interval", "dropped"],
+                                       self.csv_fsync, append=self.resumed)
+        no_trial, phase, frames, mean, maximum, dropped = summary
+        self.frameFile.write_row(['' if no_trial < 0 else no_trial, phase, frames, f"{mean:.3f}", f"{maximum:.3f}",
+                                  dropped])
+
+    def get_flip_time(self):
+        """
+        Get the session time (see <ClockSync>) of the last flip of the window.
+        """
+        return self.clock.from_psychopy(self.win.lastFrameT)
 
     def wait_yes(self, key):
         """wait until user presses <self.yes_key_code>
@@ -380,36 +4166,55 @@ class TaskTemplate:
     def quit_experiment(self):
         """Ends the experiment
         """
+        self.join_break_worker()
         if self.eye_tracker_study:
             self.unsubscribe()
             self.close_datafile()
         self.dataFile.close()
+        if self.aoiFile is not None:
+            self.aoiFile.close()
+        if self.frame_timer is not None:
+            self.frame_timer.end_segment()
+        if self.frameFile is not None:
+            self.frameFile.close()
+        if self.response_input is not None:
+            self.response_input.stop()
+        if self.image_pipeline is not None:
+            self.image_pipeline.close()
+        if self.trial_executor is not None:
+            self.trial_executor.shutdown(wait=False)
+        if self.journal is not None:
+            self.journal.close()
+        self.clock.stop()
         sys.exit()
 
     def get_response(self, keys=None, timeout=float("inf")):
         """Waits for a response from the participant.
         Pressing Q while the function is wait for a response will quit the experiment.
-        Returns the pressed key.
+        Returns the pressed key, or None if timeout is reached.
         """
         if keys is None:
             keys = self.keys
 
         if self.response_pad:
-            self.dev.clear_response_queue()
-            while not self.dev.has_response():
-                self.dev.poll_for_response()
-            resp = self.dev.get_next_response()
-            self.dev.clear_response_queue()
+            self.response_input.clear()
+            received = self.response_input.get(timeout)
+            if received is None:
+                return
+            resp = received[0]
+            self.response_input.clear()
+            self.last_response_time = self.clock.from_pad(resp["time"])
             if str(resp["key"]) == self.quit_code:
                 self.quit_experiment()
             return str(resp["key"])
         else:
-            resp = event.waitKeys(keyList=keys, clearEvents=True, maxWait=timeout)
+            resp = self.event.waitKeys(keyList=keys, clearEvents=True, maxWait=timeout, timeStamped=core.monotonicClock)
             if resp is None:
                 return
-            if resp[0] == self.quit_code:
+            self.last_response_time = self.clock.from_psychopy(resp[0][1])
+            if resp[0][0] == self.quit_code:
                 self.quit_experiment()
-            return resp[0]
+            return resp[0][0]
 
     def get_response_with_time(self, keys=None, timeout=float("inf")):
         """Waits for a response from the participant.
@@ -419,18 +4224,21 @@ class TaskTemplate:
         if keys is None:
             keys = self.keys
         if self.response_pad:
-            self.dev.flush_serial_buffer()
-            while not self.dev.has_response():
-                self.dev.poll_for_response()
-            resp = self.dev.get_next_response()
+            self.response_input.clear()
+            received = self.response_input.get(timeout)
+            if received is None:
+                return [None, None]
+            resp = received[0]
+            self.last_response_time = self.clock.from_pad(resp["time"])
             if str(resp["key"]) == self.quit_code:
                 self.quit_experiment()
             return str(resp["key"]), resp["time"] / 1000
         else:
             clock = core.Clock()
-            resp = event.waitKeys(maxWait=timeout, keyList=keys, timeStamped=clock)
+            resp = self.event.waitKeys(maxWait=timeout, keyList=keys, timeStamped=clock)
             if resp is None:
                 return [None, None]
+            self.last_response_time = self.clock.from_psychopy(clock.getLastResetTime() + resp[0][1])
             if resp[0][0] == self.quit_code:
                 self.quit_experiment()
             return resp[0]
@@ -454,18 +4262,20 @@ class TaskTemplate:
             raise RuntimeError('Eyetracker is not found.')
 
         if enable_mouse:
-            mouse = event.Mouse(visible=False, win=self.win)
+            mouse = self.event.Mouse(visible=False, win=self.win)
 
         self.gaze_data_status = None
-        self.eyetracker.subscribe_to(tobii_research.EYETRACKER_GAZE_DATA,
+        self.eyetracker.subscribe_to(self.tobii_research.EYETRACKER_GAZE_DATA,
                                      self.on_gaze_data_status)
 
         msg = self.create_visual_text(text="", pos=(0, -0.35), color=text_color, units="height", font_size=0.02,
-                                      autolog=False)
+                                      autolog=False, cache=True)
         bgrect = self.create_visual_rect(size=(0.6, 0.6), lineColor="white", fillColor="black", units="height",
-                                         autolog=False)
-        leye = self.create_visual_circle(size=0.05, units='height', fillcolor="red", autolog=False)
-        reye = self.create_visual_circle(size=0.05, units='height', fillcolor="yellow", autolog=False)
+                                         autolog=False, cache=True)
+        leye = self.create_visual_circle(size=0.05, units='height', fillcolor="red", autolog=False,
+                                         cache=True)
+        reye = self.create_visual_circle(size=0.05, units='height', fillcolor="yellow", autolog=False,
+                                         cache=True)
 
         b_show_status = True
         while b_show_status:
@@ -484,7 +4294,7 @@ class TaskTemplate:
                     reye.setRadius((1 - rp[2]) / 2)
                     reye.draw()
 
-            for key in event.getKeys():
+            for key in self.event.getKeys():
                 if key == 'escape' or key == 'space':
                     b_show_status = False
 
@@ -494,7 +4304,7 @@ class TaskTemplate:
             msg.draw()
             self.win.flip()
 
-        self.eyetracker.unsubscribe_from(tobii_research.EYETRACKER_GAZE_DATA)
+        self.eyetracker.unsubscribe_from(self.tobii_research.EYETRACKER_GAZE_DATA)
 
     def on_gaze_data_status(self, gaze_data):
         """
@@ -539,10 +4349,10 @@ class TaskTemplate:
 
         img = Image.new('RGBA', tuple(self.win.size))
         img_draw = ImageDraw.Draw(img)
-        result_img = visual.SimpleImageStim(self.win, img, autoLog=False)
-        result_msg = visual.TextStim(self.win, pos=(0, -self.win.size[1] / 4),
+        result_img = self.visual.SimpleImageStim(self.win, img, autoLog=False)
+        result_msg = self.visual.TextStim(self.win, pos=(0, -self.win.size[1] / 4),
                                      color=text_color, units='pix', autoLog=False)
-        remove_marker = visual.Circle(
+        remove_marker = self.visual.Circle(
             self.win, radius=self.calibration_target_dot.radius * 5,
             fillColor='black', lineColor='white', lineWidth=1, autoLog=False)
         if self.win.units == 'norm':  # fix oval
@@ -569,7 +4379,7 @@ class TaskTemplate:
                 if start_key is not None:
                     result_msg.setText(f'Appuyez sur la touche espace pour commencer la calibration')
                 while waitkey:
-                    for key in event.getKeys():
+                    for key in self.event.getKeys():
                         if key == start_key:
                             waitkey = False
 
@@ -589,7 +4399,7 @@ class TaskTemplate:
 
             img_draw.rectangle(((0, 0), tuple(self.win.size)), fill=(0, 0, 0, 0))
             # CHECK IF NEEDED !!!!!
-            if calibration_result.status == tobii_research.CALIBRATION_STATUS_FAILURE:
+            if calibration_result.status == self.tobii_research.CALIBRATION_STATUS_FAILURE:
                 # computeCalibration failed.
                 pass
             else:
@@ -601,11 +4411,11 @@ class TaskTemplate:
                         for calibration_sample in calibration_point.calibration_samples:
                             lp = calibration_sample.left_eye.position_on_display_area
                             rp = calibration_sample.right_eye.position_on_display_area
-                            if calibration_sample.left_eye.validity == tobii_research.VALIDITY_VALID_AND_USED:
+                            if calibration_sample.left_eye.validity == self.tobii_research.VALIDITY_VALID_AND_USED:
                                 img_draw.line(((p[0] * self.win.size[0], p[1] * self.win.size[1]),
                                                (lp[0] * self.win.size[0], lp[1] * self.win.size[1])),
                                               fill=(0, 255, 0, 255))
-                            if calibration_sample.right_eye.validity == tobii_research.VALIDITY_VALID_AND_USED:
+                            if calibration_sample.right_eye.validity == self.tobii_research.VALIDITY_VALID_AND_USED:
                                 img_draw.line(((p[0] * self.win.size[0], p[1] * self.win.size[1]),
                                                (rp[0] * self.win.size[0], rp[1] * self.win.size[1])),
                                               fill=(255, 0, 0, 255))
@@ -620,7 +4430,7 @@ class TaskTemplate:
             waitkey = True
             self.retry_points = []
             while waitkey:
-                for key in event.getKeys():
+                for key in self.event.getKeys():
                     if key in [decision_key, 'escape']:
                         waitkey = False
                     elif key in ['0', 'num_0']:
@@ -700,7 +4510,7 @@ class TaskTemplate:
                     (self.calibration_target_dot_size * 2.0 - self.calibration_target_disc_size) / \
                     self.move_duration * current_time + self.calibration_target_disc_size
                 )
-                event.getKeys()
+                self.event.getKeys()
                 self.calibration_target_disc.draw()
                 self.calibration_target_dot.draw()
                 self.win.flip()
@@ -798,23 +4608,58 @@ class TaskTemplate:
         Start recording.
         """
 
-        self.gaze_data = []
+        self.gaze_data = GazeBuffer(self.gaze_buffer_chunk_size)
         self.event_data = []
+        self.latest_gaze = None
+        self.gaze_latencies = []
+        if self.classify_gaze_events:
+            self.gaze_classifier = GazeEventClassifier(self.saccade_velocity_threshold,
+                                                       self.get_degrees_per_display_area(), self.insert_event,
+                                                       self.saccade_velocity_window, self.min_fixation_duration)
         self.recording = True
         # Temps entre "OK" dans la boîte de dialogue ET quand le mec appuie sur la touche violette
         self.shift = time.time() - self.time_stamp_shift
-        self.eyetracker.subscribe_to(tobii_research.EYETRACKER_GAZE_DATA, self.on_gaze_data)
+        if (self.streaming or self.journal is not None) and self.datafile is not None:
+            self.gaze_writer = GazeDataWriter(self.datafile, self.get_coordinate_transform(), self.shift,
+                                              self.event_data, self.embed_events, gaze_data=self.gaze_data,
+                                              release_limit=self.get_release_limit, interval=self.stream_interval,
+                                              batch_size=self.stream_batch_size)
+            self.gaze_writer.start()
+        if self.acquisition_process:
+            self.gaze_acquisition = GazeAcquisition(self.eyetracker, self.acquisition_ring_size,
+                                                    self.acquisition_poll_interval, self.on_gaze_samples)
+            self.gaze_acquisition.start()
+        else:
+            self.eyetracker.subscribe_to(self.tobii_research.EYETRACKER_GAZE_DATA, self.on_gaze_data)
 
     def unsubscribe(self):
         """
         Stop recording.
         """
 
-        self.eyetracker.unsubscribe_from(tobii_research.EYETRACKER_GAZE_DATA)
+        if self.gaze_acquisition is not None:
+            self.gaze_acquisition.stop()
+            self.gaze_acquisition = None
+        else:
+            self.eyetracker.unsubscribe_from(self.tobii_research.EYETRACKER_GAZE_DATA)
         self.recording = False
-        self.flush_data()
-        self.gaze_data = []
+        if self.gaze_classifier is not None:
+            self.gaze_classifier.finish()
+            self.gaze_classifier = None
+        if self.gaze_writer is not None:
+            self.gaze_writer.stop()
+            timestamp_start = self.gaze_writer.timestamp_start
+            self.gaze_writer = None
+        else:
+            timestamp_start = self.gaze_data[0][0] if len(self.gaze_data) > 0 else None
+            self.flush_data()
+        if self.journal is not None and self.datafile is not None and timestamp_start is not None:
+            # times of the gaze data file are relative to its first sample
+            self.journal.write('recording', file=self.datafile_name, timestamp_start=int(timestamp_start),
+                               session_time=self.clock.from_tobii(timestamp_start))
+        self.gaze_data = GazeBuffer(self.gaze_buffer_chunk_size)
         self.event_data = []
+        self.latest_gaze = None
 
     def on_gaze_data(self, gaze_data):
         """
@@ -833,7 +4678,84 @@ class TaskTemplate:
         ry = gaze_data.right_eye.gaze_point.position_on_display_area[1]
         rp = gaze_data.right_eye.pupil.diameter
         rv = gaze_data.right_eye.gaze_point.validity
-        self.gaze_data.append((t, lx, ly, lp, lv, rx, ry, rp, rv))
+        record = (t, lx, ly, lp, lv, rx, ry, rp, rv)
+        self.gaze_data.append(record)
+        classifier = self.gaze_classifier
+        if classifier is not None:
+            classifier.update(record)
+
+        # single writer slot: the latest sample and the one before are replaced at once
+        latest = self.latest_gaze
+        self.latest_gaze = (record, latest[0] if latest is not None else None)
+        waiter = self.gaze_waiter
+        if waiter is not None:
+            waiter.set()
+
+    def on_gaze_samples(self, records):
+        """
+        Callback of the acquisition process (see <acquisition_process>), called with each block of new samples.
+
+        Usually, users don't have to call this method.
+        """
+
+        self.gaze_data.extend(records)
+        classifier = self.gaze_classifier
+        if classifier is not None:
+            for record in records.tolist():
+                classifier.update(record)
+        latest = self.latest_gaze
+        if len(records) > 1:
+            previous = records[-2].item()
+        else:
+            previous = latest[0] if latest is not None else None
+        self.latest_gaze = (records[-1].item(), previous)
+        waiter = self.gaze_waiter
+        if waiter is not None:
+            waiter.set()
+
+    def read_latest_gaze(self):
+        """
+        Get the latest gaze sample and the one before, as a tuple (record, previous record or None) of tuples
+        (t, lx, ly, lp, lv, rx, ry, rp, rv). With the acquisition process, they are read from its shared ring.
+        Returns None before the first sample.
+        Usually, users don't have to call this method.
+        """
+
+        acquisition = self.gaze_acquisition
+        if acquisition is not None:
+            return acquisition.latest()
+        return self.latest_gaze
+
+    def get_latest_gaze(self):
+        """
+        Get the latest gaze sample converted to PsychoPy coordinates, as a tuple of
+        (timestamp, left_x, left_y, right_x, right_y, x, y) where x, y is the average of valid eyes.
+        Positions are converted only once per sample, whatever the number of calls.
+        Returns None before the first sample.
+        """
+
+        latest = self.read_latest_gaze()
+        if latest is None:
+            return None
+        converted = self.latest_gaze_converted
+        if converted is not None and converted[0][0] == latest[0][0]:
+            return converted[1]
+
+        record = latest[0]
+        transform = self.get_coordinate_transform()
+        lx, ly = transform.to_psychopy_xy(record[1], record[2])
+        rx, ry = transform.to_psychopy_xy(record[5], record[6])
+        if record[4] == 0 and record[8] == 0:
+            x, y = np.nan, np.nan
+        elif record[4] == 0:
+            x, y = rx, ry
+        elif record[8] == 0:
+            x, y = lx, ly
+        else:
+            x, y = (lx + rx) / 2.0, (ly + ry) / 2.0
+        sample = (record[0], lx, ly, rx, ry, x, y)
+        self.latest_gaze_converted = (record, sample)
+        return sample
 
     def get_current_gaze_position(self):
         """
@@ -842,12 +4764,11 @@ class TaskTemplate:
         Values are numpy.nan if Tobii fails to get gaze position.
         """
 
-        if len(self.gaze_data) == 0:
+        sample = self.get_latest_gaze()
+        if sample is None:
             return np.nan, np.nan, np.nan, np.nan
         else:
-            lxy = self.get_psychopy_pos(self.gaze_data[-1][1:3])
-            rxy = self.get_psychopy_pos(self.gaze_data[-1][5:7])
-            return lxy[0], lxy[1], rxy[0], rxy[1]
+            return sample[1:5]
 
     def get_current_pupil_size(self):
         """
@@ -856,13 +4777,98 @@ class TaskTemplate:
         Values are numpy.nan if Tobii fails to get pupil size.
         """
 
-        if len(self.gaze_data) == 0:
+        latest = self.read_latest_gaze()
+        if latest is None:
             return None, None
         else:
-            return (self.gaze_data[-1][3],  # lp
-                    self.gaze_data[-1][7])  # rp
+            return (latest[0][3],  # lp
+                    latest[0][7])  # rp
+
+    def get_gaze_contingent_position(self, extrapolate=False, max_extrapolation=0.05):
+        """
+        Get the gaze position to display on the next flip, as a tuple (x, y) in window units.
+        Values are numpy.nan if Tobii fails to get gaze position.
+        Use :func:`flip_gaze_contingent` to flip, so that sample-to-display latency is measured.
+
+        :param bool extrapolate: If True, the position is linearly extrapolated from the two latest samples to the
+            expected time of the next flip. Default value is False.
+        :param float max_extrapolation: Maximum extrapolation time in seconds. Default value is 0.05.
+        """
+
+        latest = self.read_latest_gaze()
+        if latest is None:
+            return np.nan, np.nan
+        record, previous = latest
+        if (not extrapolate or previous is None or 0 in (record[4], record[8], previous[4], previous[8])
+                or record[0] <= previous[0]):
+            sample = self.get_latest_gaze()
+            self.gaze_contingent_timestamp = sample[0]
+            return sample[5], sample[6]
+
+        self.gaze_contingent_timestamp = record[0]
+        next_flip = max(0.0, self.win.lastFrameT + self.win.monitorFramePeriod - core.getTime())
+        target = self.tobii_research.get_system_time_stamp() + min(next_flip, max_extrapolation) * 1e6
+        ratio = min(target - record[0], max_extrapolation * 1e6) / (record[0] - previous[0])
+        x = (record[1] + record[5]) / 2.0
+        y = (record[2] + record[6]) / 2.0
+        x += ratio * (x - (previous[1] + previous[5]) / 2.0)
+        y += ratio * (y - (previous[2] + previous[6]) / 2.0)
+        return self.get_coordinate_transform().to_psychopy_xy(x, y)
+
+    def flip_gaze_contingent(self):
+        """
+        Flip the window, and record the latency between the gaze sample used by the last call of
+        :func:`get_gaze_contingent_position` and the flip. See :func:`get_gaze_latency_report`.
+        """
+
+        flip_time = self.win.flip()
+        if self.gaze_contingent_timestamp is not None:
+            self.gaze_latencies.append(
+                (self.tobii_research.get_system_time_stamp() - self.gaze_contingent_timestamp) / 1000.0)
+            self.gaze_contingent_timestamp = None
+        return flip_time
+
+    def get_gaze_latency_report(self):
+        """
+        Get statistics of the sample-to-display latencies measured by :func:`flip_gaze_contingent`, as a dict with
+        keys 'n', 'mean', 'median', 'p95' and 'max'. Latencies are in milliseconds.
+        """
 
-    def open_datafile(self, filename, embed_events=False):
+        latencies = np.array(self.gaze_latencies)
+        if len(latencies) == 0:
+            return {'n': 0, 'mean': np.nan, 'median': np.nan, 'p95': np.nan, 'max': np.nan}
+        return {'n': len(latencies), 'mean': latencies.mean(), 'median': np.median(latencies),
+                'p95': np.percentile(latencies, 95), 'max': latencies.max()}
+
+    def wait_for_gaze_in(self, region, timeout=float("inf")):
+        """
+        Wait until the gaze is in a region, without busy-waiting: the Tobii callback wakes this method up
+        at each new sample.
+        Returns the gaze position (x, y) in window units, or None if timeout is reached.
+
+        :param region: Object with a contains(x, y) method (e.g. a visual stimulus), or a function f(x, y)
+            returning True if the position is in the region. Positions are in window units.
+        :param float timeout: Maximum waiting time in seconds. Default is no timeout.
+        """
+
+        contains = getattr(region, 'contains', region)
+        deadline = time.time() + timeout
+        waiter = threading.Event()
+        self.gaze_waiter = waiter
+        try:
+            while True:
+                x, y = self.get_gaze_contingent_position()
+                if not np.isnan(x) and contains(x, y):
+                    return x, y
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                waiter.wait(min(remaining, 0.1))
+                waiter.clear()
+        finally:
+            self.gaze_waiter = None
+
+    def open_datafile(self, filename, embed_events=False, datafile_format=None):
         """
         Open data file.
 
@@ -870,13 +4876,29 @@ class TaskTemplate:
         :param bool embed_events: If True, event data is
             embeded in gaze data.  Otherwise, event data is
             separately output after gaze data.
+        :param str datafile_format: 'tsv' or 'npy' (see <GazeBinaryFile>).
+            Default value is <self.datafile_format>.
         """
 
         if self.datafile is not None:
             self.close_datafile()
 
+        if datafile_format is None:
+            datafile_format = self.datafile_format
         self.embed_events = embed_events
-        self.datafile = open(filename, 'w')
+        self.datafile_name = filename
+        if datafile_format == 'tsv':
+            self.datafile = open(filename, 'w')
+        elif datafile_format == 'npy':
+            self.datafile = GazeBinaryFile(filename, info={
+                'units': self.win.units,
+                'size': [int(v) for v in self.win.size],
+                'monitor_width': self.win.monitor.getWidth(),
+                'monitor_size_pix': [int(v) for v in self.win.monitor.getSizePix()],
+                'monitor_distance': self.win.monitor.getDistance(),
+            })
+        else:
+            raise ValueError('datafile_format must be \'tsv\' or \'npy\'')
 
     def close_datafile(self):
         """
@@ -900,13 +4922,42 @@ class TaskTemplate:
         if not self.recording:
             return
 
-        self.event_data.append((tobii_research.get_system_time_stamp(), event))
+        self.insert_event(self.tobii_research.get_system_time_stamp(), event)
+
+    def insert_event(self, t, event):
+        """
+        Insert an event in event data, keeping events sorted by timestamp.
+        Usually, users don't have to call this method.
+
+        :param t: Tobii's timestamp of the event.
+        :param str event: Any string.
+        """
+        with self.event_lock:
+            if len(self.event_data) == 0 or self.event_data[-1][0] <= t:
+                self.event_data.append((t, event))
+            else:
+                bisect.insort_right(self.event_data, (t, event))
+
+    def get_degrees_per_display_area(self):
+        """
+        Get the degrees of visual angle per unit of Tobii's display area in x and y, from the monitor of the
+        window (width, size in pixels and distance).
+        """
+
+        monitor = self.win.monitor
+        width = monitor.getWidth()
+        size_pix = monitor.getSizePix()
+        distance = monitor.getDistance()
+        if width is None or size_pix is None or distance is None:
+            raise ValueError("Monitor %s has no known width, size or distance (SEE MONITOR CENTER)" % monitor.name)
+        scale_x = width / (distance * 0.017455)
+        return scale_x, scale_x * size_pix[1] / size_pix[0]
 
     def flush_data(self):
         """
         Write data to the data file.
 
-        Note: This method do nothing during recording.
+        Note: This method do nothing during recording. In streaming mode, data is written by <gaze_writer> instead.
         """
 
         if self.datafile is None:
@@ -919,37 +4970,21 @@ class TaskTemplate:
         if self.recording:
             return
 
-        if self.embed_events:
-            self.datafile.write('\t'.join(['TimeStamp',
-                                           'GazePointXLeft',
-                                           'GazePointYLeft',
-                                           'PupilLeft',
-                                           'ValidityLeft',
-                                           'GazePointXRight',
-                                           'GazePointYRight',
-                                           'PupilRight',
-                                           'ValidityRight',
-                                           'GazePointX',
-                                           'GazePointY',
-                                           'Event']) + '\n')
-        else:
-            self.datafile.write('\t'.join(['TimeStamp',
-                                           'GazePointXLeft',
-                                           'GazePointYLeft',
-                                           'PupilLeft',
-                                           'ValidityLeft',
-                                           'GazePointXRight',
-                                           'GazePointYRight',
-                                           'PupilRight',
-                                           'ValidityRight',
-                                           'GazePointX',
-                                           'GazePointY']) + '\n')
-
-        format_string = '%.1f\t%.4f\t%.4f\t%.4f\t%d\t%.4f\t%.4f\t%.4f\t%d\t%.4f\t%.4f'
+        if isinstance(self.datafile, GazeBinaryFile):
+            GazeDataWriter(self.datafile, self.get_coordinate_transform(), self.shift,
+                           self.event_data).write_segment(as_gaze_array(self.gaze_data), final=True)
+            self.datafile.flush()
+            return
+
+        self.write_datafile_header()
+
+        format_string = gaze_record_format
 
         timestamp_start = self.gaze_data[0][0]
         num_output_events = 0
-        if self.embed_events:
+        if self.batch_export:
+            self.write_gaze_data_batch(timestamp_start)
+        elif self.embed_events:
             for i in range(len(self.gaze_data)):
                 if num_output_events < len(self.event_data) and self.event_data[num_output_events][0] < \
                         self.gaze_data[i][0]:
@@ -994,57 +5029,56 @@ class TaskTemplate:
 
         self.datafile.flush()
 
-    def get_psychopy_pos(self, p):
+    def write_datafile_header(self):
         """
-        Convert PsychoPy position to Tobii coordinate system.
+        Write the header line of the gaze data file.
+        Usually, users don't have to call this method.
+        """
+
+        write_tsv_header(self.datafile, self.embed_events)
 
-        :param p: Position (x, y)
+    def write_gaze_data_batch(self, timestamp_start):
         """
+        Write gaze and event data to the data file, converting whole columns at once and writing rows by blocks.
+        The output is identical to the per-record export of :func:`flush_data`.
+        Usually, users don't have to call this method.
 
-        p = (p[0], 1 - p[1])  # flip vert
-        if self.win.units == 'norm':
-            return (2 * p[0] - 1, 2 * p[1] - 1)
-        elif self.win.units == 'height':
-            return ((p[0] - 0.5) * self.win.size[0] / self.win.size[1], p[1] - 0.5)
+        :param timestamp_start: Tobii's timestamp when recording was started.
+        """
 
-        p_pix = ((p[0] - 0.5) * self.win.size[0], (p[1] - 0.5) * self.win.size[1])
-        if self.win.units == 'pix':
-            return p_pix
-        elif self.win.units == 'cm':
-            return (pix2cm(p_pix[0], self.win.monitor), pix2cm(p_pix[1], self.win.monitor))
-        elif self.win.units == 'deg':
-            return (pix2deg(p_pix[0], self.win.monitor), pix2deg(p_pix[1], self.win.monitor))
-        elif self.win.units in ['degFlat', 'degFlatPos']:
-            return (pix2deg(np.array(p_pix), self.win.monitor, correctFlat=True))
-        else:
-            raise ValueError('unit ({}) is not supported.'.format(self.win.units))
+        writer = GazeDataWriter(self.datafile, self.get_coordinate_transform(), self.shift, self.event_data,
+                                self.embed_events, timestamp_start)
+        writer.write_segment(as_gaze_array(self.gaze_data), final=True)
 
-    def get_tobii_pos(self, p):
+    def get_coordinate_transform(self):
+        """
+        Get the <CoordinateTransform> of the window. It is built once, and again only if units or size of the
+        window change.
+        """
+
+        key = (self.win.units, tuple(self.win.size), id(self.win.monitor))
+        if self.coordinate_transform is None or self.coordinate_transform_key != key:
+            self.coordinate_transform = CoordinateTransform.from_window(self.win)
+            self.coordinate_transform_key = key
+        return self.coordinate_transform
+
+    def get_psychopy_pos(self, p):
         """
         Convert Tobii position to PsychoPy coordinate system.
 
-        :param p: Position (x, y)
-        """
-
-        if self.win.units == 'norm':
-            gp = ((p[0] + 1) / 2, (p[1] + 1) / 2)
-        elif self.win.units == 'height':
-            gp = (p[0] * self.win.size[1] / self.win.size[0] + 0.5, p[1] + 0.5)
-        elif self.win.units == 'pix':
-            gp = (p[0] / self.win.size[0] + 0.5, p[1] / self.win.size[1] + 0.5)
-        elif self.win.units == 'cm':
-            p_pix = (cm2pix(p[0], self.win.monitor), cm2pix(p[1], self.win.monitor))
-            gp = (p_pix[0] / self.win.size[0] + 0.5, p_pix[1] / self.win.size[1] + 0.5)
-        elif self.win.units == 'deg':
-            p_pix = (deg2pix(p[0], self.win.monitor), deg2pix(p[1], self.win.monitor))
-            gp = (p_pix[0] / self.win.size[0] + 0.5, p_pix[1] / self.win.size[1] + 0.5)
-        elif self.win.units in ['degFlat', 'degFlatPos']:
-            p_pix = (deg2pix(np.array(p), self.win.monitor, correctFlat=True))
-            gp = (p_pix[0] / self.win.size[0] + 0.5, p_pix[1] / self.win.size[1] + 0.5)
-        else:
-            raise ValueError('unit ({}) is not supported'.format(self.win.units))
+        :param p: Position (x, y). x and y can also be arrays.
+        """
+
+        return self.get_coordinate_transform().to_psychopy_xy(p[0], p[1])
+
+    def get_tobii_pos(self, p):
+        """
+        Convert PsychoPy position to Tobii coordinate system.
+
+        :param p: Position (x, y). x and y can also be arrays.
+        """
 
-        return (gp[0], 1 - gp[1])  # flip vert
+        return self.get_coordinate_transform().to_tobii_xy(p[0], p[1])
 
     def convert_tobii_record(self, record, start_time):
         """
@@ -1072,6 +5106,22 @@ class TaskTemplate:
                 rxy[0], rxy[1], record[7], record[8],
                 ave[0], ave[1])
 
+    def convert_tobii_records(self, records, start_time, transform=None):
+        """
+        Convert an array of tobii data to output style, one column at a time.
+        Vectorized version of :func:`convert_tobii_record` (see :func:`convert_gaze_records`).
+        Usually, users don't have to call this method.
+
+        :param records: structured array of gaze records (see <gaze_dtype>).
+        :param start_time: Tobii's timestamp when recording was started.
+        :param transform: <CoordinateTransform> to use. Default is the one of the window.
+        :return: list of the 11 output columns.
+        """
+
+        if transform is None:
+            transform = self.get_coordinate_transform()
+        return convert_gaze_records(records, start_time, transform)
+
     def interpolate_gaze_data(self, record1, record2, t):
         """
         Interpolate gaze data between record1 and record2.
@@ -1101,9 +5151,9 @@ class TaskTemplate:
         # right eye
         if record1[8] == 0 and record2[8] == 0:
             rdata = record1[5:9]
-        elif record1[4] == 0:
+        elif record1[8] == 0:
             rdata = record2[5:9]
-        elif record2[4] == 0:
+        elif record2[8] == 0:
             rdata = record1[5:9]
         else:
             rdata = (w1 * record1[5] + w2 * record2[5],
@@ -1113,11 +5163,67 @@ class TaskTemplate:
 
         return (t,) + ldata + rdata
 
+    def interpolate_gaze_records(self, records, positions, t):
+        """
+        Interpolate gaze data at several timestamps at once (see :func:`interpolate_gaze_records`).
+        Usually, users don't have to call this method.
+
+        :param records: structured array of gaze records (see <gaze_dtype>).
+        :param positions: index of the record following each timestamp.
+        :param t: timestamps to calculate interpolation.
+        """
+
+        return interpolate_gaze_records(records, positions, t)
+
     def task(self, no_trial):
         """Method to overwrite to implement your cognitive task.
         :param no_trial: Trial number (starting from 0).
         """
 
+    def prepare_trial(self, no_trial):
+        """Method to overwrite to prepare a trial in advance: it is run in a worker thread while the previous trial
+        is running, and its return value is given by :func:`get_prepared_trial` in <task>.
+        Heavy work goes here: choosing and decoding images (e.g. with get_image_pipeline().get_texture), computing
+        positions, AOI geometry... PsychoPy stimuli must not be created here, since OpenGL can only be used from the
+        main thread: create them in <task> from the prepared data (see create_visual_image and StimulusCache).
+        Random draws must use the generator of :func:`get_trial_random` (also for StimulusCatalog.sample), not the
+        random modules or the generator of the stimulus catalog: <task> uses them at the same time in the main
+        thread, so draws would change from run to run.
+        :param no_trial: Trial number (starting from 0).
+        """
+
+    def get_trial_random(self, no_trial):
+        """
+        Get a random generator for a trial, seeded from <session_seed> and the trial number: it gives the same draws
+        whenever the trial is prepared, and in a resumed session.
+
+        :param no_trial: Trial number (starting from 0).
+        :return: numpy.random.RandomState.
+        """
+        return np.random.RandomState([self.session_seed, no_trial])
+
+    def prefetch_trial(self, no_trial):
+        """
+        Start preparing a trial in the worker thread (see :func:`prepare_trial`), if it is not already.
+        Usually, users don't have to call this method.
+        """
+        if no_trial in self.prepared_trials or no_trial >= self.trials:
+            return
+        if self.trial_executor is None:
+            self.trial_executor = concurrent.futures.ThreadPoolExecutor(max_workers=1,
+                                                                        thread_name_prefix='prepare_trial')
+        self.prepared_trials[no_trial] = self.trial_executor.submit(self.prepare_trial, no_trial)
+
+    def get_prepared_trial(self, no_trial):
+        """
+        Get the return value of :func:`prepare_trial` for a trial, waiting for it if it is not ready yet (it is then
+        prepared now if it was not prefetched). Exceptions raised by prepare_trial are raised here.
+        :param no_trial: Trial number (starting from 0).
+        """
+        if no_trial not in self.prepared_trials:
+            return self.prepare_trial(no_trial)
+        return self.prepared_trials[no_trial].result()
+
     def example(self):
         """Method to overwrite to implement an example in your cognitive task. Will be launch only if
         <self.launch_example> is True.
@@ -1125,6 +5231,7 @@ class TaskTemplate:
 
     def start(self):
         if self.eye_tracker_study:
+            self.set_frame_phase('calibration')
             self.open_datafile(f"csv_eyetracker/{self.file_name}.tsv", embed_events=False)
             self.set_calibration_keymap({'num_7': 0, 'num_9': 1, 'num_5': 2, 'num_1': 3, 'num_3': 4})
             self.show_status()
@@ -1132,7 +5239,7 @@ class TaskTemplate:
 
             if ret == "abort":
                 sys.exit()
-            marker = visual.Rect(self.win, size=(0.01, 0.01))
+            marker = self.visual.Rect(self.win, size=(0.01, 0.01))
             # recording starts just after calibration, when we can see the marker (rectangle) representing gaze
             self.subscribe()
 
@@ -1148,7 +5255,7 @@ class TaskTemplate:
                     marker.setLineColor('white')
                 else:
                     marker.setLineColor('red')
-                keys = event.getKeys()
+                keys = self.event.getKeys()
                 if 'space' in keys:
                     waitkey = False
                 elif len(keys) >= 1:
@@ -1159,22 +5266,29 @@ class TaskTemplate:
                 self.win.flip()
             self.unsubscribe()
 
+        self.index_stimuli()
+        if self.preload_images_at_start:
+            self.preload_images()
+        self.prefetch_trial(0)
+        self.set_frame_phase('instructions')
         self.win.winHandle.set_fullscreen(True)
         self.win.flip()
         self.win.mouseVisible = False
-        self.create_visual_text(self.welcome, color=self.text_color).draw()
+        self.create_visual_text(self.welcome, color=self.text_color, cache=True).draw()
         self.win.flip()
         core.wait(2)
-        next = self.create_visual_text(self.next, (0, -0.4), 0.04, color=self.text_color)
-        flag = self.create_visual_text(self.flag, (0, 0.4), 0.04, color=self.text_color)
+        next = self.create_visual_text(self.next, (0, -0.4), 0.04, color=self.text_color, cache=True)
+        flag = self.create_visual_text(self.flag, (0, 0.4), 0.04, color=self.text_color, cache=True)
         for instr in self.instructions:
-            self.create_visual_text(instr, font_size=self.font_size_instr, color=self.text_color).draw()
+            self.create_visual_text(instr, font_size=self.font_size_instr, color=self.text_color, cache=True).draw()
             next.draw()
             self.win.flip()
             self.wait_yes(self.yes_key_code)
         if self.launch_example:
+            self.set_frame_phase('example')
             self.example()
-        self.create_visual_text(self.good_luck, color=self.text_color).draw()
+            self.set_frame_phase('instructions')
+        self.create_visual_text(self.good_luck, color=self.text_color, cache=True).draw()
         flag.draw()
         self.win.flip()
         self.wait_yes(self.flag_code)
@@ -1182,9 +5296,71 @@ class TaskTemplate:
             self.subscribe()
         self.win.flip()
         core.wait(2)
-        for i in range(self.trials):
-            self.task(i)
-        self.create_visual_text(self.end, color=self.text_color).draw()
+        self.run_trials(0)
+
+    def resume(self):
+        """
+        Continue a session from its journal (see the <resume_from> parameter of the constructor), at the next
+        unfinished trial: instructions, example and calibration are not repeated. The random generators are restored
+        to their state at the start of that trial before anything else; the trial is then prepared again with the
+        same draws, since :func:`prepare_trial` uses the generator of :func:`get_trial_random` and the session seed
+        of the journal. Gaze data is recorded in a new file, <file_name>_resume<n>.tsv, and the AOI and frame CSV
+        files are continued.
+        """
+        self.index_stimuli()
+        if self.resume_state is not None:
+            SessionJournal.set_random_state(self.resume_state, self.get_catalog_generator())
+        self.journal.flush()
+        n = sum(1 for entry in SessionJournal.load(self.journal.filename) if entry['type'] == 'resume')
+        if self.eye_tracker_study:
+            self.open_datafile(f"csv_eyetracker/{self.file_name}_resume{n}.tsv", embed_events=False)
+        self.prefetch_trial(self.resume_trial)
+        self.win.winHandle.set_fullscreen(True)
+        self.win.mouseVisible = False
+        self.create_visual_text(self.good_luck, color=self.text_color, cache=True).draw()
+        self.create_visual_text(self.flag, (0, 0.4), 0.04, color=self.text_color, cache=True).draw()
+        self.win.flip()
+        self.wait_yes(self.flag_code)
+        if self.eye_tracker_study:
+            self.subscribe()
+        self.win.flip()
+        core.wait(2)
+        self.run_trials(self.resume_trial)
+
+    def run_trials(self, first_trial):
+        """
+        Run the trials from <first_trial>, recording them in the journal, then end the experiment.
+        Usually, users don't have to call this method.
+        """
+        for i in range(first_trial, self.trials):
+            self.journal.write('trial_start', trial=i,
+                               random_state=SessionJournal.get_random_state(self.get_catalog_generator()))
+            self.trial_rows = []
+            self.trial_gaze_start = len(self.gaze_data)
+            # trial i+1 is prepared while trial i runs
+            self.prefetch_trial(i + 1)
+            for procedure in self.adaptive_procedures.values():
+                procedure.next_intensity()
+            self.set_frame_phase('task', i)
+            try:
+                self.task(i)
+            except Exception as e:
+                self.journal.write('error', trial=i, error=repr(e))
+                # gaze data and events recorded so far are written before the exception ends the session
+                if self.recording:
+                    self.unsubscribe()
+                    self.close_datafile()
+                self.journal.flush()
+                raise
+            # states are saved first, so that every trial finished in the journal has its responses in them
+            self.save_adaptive_procedures()
+            self.journal.write('trial_end', trial=i, rows=self.trial_rows, gaze_file=self.datafile_name,
+                               gaze_samples=[self.trial_gaze_start, len(self.gaze_data)],
+                               gaze_written=self.gaze_writer.samples_written if self.gaze_writer is not None else 0)
+            self.prepared_trials.pop(i, None)
+        self.journal.write('end')
+        self.set_frame_phase('end')
+        self.create_visual_text(self.end, color=self.text_color, cache=True).draw()
         self.win.flip()
         core.wait(60)
         self.dataFile.close()
@@ -1192,3 +5368,11 @@ class TaskTemplate:
             self.unsubscribe()
             self.close_datafile()
         self.quit_experiment()
+
+    def get_catalog_generator(self):
+        """
+        Get the random generator of the stimulus catalog, saved in the journal with the global ones, or None if the
+        catalog is not used.
+        Usually, users don't have to call this method.
+        """
+        return self.stimulus_catalog.random if self.stimulus_catalog is not None else None
@@ -0,0 +1,42 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from task_template import gaze_dtype
+
+
+@pytest.fixture
+def make_records():
+    """
+    Factory of synthetic gaze records: fixations on random points with noise, saccades between them, blinks, single
+    eye dropouts, and a few repeated timestamps, as (n, rate, seed) -> structured array (see <gaze_dtype>).
+    """
+    def make(n, rate=600, seed=0):
+        random = np.random.RandomState(seed)
+        records = np.zeros(n, dtype=gaze_dtype)
+        records['t'] = 10 ** 12 + np.round(np.arange(n) * 1e6 / rate).astype(np.int64)
+        repeated = random.uniform(size=n) < 0.01
+        repeated[0] = False
+        records['t'][repeated] = records['t'][np.nonzero(repeated)[0] - 1]
+        ends = np.cumsum(random.uniform(0.15, 0.45, n // int(rate * 0.15) + 2) * rate).astype(np.int64)
+        points = random.uniform(0.1, 0.9, (len(ends) + 1, 2))
+        fixation = np.searchsorted(ends, np.arange(n), 'right')
+        # gaze moves to the next point during the first 30 ms of each fixation
+        start = np.r_[0, ends][fixation]
+        progress = np.clip((np.arange(n) - start) / (rate * 0.03), 0, 1)[:, np.newaxis]
+        previous = points[np.maximum(fixation - 1, 0)]
+        position = previous + (points[fixation] - previous) * progress
+        blink = np.convolve(random.uniform(size=n) < 0.3 / rate, np.ones(int(rate * 0.15)), 'same') > 0
+        for eye, offset in (('l', -0.005), ('r', 0.005)):
+            valid = ~blink & (random.uniform(size=n) >= 0.01)
+            records[eye + 'v'] = valid
+            records[eye + 'x'] = np.where(valid, position[:, 0] + offset + random.normal(0, 0.001, n), np.nan)
+            records[eye + 'y'] = np.where(valid, position[:, 1] + random.normal(0, 0.001, n), np.nan)
+            records[eye + 'p'] = np.where(valid, random.uniform(3, 4, n), np.nan)
+        return records
+
+    return make
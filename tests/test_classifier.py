@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from task_template import GazeEventClassifier, gaze_dtype
+
+
+@pytest.mark.parametrize('rate', [60, 120, 300, 600, 1200])
+def test_online_classification_gives_the_batch_events(make_records, rate):
+    records = make_records(rate * 20, rate, seed=rate)
+    classifier = GazeEventClassifier(30.0, (40.0, 30.0))
+    for record in records.tolist():
+        classifier.update(record)
+    classifier.finish()
+
+    events = GazeEventClassifier(30.0, (40.0, 30.0)).classify(records)
+    assert events == classifier.events
+    assert sum(1 for t, name in events if name == 'fixation_start') > 20
+
+
+def test_events_are_paired_and_fixations_are_long_enough(make_records):
+    events = GazeEventClassifier(30.0, (40.0, 30.0), min_fixation_duration=60000).classify(make_records(12000))
+    starts = {}
+    for t, name in events:
+        label, edge = name.split('_')
+        if edge == 'start':
+            assert not starts
+            starts[label] = t
+        else:
+            start = starts.pop(label)
+            assert t >= start
+            if label == 'fixation':
+                assert t - start >= 60000
+    assert not starts
+
+
+def test_no_records_give_no_events():
+    assert GazeEventClassifier().classify(np.zeros(0, dtype=gaze_dtype)) == []
@@ -0,0 +1,70 @@
+import io
+import types
+
+import numpy as np
+import pytest
+
+from task_template import TaskTemplate, GazeBinaryFile, GazeBuffer, export_tsv
+
+units = ['norm', 'height', 'pix', 'cm', 'deg', 'degFlat', 'degFlatPos']
+
+
+class Monitor:
+    name = 'test'
+
+    def getWidth(self):
+        return 53.0
+
+    def getSizePix(self):
+        return [1920, 1080]
+
+    def getDistance(self):
+        return 60.0
+
+
+def make_task(records, units, n_events=300, seed=0):
+    task = TaskTemplate.__new__(TaskTemplate)
+    task.win = types.SimpleNamespace(units=units, size=np.array([1920, 1080]), monitor=Monitor())
+    task.shift = 1.2345
+    task.recording = False
+    task.gaze_data = GazeBuffer(256)
+    task.gaze_data.extend(records)
+    random = np.random.RandomState(seed)
+    t = records['t']
+    events = sorted(random.randint(t[0] - 5000, t[-1] + 5000, n_events).tolist())
+    # events before the first sample, between the same samples and at the time of a sample
+    events += [int(t[0]) - 1] * 3 + [int(t[len(t) // 2]) + 1] * 5 + [int(t[len(t) // 3])]
+    task.event_data = [(e, 'event{}'.format(k)) for k, e in enumerate(sorted(events))]
+    return task
+
+
+def export(task, embed_events, batch_export):
+    task.embed_events = embed_events
+    task.batch_export = batch_export
+    task.datafile = io.StringIO()
+    task.flush_data()
+    return task.datafile.getvalue()
+
+
+@pytest.mark.parametrize('embed_events', [False, True])
+@pytest.mark.parametrize('units', units)
+def test_batch_export_is_identical_to_per_record_export(make_records, units, embed_events):
+    task = make_task(make_records(2000), units)
+    batch = export(task, embed_events, True)
+    assert batch == export(task, embed_events, False)
+    assert len(batch.splitlines()) > 2000
+
+
+@pytest.mark.parametrize('embed_events', [False, True])
+def test_binary_file_exports_the_same_tsv(make_records, tmp_path, embed_events):
+    task = make_task(make_records(2000), 'height')
+    expected = export(task, embed_events, True)
+
+    task.datafile = GazeBinaryFile(str(tmp_path / 'gaze.npy'), info={
+        'units': 'height', 'size': [1920, 1080], 'monitor_width': 53.0, 'monitor_size_pix': [1920, 1080],
+        'monitor_distance': 60.0})
+    task.flush_data()
+    task.datafile.close()
+    export_tsv(str(tmp_path / 'gaze.npy'), str(tmp_path / 'gaze.tsv'), embed_events)
+    with open(str(tmp_path / 'gaze.tsv')) as f:
+        assert f.read() == expected
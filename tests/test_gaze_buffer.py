@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from task_template import GazeBuffer, gaze_dtype
+
+
+def assert_same(records, expected):
+    # missing eyes are NaN, which are not equal to themselves
+    assert records.dtype == expected.dtype
+    assert records.tobytes() == expected.tobytes()
+
+
+def assert_same_sample(sample, record):
+    assert_same(np.array([sample], dtype=gaze_dtype), record.reshape(1))
+
+
+def test_samples_are_read_back_across_chunks(make_records):
+    records = make_records(1000)
+    buffer = GazeBuffer(64)
+    for record in records[:300].tolist():
+        buffer.append(record)
+    buffer.extend(records[300:])
+
+    assert len(buffer) == 1000
+    assert_same_sample(buffer[0], records[0])
+    assert_same_sample(buffer[-1], records[-1])
+    assert buffer[130][0] == records['t'][130]
+    assert_same(buffer.read(50, 700), records[50:700])
+    assert_same(buffer.to_array(), records)
+    assert len(buffer.read(900, 2000)) == 100
+    assert len(buffer.read(10, 10)) == 0
+    with pytest.raises(IndexError):
+        buffer[1000]
+
+
+def test_release_frees_whole_chunks_only(make_records):
+    records = make_records(1000)
+    buffer = GazeBuffer(64)
+    buffer.extend(records)
+    chunks = buffer.nbytes()
+
+    buffer.release(200)
+    assert buffer.released == 192
+    assert buffer.nbytes() == chunks - 3 * 64 * records.itemsize
+    assert_same(buffer.read(192, 1000), records[192:])
+    assert_same_sample(list(buffer)[0], records[192])
+    with pytest.raises(IndexError):
+        buffer.read(191, 300)
+    with pytest.raises(IndexError):
+        buffer[100]
+
+    # released samples are never read again, and the chunk of the latest sample is kept
+    buffer.release(100)
+    assert buffer.released == 192
+    buffer.release(5000)
+    assert buffer.released == 960
+    assert_same_sample(buffer[-1], records[-1])
+    buffer.append(records[0].item())
+    assert len(buffer) == 1001
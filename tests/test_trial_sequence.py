@@ -0,0 +1,59 @@
+import collections
+
+import pytest
+
+from task_template import TrialSequence, balanced_latin_square
+
+conditions = {'word': ['a', 'b', 'c', 'd'], 'answer': ['y', 'n', 'y', 'n']}
+
+
+def longest_run(values):
+    longest = run = 1
+    for previous, value in zip(values, values[1:]):
+        run = run + 1 if value == previous else 1
+        longest = max(longest, run)
+    return longest
+
+
+def test_blocks_hold_every_condition():
+    sequence = TrialSequence(conditions, repetitions=3, blocks=4, participant=2)
+    assert len(sequence) == 48
+    for block in range(4):
+        counts = collections.Counter(t['word'] for t in sequence.trials if t['block'] == block)
+        assert counts == {'a': 3, 'b': 3, 'c': 3, 'd': 3}
+    assert [t['trial'] for t in sequence.trials] == list(range(48))
+    assert sequence[5]['answer'] == conditions['answer'][sequence[5]['condition']]
+
+
+def test_participant_gets_the_same_plan():
+    plan = [t['condition'] for t in TrialSequence(conditions, repetitions=3, blocks=2, participant='7').trials]
+    assert plan == [t['condition'] for t in TrialSequence(conditions, repetitions=3, blocks=2, participant='7').trials]
+    assert plan != [t['condition'] for t in TrialSequence(conditions, repetitions=3, blocks=2, participant='8').trials]
+
+
+def test_blocked_design_follows_the_latin_square():
+    for participant in range(4):
+        sequence = TrialSequence(conditions, repetitions=2, blocks=2, block_factor='answer', participant=participant)
+        levels = [sequence.trials[block * 4]['answer'] for block in range(4)]
+        assert all(len({t['answer'] for t in sequence.trials if t['block'] == block}) == 1 for block in range(4))
+        assert levels == [['y', 'n'][level] for level in balanced_latin_square(2, participant)] * 2
+
+
+@pytest.mark.parametrize('max_repeats', [1, 2, 3])
+@pytest.mark.parametrize('seed', range(20))
+def test_runs_are_limited_across_blocks(max_repeats, seed):
+    sequence = TrialSequence(conditions, repetitions=3, blocks=4, max_repeats=max_repeats, repeat_factor='answer',
+                             seed=seed)
+    assert longest_run([t['answer'] for t in sequence.trials]) <= max_repeats
+    for block in range(4):
+        assert sorted(t['condition'] for t in sequence.trials if t['block'] == block) == sorted(list(range(4)) * 3)
+
+
+def test_tight_designs_are_ordered():
+    sequence = TrialSequence({'c': [0, 1]}, repetitions=10, blocks=5, max_repeats=1, repeat_factor='c')
+    assert longest_run([t['c'] for t in sequence.trials]) == 1
+
+
+def test_impossible_designs_raise():
+    with pytest.raises(ValueError):
+        TrialSequence({'c': [0, 0, 0, 1]}, repetitions=2, max_repeats=1, repeat_factor='c')
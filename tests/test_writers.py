@@ -0,0 +1,84 @@
+import csv
+import random
+
+import numpy as np
+import pytest
+
+from task_template import CsvWriter, SessionJournal
+
+
+def read_rows(filename):
+    with open(filename, newline='') as f:
+        return list(csv.reader(f))
+
+
+def test_csv_rows_are_written_in_order_and_quoted(tmp_path):
+    filename = str(tmp_path / 'trials.csv')
+    writer = CsvWriter(filename, ['trial', 'response', 'rt'], fsync='batch')
+    for i in range(100):
+        writer.write_row([i, 'yes, "sure"' if i == 3 else 'no', 0.5])
+    writer.flush()
+    assert len(read_rows(filename)) == 101
+    writer.write(lambda: '100,late,0.1\n')
+    writer.close()
+    writer.close()
+
+    rows = read_rows(filename)
+    assert rows[0] == ['trial', 'response', 'rt']
+    assert [row[0] for row in rows[1:]] == [str(i) for i in range(101)]
+    assert rows[4] == ['3', 'yes, "sure"', '0.5']
+    assert rows[-1] == ['100', 'late', '0.1']
+
+
+def test_csv_writer_checks_rows_and_policy(tmp_path):
+    writer = CsvWriter(str(tmp_path / 'trials.csv'), ['trial', 'response'], fsync=None)
+    with pytest.raises(ValueError):
+        writer.write_row([1])
+    writer.close()
+    with pytest.raises(ValueError):
+        writer.write_row([1, 'yes'])
+    with pytest.raises(ValueError):
+        CsvWriter(str(tmp_path / 'other.csv'), fsync='always')
+
+
+def test_csv_append_writes_headers_once(tmp_path):
+    filename = str(tmp_path / 'aoi.csv')
+    for i in range(3):
+        writer = CsvWriter(filename, ['trial'], fsync='close', append=True)
+        writer.write_row([i])
+        writer.close()
+    assert read_rows(filename) == [['trial'], ['0'], ['1'], ['2']]
+
+
+def test_journal_entries_are_read_back(tmp_path):
+    filename = str(tmp_path / 'journal.jsonl')
+    journal = SessionJournal(filename)
+    journal.write('session', participant='p1', trials=2)
+    journal.write('trial_end', trial=0, rows=[['0', 'yes']])
+    journal.flush()
+    assert [entry['type'] for entry in SessionJournal.load(filename)] == ['session', 'trial_end']
+    journal.close()
+
+    # a journal cut by a crash is continued after its last complete entry
+    with open(filename, 'a') as f:
+        f.write('{"type": "trial_end", "tri')
+    assert len(SessionJournal.load(filename)) == 2
+    journal = SessionJournal(filename)
+    journal.write('resume', trial=1)
+    journal.close()
+    entries = SessionJournal.load(filename)
+    assert [entry['type'] for entry in entries] == ['session', 'trial_end', 'resume']
+    assert entries[1]['rows'] == [['0', 'yes']]
+    assert all('time' in entry for entry in entries)
+
+
+def test_journal_restores_random_states(tmp_path):
+    generator = random.Random(3)
+    state = SessionJournal.get_random_state(generator)
+    journal = SessionJournal(str(tmp_path / 'journal.jsonl'))
+    journal.write('trial_start', trial=0, random_state=state)
+    journal.close()
+    expected = random.random(), np.random.randint(10 ** 6), generator.random()
+
+    SessionJournal.set_random_state(SessionJournal.load(journal.filename)[0]['random_state'], generator)
+    assert (random.random(), np.random.randint(10 ** 6), generator.random()) == expected